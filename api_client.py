@@ -1,56 +1,238 @@
 from config import Config
+from instrumentation import Instrumentation, instrumented
 import logging
 import streamlit as st
 import requests
+from http_session import HTTPSession
+import codecs
+import contextvars
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
 from datetime import datetime, time
-from typing import List, Dict, Any, Optional
+from urllib.parse import urlparse
+from typing import List, Dict, Any, Callable, Iterable, NamedTuple, Optional, Iterator, Tuple
+
+class StationResults(NamedTuple):
+    results: Dict[str, Any]             # station -> value returned
+    errors: Dict[str, Exception]        # station -> exception raised, TimeoutError if it did not answer in time
 
 class APIClient:
-  
-    # request info from a specific date (timestamp from midnight of that day)
+    """
+    Client of one station, a Raspberry Pi recorder serving the API at
+    `api_base`. Stations are listed in Config.STATIONS (name -> API base),
+    the first one is the default station. Every request goes through the
+    shared HTTPSession with the station as circuit, so an unreachable
+    station fails fast without affecting the others.
+    """
+
+    # shared by every session, per-station calls of APIClient.fan_out
+    _pool = ThreadPoolExecutor(max_workers=Config.STATION_MAX_WORKERS, thread_name_prefix="station")
+
+    def __init__(self, station: str, api_base: str):
+        self.station = station
+        self.api_base = api_base
+
+    def __repr__(self) -> str:
+        return f"APIClient({self.station!r}, {self.api_base!r})"
+
+    @property
+    def host(self) -> str:
+        return urlparse(self.api_base).hostname or self.api_base
+
+    @staticmethod
+    def stations(names: Optional[Iterable[str]] = None) -> List["APIClient"]:
+        """Clients of the given stations (every station by default), in Config.STATIONS order"""
+        names = None if names is None else set(names)
+        return [APIClient(name, api_base) for name, api_base in Config.STATIONS.items()
+                if names is None or name in names]
+
     @staticmethod
-    def fetch_detections(start_date: datetime.date, end_date: datetime.date) -> List[Dict[str, Any]]:
+    def station(name: Optional[str] = None) -> "APIClient":
+        """Client of the station `name`, of the default station if None"""
+        name = name or next(iter(Config.STATIONS))
+        return APIClient(name, Config.STATIONS[name])
+
+    @staticmethod
+    def fan_out(call: Callable[["APIClient"], Any], stations: Optional[Iterable[str]] = None,
+                timeout: Optional[float] = None) -> StationResults:
+        """
+        Run `call(client)` for every station concurrently and wait at most
+        `timeout` seconds (Config.STATION_TIMEOUT by default). Stations that
+        raise or are still running are reported in `errors`; a late call
+        keeps running in background but is not waited for.
+        """
+        timeout = Config.STATION_TIMEOUT if timeout is None else timeout
+        clients = APIClient.stations(stations)
+        # each call runs in a copy of the caller's context, so it reports to the same rerun trace
+        futures = {
+            client.station: APIClient._pool.submit(contextvars.copy_context().run, call, client)
+            for client in clients
+        }
+        wait(futures.values(), timeout=timeout)
+
+        outcome = StationResults({}, {})
+        for station, future in futures.items():
+            if not future.done():
+                logging.warning(f"Station {station} did not answer in time")
+                outcome.errors[station] = TimeoutError(f"no answer within {timeout}s")
+            elif future.exception() is not None:
+                logging.error(f"Station {station} failed: {future.exception()}")
+                outcome.errors[station] = future.exception()
+            else:
+                outcome.results[station] = future.result()
+        return outcome
+
+    def _get(self, endpoint: str, path: str, **kwargs) -> requests.Response:
+        return HTTPSession.get(f"{self.station}/{endpoint}", f"{self.api_base}{path}", circuit=self.station, **kwargs)
+
+    # request info from a specific date (timestamp from midnight of that day)
+    def fetch_detections(self, start_date: datetime.date, end_date: datetime.date) -> List[Dict[str, Any]]:
         # combine the date with a time of midnight (00:00:00)
         start_ts = int(datetime.combine(start_date, time.min).timestamp())
         end_ts = int(datetime.combine(end_date, time.max).timestamp())
+        return self.fetch_detections_between(start_ts, end_ts) or []
+
+    # request info between two unix timestamps, None means the request failed
+    @instrumented("api.detections")
+    def fetch_detections_between(self, start_ts: int, end_ts: int) -> Optional[List[Dict[str, Any]]]:
         try:
-            response = requests.get(
-                f"{Config.API_BASE}/birds/classifications",
+            response = self._get(
+                "classifications",
+                "/birds/classifications",
                 params={"since": start_ts, "until": end_ts}, 
                 timeout=Config.REQUEST_TIMEOUT
             )
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
-            logging.error(f"Error fetching detections: {e}")
-            st.error(f"Error while fetching info: {e}")
-            return []
+            logging.error(f"Error fetching detections from {self.station}: {e}")
+            st.error(f"Error while fetching info from {self.station}: {e}")
+            return None
     
+    # split [start_ts, end_ts] in windows and fetch them concurrently,
+    # yielding ((since, until), records) as soon as each window is parsed
+    def stream_detections(self, start_ts: int, end_ts: int,
+                          window_seconds: int = None,
+                          max_workers: int = None) -> Iterator[Tuple[Tuple[int, int], List[Dict[str, Any]]]]:
+        window_seconds = window_seconds or Config.STREAM_WINDOW_SECONDS
+        max_workers = max_workers or Config.STREAM_MAX_WORKERS
+        windows = [
+            (since, min(since + window_seconds - 1, end_ts))
+            for since in range(start_ts, end_ts + 1, window_seconds)
+        ]
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(windows) or 1)) as pool:
+            # each worker runs in a copy of the caller's context, so it reports to the same rerun trace
+            futures = {
+                pool.submit(contextvars.copy_context().run, self._fetch_window, *window): window
+                for window in windows
+            }
+            try:
+                for future in as_completed(futures):
+                    yield futures[future], future.result()
+            except (requests.exceptions.RequestException, ValueError) as e:
+                logging.error(f"Error streaming detections from {self.station}: {e}")
+                for future in futures:
+                    future.cancel()
+                raise
+
+    @instrumented("api.detections_window")
+    def _fetch_window(self, since: int, until: int) -> List[Dict[str, Any]]:
+        with self._get(
+            "classifications",
+            "/birds/classifications",
+            params={"since": since, "until": until},
+            timeout=Config.REQUEST_TIMEOUT,
+            stream=True
+        ) as response:
+            response.raise_for_status()
+            return list(APIClient._iter_json_array(APIClient._count_bytes(response.iter_content(chunk_size=Config.STREAM_CHUNK_SIZE))))
+
+    @staticmethod
+    def _count_bytes(chunks: Iterator[bytes]) -> Iterator[bytes]:
+        for chunk in chunks:
+            Instrumentation.count("bytes", len(chunk))
+            yield chunk
+
+    # incremental parser for a JSON array of objects: the raw payload is never
+    # held in memory, only the chunk currently being decoded. Raises ValueError
+    # unless the whole array, closing "]" included, was received
     @staticmethod
-    def fetch_system_metrics() -> Optional[Dict[str, Any]]:
+    def _iter_json_array(chunks: Iterator[bytes]) -> Iterator[Dict[str, Any]]:
+        decoder = json.JSONDecoder()
+        text_decoder = codecs.getincrementaldecoder("utf-8")()
+        buffer = ""
+        opened = False
+        for chunk in chunks:
+            buffer += text_decoder.decode(chunk)
+            if not opened:
+                buffer = buffer.lstrip(" \t\r\n")
+                if not buffer:
+                    continue
+                if buffer[0] != "[":
+                    raise ValueError(f"Detections payload is not a JSON array: {buffer[:80]!r}")
+                buffer, opened = buffer[1:], True
+            start = len(buffer) - len(buffer.lstrip(" \t\r\n,"))
+            end = buffer.rfind("}") + 1
+            if end <= start:
+                continue
+            try:
+                # fast path: every complete element of the chunk in one C-level call
+                yield from json.loads("[" + buffer[start:end] + "]")
+                pos = end
+            except json.JSONDecodeError:
+                # "}" inside a string or a nested object, decode element by element
+                pos = start
+                while True:
+                    while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                        pos += 1
+                    try:
+                        record, pos = decoder.raw_decode(buffer, pos)
+                    except json.JSONDecodeError:
+                        break   # element split across chunks, wait for the next one
+                    yield record
+            buffer = buffer[pos:]
+        buffer += text_decoder.decode(b"", final=True)
+        if not opened or buffer.strip(" \t\r\n,") != "]":
+            raise ValueError(f"Truncated or invalid detections payload: {buffer[:80]!r}")
+
+    def fetch_system_metrics(self) -> Optional[Dict[str, Any]]:
         try:
-            response = requests.get(
-                f"{Config.API_BASE}/system_metrics", 
-                timeout=Config.REQUEST_TIMEOUT
-            )
-            response.raise_for_status()  
-            return response.json()
+            return self.system_metrics()
         except requests.exceptions.RequestException as e:
-            logging.error(f"Error while fetching system metrics: {e}")
-            st.error(f"Error while fetching system metrics: {e}")
+            logging.error(f"Error while fetching system metrics from {self.station}: {e}")
+            st.error(f"Error while fetching system metrics from {self.station}: {e}")
             return None
+
+    # same as fetch_system_metrics but raising, safe to call outside the script thread
+    @instrumented("api.system_metrics")
+    def system_metrics(self) -> Dict[str, Any]:
+        response = self._get("system_metrics", "/system_metrics", timeout=Config.REQUEST_TIMEOUT)
+        response.raise_for_status()
+        return response.json()
     
     # request a specific audio using the name (timestamp)
-    @staticmethod
-    def fetch_audio(filename: int) -> Optional[bytes]:
+    def fetch_audio(self, filename: int) -> Optional[bytes]:
         try:
-            response = requests.get(
-                f"{Config.API_BASE}/birds/audio/{filename}",
-                timeout=Config.REQUEST_TIMEOUT
-            )
-            response.raise_for_status()
-            return response.content
+            return self.download_audio(filename)
         except requests.exceptions.RequestException as e:
-            logging.error(f"Error while fetching audio {filename}: {e}")
-            st.error(f"Error while fetching audio {filename}: {e}")
+            logging.error(f"Error while fetching audio {filename} from {self.station}: {e}")
+            st.error(f"Error while fetching audio {filename} from {self.station}: {e}")
             return None
+
+    # same as fetch_audio but raising, safe to call outside the script thread
+    @instrumented("api.audio")
+    def download_audio(self, filename: int) -> bytes:
+        response = self._get("audio", f"/birds/audio/{filename}", timeout=Config.REQUEST_TIMEOUT)
+        response.raise_for_status()
+        return response.content
+
+    # bytes [start, end] of an audio (206); a Pi that ignores Range answers 200 with all of it
+    @instrumented("api.audio")
+    def download_audio_range(self, filename: int, start: int, end: int) -> requests.Response:
+        response = self._get(
+            "audio", f"/birds/audio/{filename}",
+            headers={"Range": f"bytes={start}-{end}", "Accept-Encoding": "identity"},   # ranges of the file as stored
+            timeout=Config.REQUEST_TIMEOUT
+        )
+        response.raise_for_status()
+        return response
@@ -1,18 +1,28 @@
 import streamlit as st
 import logging
+import sqlite3
 from datetime import datetime
 from config import Config
 from api_client import APIClient
+from detection_store import DetectionStore
+from detection_cache import DetectionCache
+from detection_rollups import DetectionRollups
+from audio_cache import AudioCache
 from data_processor import DataProcessor
-from utils import Utils
+from utils import Utils, KEPT_CONFIDENCE_LEVELS
+from threshold_registry import ThresholdRegistry
+from species_index import SpeciesIndex, Selection
 from ui_components import UIComponents
+from instrumentation import Instrumentation
 from datetime import datetime, timedelta
-import pandas as pd
 
 # Configure logging for debugging and monitoring
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Record where this rerun spends its time (shown in the sidebar at the end)
+Instrumentation.start_rerun()
+
 # ─────────────────────────────────────────────────────────────────────────────
 # Session state initialization
 # ─────────────────────────────────────────────────────────────────────────────
@@ -38,36 +48,48 @@ st.set_page_config(
 # ─────────────────────────────────────────────────────────────────────────────
 
 @st.cache_data(ttl=Config.CACHE_TTL_DETECTIONS)
-def fetch_new_detections(start_date: datetime.date, end_date: datetime.date):
+def fetch_overview(start_date: datetime.date, end_date: datetime.date, exclude_prefixes: tuple, stations: tuple):
     """
-    Fetch bird detections within the given date range from the backend API.
-    
-    Results are cached with TTL defined in Config.CACHE_TTL_DETECTIONS to 
-    minimize redundant network calls during repeated queries.
-    
-    Args:
-        start_date: Beginning of detection query window (inclusive).
-        end_date: End of detection query window (inclusive).
-    
-    Returns:
-        list[dict]: Detection records with keys: species, confidence, filename, 
-                    start_time, duration, and any additional metadata.
+    Long-range summary answered from the rollups of the detection stores,
+    synced first. Returns daily counts, hourly activity and per-species
+    statistics and the confidence histogram without loading any raw detection.
     """
-    return APIClient.fetch_detections(start_date, end_date)
+    Instrumentation.count("cache_misses")
+    DetectionStore.sync_stations(start_date, end_date, stations)
+    return {
+        "daily": DetectionRollups.daily(start_date, end_date, exclude_prefixes, stations),
+        "hourly": DetectionRollups.hourly(start_date, end_date, exclude_prefixes, stations),
+        "species": DetectionRollups.species(start_date, end_date, exclude_prefixes, stations),
+        "confidence": DetectionRollups.confidence_histogram(start_date, end_date, exclude_prefixes, stations=stations),
+    }
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Fragments: parts of the page that re-run on their own
+# ─────────────────────────────────────────────────────────────────────────────
+
+@st.fragment(run_every=Config.METRICS_POLL_INTERVAL)
+def system_status(stations: tuple):
+    """Sidebar metrics, redrawn from the poller on their own timer without rerunning the page"""
+    UIComponents.display_system_metrics(stations)
+    with st.expander("API connection"):
+        UIComponents.display_api_stats()
 
-@st.cache_data(ttl=Config.CACHE_TTL_METRICS)
-def fetch_system_metrics():
+@st.fragment
+def detections_panel(shown: Selection, paginated: bool, max_rows: int):
     """
-    Fetch system health metrics from the monitoring backend.
-    
-    Metrics include CPU usage, memory, disk space, and detection queue length.
-    Results are cached with TTL defined in Config.CACHE_TTL_METRICS.
-    
-    Returns:
-        dict: Metric keys and values (e.g., {'cpu': 45.2, 'ram_used': 2048}).
+    Detections table and audio analysis. Paging, sorting and selecting a row
+    re-run only this, on the frame of the last full run: the data pipeline
+    is not run again, a selection costs the audio path.
     """
+    with Instrumentation.fragment_rerun("detections_panel"):
+        selection = UIComponents.display_detections_table(shown, paginated, max_rows)
 
-    return APIClient.fetch_system_metrics()
+        if not selection:
+            st.info("Select a row to listen to the audio")
+        else:
+            st.header("🎵 Audio Analysis")
+            UIComponents.display_audio_and_spectrogram(selection['filename'], selection["start_time"] - int(selection['filename']), selection["duration"],
+                                                       selection["station"])
 
     
 # ═════════════════════════════════════════════════════════════════════════════
@@ -76,15 +98,30 @@ def fetch_system_metrics():
 
 with st.sidebar:        
     
+    # Stations: recorders of Config.STATIONS merged in the same views
+    stations = tuple(Config.STATIONS)
+    if len(stations) > 1:
+        stations = tuple(st.multiselect("Stations", stations, default=stations, key="stations",
+                                        help="Recorders whose detections are shown")) or stations
+
+    # Sampled in background by the MetricsPoller, shared by every session
     st.header("📊 System status")
-    with st.spinner('Loading system status...'):
-        UIComponents.display_system_metrics()
+    system_status(stations)
 
     st.header("Table view")
 
+    # Paginated: only one page of rows is styled and rendered per rerun
+    paginated = st.toggle("Paginated table", value=True,
+                          help="Sort, filter and browse every detection one page at a time")
     # Slider to limit number of rendered rows for performance on large datasets
-    max_rows = st.slider('Rows to show', min_value=100, max_value=5000, value=2500, step=50,
-                         help="Number of most recent detections to render when 'Show all' is off")
+    max_rows = None
+    if not paginated:
+        max_rows = st.slider('Rows to show', min_value=100, max_value=5000, value=2500, step=50,
+                             help="Number of most recent detections to render")
+    # Threshold profiles: species_confidence*.csv next to the default one
+    threshold_profiles = ThresholdRegistry.profiles()
+    threshold_profile = st.selectbox("Threshold profile", list(threshold_profiles), key="threshold_profile",
+                                     help="Per-species confidence thresholds applied to the detections")
     # Toggle to exclude non-species classes (e.g., None_, Wind_, Rain_)
     hide_non_species = st.toggle("Hide non-species classes", value=True,
                                  help="Filter out classes like None_, Wind_, Rain_, etc.")
@@ -103,16 +140,23 @@ with st.sidebar:
         st.caption(f"Last refresh: {st.session_state.last_refresh_at.strftime('%H:%M:%S')}")
     refresh_clicked = st.button("🔄 Refresh", width="stretch", disabled=st.session_state.is_fetching)
     if refresh_clicked and not st.session_state.is_fetching:
-        st.cache_data.clear()
+        # only what can have changed: today's detections (for every session) and the overview
+        DetectionCache.invalidate()
+        fetch_overview.clear()
         st.session_state.is_fetching = True
         st.rerun()
     
+    resync_clicked = st.button("♻️ Resync selected days", width="stretch", disabled=st.session_state.is_fetching,
+                               help="Fetch the selected days again whole, for detections a station uploaded late")
     st.button("🗑️ Clean Cache", width="stretch", on_click=Utils.clear_audio_cache, disabled=st.session_state.is_fetching)
 
     
-    # show cache info
-    cache_files = list(Config.AUDIO_CACHE_DIR.glob("*.wav"))
-    st.info(f"Audio file in cache: {len(cache_files)}")
+    # show cache info, read from the cache index
+    cache_summary = AudioCache.summary()
+    st.info(
+        f"Audio file in cache: {cache_summary['files']} ({cache_summary['bytes'] / 2**20:.1f} MB)  \n"
+        f"Hit rate: {cache_summary['hit_rate']:.0%} ({cache_summary['hits']} hits, {cache_summary['misses']} misses)"
+    )
 
 # ═════════════════════════════════════════════════════════════════════════════
 # MAIN AREA: DETECTIONS
@@ -120,7 +164,7 @@ with st.sidebar:
 
 # Detection
 st.header("🐦 Detections")
-st.subheader(f"Listening to: {Config.RASPBERRY_IP}")
+st.subheader(f"Listening to: {', '.join(client.host if len(Config.STATIONS) == 1 else client.station for client in APIClient.stations(stations))}")
 
 # ─────────────────────────────────────────────────────────────────────────────
 # User input controls: date range and confidence levels
@@ -135,11 +179,10 @@ with col1:
         help="Select start and end dates for analysis"
     )
 with col2:
-    confidence_levels = ['very_low', 'low', 'medium', 'high', 'very_high']
     selected_confidence_levels = st.multiselect(
         "Confidence Levels",
-        options=confidence_levels,
-        default=["medium", "high", "very_high", 'very_low', 'low'],
+        options=KEPT_CONFIDENCE_LEVELS,
+        default=KEPT_CONFIDENCE_LEVELS,
         help="Filter detections by confidence level quality"
     )
 
@@ -171,45 +214,107 @@ else:
 # Data pipeline: fetch → threshold adjustment → processing → filtering
 # ─────────────────────────────────────────────────────────────────────────────
 with st.spinner("Loading..."):
-    detections = fetch_new_detections(start_date, end_date)
-    confidence_thresholds = DataProcessor.get_confidence_thresholds(Config.CUSTOM_THRESHOLDS_PATH)
-    modified_thresholds = UIComponents.display_species_confidence_slider(confidence_thresholds)
-    df = DataProcessor.process_detections(detections, modified_thresholds)
-    df = Utils.add_confidence_level_column(df, modified_thresholds)
-    if selected_confidence_levels:
-        df = df[df["confidence_level"].isin(selected_confidence_levels)]
-    else:
+    # Shared by every session: closed days are kept, today is synced again after Config.CACHE_TTL_DETECTIONS
+    if resync_clicked:
+        DetectionCache.resync(start_date, end_date, stations)
+        fetch_overview.clear()
+    with Instrumentation.stage("detections", cached=True):
+        detections = DetectionCache.get(start_date, end_date, stations)
+    if st.session_state.is_fetching:
+        st.session_state.is_fetching = False
+        st.session_state.last_refresh_at = datetime.now()
+    profile = ThresholdRegistry.get(threshold_profiles[threshold_profile])
+    modified_thresholds = UIComponents.display_species_confidence_slider(profile.thresholds, profile.name)
+    if not selected_confidence_levels:
         st.warning("No confidence levels selected. Please select at least one level.")
-        df = pd.DataFrame()
 
-# ─────────────────────────────────────────────────────────────────────────────
-# Apply optional non-species filtering
-# ─────────────────────────────────────────────────────────────────────────────
-df_view = df   # by default
-if hide_non_species:
-    df_view = DataProcessor.filter_non_species(df_view, Config.NON_SPECIES_PREFIXES)
+    # Threshold independent work, once per data refresh
+    detections_key = (
+        start_date, end_date, stations,
+        len(detections), detections["start_time"].max() if len(detections) else None,
+    )
+    if st.session_state.get("detections_key") != detections_key:
+        prepared = DataProcessor.prepare_detections(detections)
+        st.session_state.prepared_detections = DataProcessor.add_display_columns(prepared)
+        # rows by species sorted by confidence, a threshold change only redoes its species
+        st.session_state.species_index = SpeciesIndex(st.session_state.prepared_detections)
+        st.session_state.detections_key = detections_key
+
+    # Thresholds, levels and filters: from the species index of the prepared
+    # frame, redone only when one of them changes (not when paging, sorting
+    # or selecting rows)
+    table_key = (
+        detections_key,
+        tuple(sorted(modified_thresholds.items())), tuple(selected_confidence_levels), hide_non_species,
+    )
+    if st.session_state.get("table_key") != table_key:
+        # rows kept as positions in the prepared frame: only the rows shown
+        # (the page of the table, an export) are built into a frame
+        selected = st.session_state.species_index.select_rows(modified_thresholds, selected_confidence_levels)
+
+        # ─────────────────────────────────────────────────────────────────────
+        # Apply optional non-species filtering
+        # ─────────────────────────────────────────────────────────────────────
+        shown = selected   # by default
+        if hide_non_species:
+            shown = shown.exclude(Config.NON_SPECIES_PREFIXES)
+        st.session_state.table_key = table_key
+        st.session_state.table_data = (selected, shown)
+    selected, shown = st.session_state.table_data
 
 # ═════════════════════════════════════════════════════════════════════════════
 # DISPLAY: Summary statistics and detection table
 # ═════════════════════════════════════════════════════════════════════════════
-if not df.empty:
-    df_view = df_view.head(max_rows)
+if len(selected):
     # Statistiche rapide
     col1, col2 = st.columns(2)
     with col1:
-        st.metric("Total detections", len(df))
+        st.metric("Total detections", len(selected))
     with col2:
-        unique_species = df['species'].nunique()
-        st.metric("Unique species", unique_species)
+        st.metric("Unique species", selected.species_count())
 
+# ─────────────────────────────────────────────────────────────────────────
+# Long-range overview, from the rollups only
+# ─────────────────────────────────────────────────────────────────────────
+if st.toggle("📈 Long-range overview", help="Daily and hourly activity and per-species statistics over a long period"):
+    overview_days = st.segmented_control("Period", Config.OVERVIEW_RANGES_DAYS, default=Config.OVERVIEW_RANGES_DAYS[-1],
+                                         format_func=lambda days: f"Last {days} days")
+    if overview_days:
+        overview_end = datetime.now().date()
+        exclude_prefixes = Config.NON_SPECIES_PREFIXES if hide_non_species else ("None_",)
+        try:
+            with st.spinner("Loading overview..."), Instrumentation.stage("overview", cached=True):
+                overview = fetch_overview(overview_end - timedelta(days=overview_days - 1), overview_end, exclude_prefixes,
+                                          stations)
+            UIComponents.display_overview(overview)
+        except sqlite3.Error as e:
+            logger.error(f"Rollups unavailable: {e}")
+            st.error(f"Overview unavailable: {e}")
 
 # ─────────────────────────────────────────────────────────────────────────
-# Detections table with row selection
+# Threshold sweep: detections kept per species at every threshold
 # ─────────────────────────────────────────────────────────────────────────
-selection = UIComponents.display_detections_table(df_view)
+if st.toggle("📉 Threshold sweep", help="Detections of each species kept at every threshold, to tune the threshold profile"):
+    UIComponents.display_threshold_sweep(st.session_state.species_index, modified_thresholds, profile.name,
+                                         Config.NON_SPECIES_PREFIXES if hide_non_species else ())
 
-if not selection:
-    st.info("Select a row to listen to the audio")
-else:
-    st.header("🎵 Audio Analysis")
-    UIComponents.display_audio_and_spectrogram(selection['filename'], selection["start_time"] - int(selection['filename']), selection["duration"])
\ No newline at end of file
+# ─────────────────────────────────────────────────────────────────────────
+# Detections table with row selection, re-run alone on selection and paging
+# ─────────────────────────────────────────────────────────────────────────
+detections_panel(shown, paginated, max_rows)
+
+# ─────────────────────────────────────────────────────────────────────────
+# Bulk export of the clips of the filtered detections
+# ─────────────────────────────────────────────────────────────────────────
+if len(shown):
+    with st.expander("📦 Export clips"):
+        UIComponents.display_export(shown, start_date, end_date)
+
+# ─────────────────────────────────────────────────────────────────────────
+# Rerun timings
+# ─────────────────────────────────────────────────────────────────────────
+rerun_summary = Instrumentation.finish_rerun()
+if Config.INSTRUMENTATION_PANEL:
+    with st.sidebar:
+        with st.expander("⏱️ Rerun timings"):
+            UIComponents.display_rerun_timings(rerun_summary)
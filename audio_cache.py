@@ -0,0 +1,343 @@
+from config import Config
+from instrumentation import Instrumentation
+import functools
+import io
+import logging
+import sqlite3
+import threading
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+@functools.lru_cache(maxsize=None)
+def _soundfile():
+    """soundfile, imported on first use; None without it (optional, needs libsndfile): recordings are cached and played as WAV"""
+    try:
+        import soundfile
+    except (ImportError, OSError):
+        return None
+    return soundfile
+
+# PCM subtypes transcoded to FLAC, read back with the dtype scipy's wavfile gives them
+FLAC_DTYPES = {"PCM_16": "int16", "PCM_24": "int32"}
+OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+
+class AudioCache:
+    """
+    Managed audio cache in Config.AUDIO_CACHE_DIR.
+
+    An SQLite index next to the files keeps size, last access and hit count of
+    every entry, plus running totals (files, bytes, hits, misses, evictions) so
+    the sidebar never has to scan the directory. Files are written atomically
+    and, after every write, entries not accessed for Config.AUDIO_CACHE_MAX_AGE
+    seconds are removed, then the least recently used ones until the cache fits
+    in Config.AUDIO_CACHE_MAX_BYTES.
+
+    Entries are named by AudioCache.key: the recording's filename, prefixed
+    with the station for every station but the default one (filenames are
+    timestamps, two recorders can produce the same).
+
+    With Config.AUDIO_CACHE_FORMAT = "flac" the WAV downloaded from the Pi is
+    stored as FLAC (lossless, same samples); with Config.AUDIO_PLAYBACK_FORMAT
+    = "opus" an Ogg Opus copy for the browser is encoded in background and
+    kept next to it, counted in the size of the entry and evicted with it.
+    Entries cached as WAV before the format changed stay readable until
+    evicted.
+    """
+
+    INDEX_NAME = "index.sqlite"
+    WAV_SUFFIX = ".wav"
+    FLAC_SUFFIX = ".flac"
+    OPUS_SUFFIX = ".opus"
+    SUFFIXES = (FLAC_SUFFIX, WAV_SUFFIX)
+
+    _transcoder = ThreadPoolExecutor(max_workers=1, thread_name_prefix="audio-opus")
+    _evict_listeners: List[Callable[[List[str]], None]] = []
+
+    @staticmethod
+    @contextmanager
+    def _connect():
+        conn = sqlite3.connect(Config.AUDIO_CACHE_DIR / AudioCache.INDEX_NAME, timeout=Config.REQUEST_TIMEOUT)
+        try:
+            with conn:
+                AudioCache._create_index(conn)
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _create_index(conn: sqlite3.Connection):
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS entries (
+                name TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_access REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            )"""
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS totals (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                files INTEGER NOT NULL, bytes INTEGER NOT NULL,
+                hits INTEGER NOT NULL, misses INTEGER NOT NULL, evictions INTEGER NOT NULL
+            )"""
+        )
+        if conn.execute("SELECT 1 FROM totals").fetchone() is not None:
+            return
+        # new index: adopt the files downloaded before it existed
+        now = time.time()
+        rows = [
+            (path.name, path.stat().st_size, path.stat().st_mtime, now)
+            for suffix in AudioCache.SUFFIXES
+            for path in Config.AUDIO_CACHE_DIR.glob(f"*{suffix}")
+        ]
+        conn.executemany("INSERT OR IGNORE INTO entries (name, size, created, last_access) VALUES (?, ?, ?, ?)", rows)
+        conn.execute(
+            "INSERT OR IGNORE INTO totals SELECT 0, COUNT(*), COALESCE(SUM(size), 0), 0, 0, 0 FROM entries"
+        )
+
+    @staticmethod
+    def key(filename: int, station: Optional[str] = None) -> str:
+        """Cache key of a recording of `station`, bare filename for the default station"""
+        if station is None or station == next(iter(Config.STATIONS)):
+            return str(filename)
+        return f"{station}_{filename}"
+
+    @staticmethod
+    def suffix() -> str:
+        """Suffix new entries are written with"""
+        return AudioCache.FLAC_SUFFIX if Config.AUDIO_CACHE_FORMAT == "flac" and _soundfile() is not None else AudioCache.WAV_SUFFIX
+
+    @staticmethod
+    def entry_path(key: str) -> Path:
+        """File of the entry `key`, in whichever format it was cached (the current one if not cached)"""
+        for suffix in AudioCache.SUFFIXES:
+            path = Config.AUDIO_CACHE_DIR / f"{key}{suffix}"
+            if path.exists():
+                return path
+        return Config.AUDIO_CACHE_DIR / f"{key}{AudioCache.suffix()}"
+
+    @staticmethod
+    def path(filename: int, station: Optional[str] = None) -> Path:
+        return AudioCache.entry_path(AudioCache.key(filename, station))
+
+    @staticmethod
+    def playback_path(filename: int, station: Optional[str] = None) -> Optional[Path]:
+        """Opus copy of the recording for the browser, None if there is none"""
+        if Config.AUDIO_PLAYBACK_FORMAT != "opus":
+            return None
+        path = Config.AUDIO_CACHE_DIR / f"{AudioCache.key(filename, station)}{AudioCache.OPUS_SUFFIX}"
+        return path if path.exists() else None
+
+    @staticmethod
+    def contains(filename: int, station: Optional[str] = None) -> bool:
+        """Existence check that does not count as an access"""
+        return AudioCache.contains_key(AudioCache.key(filename, station))
+
+    @staticmethod
+    def contains_key(key: str) -> bool:
+        """Whether the recording with key `key` is cached, in any format"""
+        return any((Config.AUDIO_CACHE_DIR / f"{key}{suffix}").exists() for suffix in AudioCache.SUFFIXES)
+
+    @staticmethod
+    def info(path: Path) -> Tuple[int, int]:
+        """Sample rate and number of frames of a cached recording, without decoding it"""
+        if path.suffix == AudioCache.FLAC_SUFFIX:
+            info = _soundfile().info(str(path))
+            return info.samplerate, info.frames
+        sample_rate, samples = AudioCache.read(path)
+        return sample_rate, len(samples)
+
+    @staticmethod
+    def read(path: Path, start: int = 0, stop: Optional[int] = None) -> Tuple[int, np.ndarray]:
+        """
+        Sample rate and frames [start, stop) of a cached recording: a view
+        into the memory-mapped file for WAV, only the frames of the range
+        decoded for FLAC.
+        """
+        if path.suffix == AudioCache.FLAC_SUFFIX:
+            with _soundfile().SoundFile(str(path)) as f:
+                f.seek(start)
+                frames = (f.frames if stop is None else stop) - start
+                return f.samplerate, f.read(frames, dtype=FLAC_DTYPES.get(f.subtype, "float32"))
+        from scipy.io import wavfile
+        try:
+            sample_rate, samples = wavfile.read(path, mmap=True)
+        except ValueError:
+            # formats that cannot be memory-mapped (e.g. 24-bit PCM)
+            sample_rate, samples = wavfile.read(path)
+        return sample_rate, samples[start:stop]
+
+    @staticmethod
+    def get(filename: int, station: Optional[str] = None) -> Optional[Path]:
+        """Path of the cached file, None on a miss; hits and misses are counted"""
+        path = AudioCache.path(filename, station)
+        with AudioCache._connect() as conn:
+            found = path.exists() and conn.execute(
+                "UPDATE entries SET last_access = ?, hits = hits + 1 WHERE name = ?", (time.time(), path.name)
+            ).rowcount > 0
+            conn.execute(f"UPDATE totals SET {'hits = hits' if found else 'misses = misses'} + 1")
+        Instrumentation.count("cache_hits" if found else "cache_misses")
+        return path if found else None
+
+    @staticmethod
+    def _encode(data: bytes) -> Tuple[str, bytes]:
+        """Suffix and bytes of the entry for the WAV `data` downloaded from the Pi"""
+        if AudioCache.suffix() != AudioCache.FLAC_SUFFIX:
+            return AudioCache.WAV_SUFFIX, data
+        sf = _soundfile()
+        try:
+            info = sf.info(io.BytesIO(data))
+            if info.subtype not in FLAC_DTYPES:
+                return AudioCache.WAV_SUFFIX, data
+            samples, sample_rate = sf.read(io.BytesIO(data), dtype=FLAC_DTYPES[info.subtype])
+            buffer = io.BytesIO()
+            sf.write(buffer, samples, sample_rate, format="FLAC", subtype=info.subtype)
+            return AudioCache.FLAC_SUFFIX, buffer.getvalue()
+        except RuntimeError as e:
+            logger.warning(f"Audio kept as WAV, could not be transcoded: {e}")
+            return AudioCache.WAV_SUFFIX, data
+
+    @staticmethod
+    def _write_playback(path: Path):
+        """Writes the Opus copy of the entry at `path` and adds its size to the entry"""
+        if not path.exists():
+            return      # evicted before its turn
+        try:
+            sample_rate, samples = AudioCache.read(path)
+            if sample_rate not in OPUS_SAMPLE_RATES:
+                return
+            buffer = io.BytesIO()
+            _soundfile().write(buffer, samples, sample_rate, format="OGG", subtype="OPUS")
+        except (OSError, ValueError, RuntimeError) as e:
+            logger.warning(f"No Opus copy of {path.name}: {e}")
+            return
+        opus_path = path.with_name(f"{path.name.rsplit('.', 1)[0]}{AudioCache.OPUS_SUFFIX}")
+        AudioCache._write_atomic(opus_path, buffer.getvalue())
+        with AudioCache._connect() as conn:
+            size = len(buffer.getvalue())
+            if conn.execute("UPDATE entries SET size = size + ? WHERE name = ?", (size, path.name)).rowcount:
+                conn.execute("UPDATE totals SET bytes = bytes + ?", (size,))
+            else:
+                opus_path.unlink(missing_ok=True)   # evicted in the meantime
+
+    @staticmethod
+    def _write_atomic(path: Path, data: bytes):
+        """Writes to a temp file first so readers never see a partial file; also used by AudioSegments and SpectrogramCache"""
+        tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(data)
+        tmp_path.replace(path)
+
+    @staticmethod
+    def put(filename: int, data: bytes, station: Optional[str] = None) -> Path:
+        """Caches the WAV `data` downloaded from the Pi, in the format of Config.AUDIO_CACHE_FORMAT"""
+        suffix, stored = AudioCache._encode(data)
+        path = Config.AUDIO_CACHE_DIR / f"{AudioCache.key(filename, station)}{suffix}"
+        AudioCache._write_atomic(path, stored)
+        size = len(stored)
+
+        now = time.time()
+        with AudioCache._connect() as conn:
+            previous = conn.execute("SELECT size FROM entries WHERE name = ?", (path.name,)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (name, size, created, last_access) VALUES (?, ?, ?, ?)",
+                (path.name, size, now, now)
+            )
+            if previous is None:
+                conn.execute("UPDATE totals SET files = files + 1, bytes = bytes + ?", (size,))
+            else:
+                conn.execute("UPDATE totals SET bytes = bytes + ?", (size - previous[0],))
+            AudioCache._enforce_limits(conn, keep=path.name)
+        # Opus encoding is slow: the first playback may still be the WAV clip
+        if Config.AUDIO_PLAYBACK_FORMAT == "opus" and _soundfile() is not None:
+            AudioCache._transcoder.submit(AudioCache._write_playback, path)
+        return path
+
+    @staticmethod
+    def _unlink(name: str):
+        """Removes the file of an entry and its Opus copy"""
+        (Config.AUDIO_CACHE_DIR / name).unlink(missing_ok=True)
+        (Config.AUDIO_CACHE_DIR / f"{name.rsplit('.', 1)[0]}{AudioCache.OPUS_SUFFIX}").unlink(missing_ok=True)
+
+    @staticmethod
+    def _enforce_limits(conn: sqlite3.Connection, keep: str = None):
+        expired = conn.execute(
+            "SELECT name, size FROM entries WHERE last_access < ? AND name != ?",
+            (time.time() - Config.AUDIO_CACHE_MAX_AGE, keep or "")
+        ).fetchall()
+        AudioCache._evict(conn, expired)
+
+        (total_bytes,) = conn.execute("SELECT bytes FROM totals").fetchone()
+        if total_bytes <= Config.AUDIO_CACHE_MAX_BYTES:
+            return
+        victims = []
+        for name, size in conn.execute(
+            "SELECT name, size FROM entries WHERE name != ? ORDER BY last_access", (keep or "",)
+        ):
+            victims.append((name, size))
+            total_bytes -= size
+            if total_bytes <= Config.AUDIO_CACHE_MAX_BYTES:
+                break
+        AudioCache._evict(conn, victims)
+
+    @staticmethod
+    def _evict(conn: sqlite3.Connection, entries):
+        if not entries:
+            return
+        for name, _ in entries:
+            AudioCache._unlink(name)
+        conn.executemany("DELETE FROM entries WHERE name = ?", [(name,) for name, _ in entries])
+        conn.execute(
+            "UPDATE totals SET files = files - ?, bytes = bytes - ?, evictions = evictions + ?",
+            (len(entries), sum(size for _, size in entries), len(entries))
+        )
+        logger.info(f"Evicted {len(entries)} files from the audio cache")
+        AudioCache.notify_evicted([name.rsplit(".", 1)[0] for name, _ in entries])
+
+    @staticmethod
+    def on_evict(listener: Callable[[List[str]], None]):
+        """Calls `listener` with the keys of the recordings evicted, from the cache or from AudioSegments"""
+        AudioCache._evict_listeners.append(listener)
+
+    @staticmethod
+    def notify_evicted(keys: List[str]):
+        for listener in AudioCache._evict_listeners:
+            try:
+                listener(keys)
+            except OSError as e:
+                logger.warning(f"Error while cleaning up after the eviction of {len(keys)} recordings: {e}")
+
+    @staticmethod
+    def clear():
+        with AudioCache._connect() as conn:
+            names = [name for (name,) in conn.execute("SELECT name FROM entries")]
+            for name in names:
+                AudioCache._unlink(name)
+            conn.execute("DELETE FROM entries")
+            conn.execute("UPDATE totals SET files = 0, bytes = 0")
+        AudioCache.notify_evicted([name.rsplit(".", 1)[0] for name in names])
+
+    @staticmethod
+    def summary() -> Dict[str, float]:
+        """Totals of the cache, read from a single index row"""
+        with AudioCache._connect() as conn:
+            files, size, hits, misses, evictions = conn.execute(
+                "SELECT files, bytes, hits, misses, evictions FROM totals"
+            ).fetchone()
+        lookups = hits + misses
+        return {
+            "files": files,
+            "bytes": size,
+            "hits": hits,
+            "misses": misses,
+            "evictions": evictions,
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
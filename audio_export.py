@@ -0,0 +1,324 @@
+from config import Config
+from instrumentation import instrumented
+import argparse
+import contextvars
+import csv
+import hashlib
+import io
+import logging
+import re
+import shutil
+import zipfile
+import numpy as np
+import pandas as pd
+import requests
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import date
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional
+from api_client import APIClient
+from audio_cache import AudioCache
+from audio_processor import AudioProcessor
+from data_processor import DataProcessor
+from detection_cache import DetectionCache
+from threshold_registry import ThresholdRegistry
+from utils import Utils, KEPT_CONFIDENCE_LEVELS
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+except ImportError:     # optional, the manifest is then only written as CSV
+    pa = None
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# one row per clip; clip_offset is where the clip starts in the recording, in seconds
+MANIFEST_COLUMNS = (
+    "clip", "station", "filename", "species", "confidence", "confidence_level",
+    "start_time", "duration", "clip_offset", "clip_duration", "sample_rate",
+)
+
+class ExportResult(NamedTuple):
+    archive: Path
+    clips: int              # clips in the archive
+    resumed: int            # recordings already exported by an interrupted run
+    failed: List[str]       # audio keys of the recordings that could not be exported
+
+class AudioExporter:
+    """
+    Bulk export of detections (e.g. the filtered table) as audio clips in a
+    zip archive, with the manifest as CSV (and Parquet when pyarrow is
+    installed).
+
+    Every recording is read once, from the audio cache or downloaded to
+    memory without caching it (an export does not evict what is being
+    listened to), and the window of each of its detections plus `padding`
+    seconds is written as a WAV under the species directory. Recordings are
+    processed by Config.EXPORT_WORKERS threads and only a few more are queued,
+    so memory does not grow with the size of the export; the calling thread
+    compresses the clips into the archive while the workers download.
+
+    Clips go to a staging directory next to the archive (<archive>.parts)
+    and the manifest is appended as recordings complete: exporting the same
+    detections to the same archive again resumes an interrupted or partly
+    failed export, recordings already in the manifest are not read again.
+    """
+
+    MANIFEST_NAME = "manifest.csv"
+    PARQUET_NAME = "manifest.parquet"
+    SELECTION_NAME = "selection"    # fingerprint of the exported detections, in the staging directory
+
+    @staticmethod
+    def _detections(df: pd.DataFrame) -> pd.DataFrame:
+        """Columns of the export, sorted by recording"""
+        if df.empty:
+            return pd.DataFrame(columns=["station", "filename", "species", "confidence", "confidence_level",
+                                         "start_time", "duration"])
+        rows = pd.DataFrame({
+            "station": df["station"].astype(str).to_numpy() if "station" in df else next(iter(Config.STATIONS)),
+            "filename": df["filename"].to_numpy(dtype=np.int64),
+            "species": df["species"].astype(str).to_numpy(),
+            "confidence": df["confidence"].to_numpy(dtype=float),
+            "confidence_level": df["confidence_level"].astype(str).to_numpy() if "confidence_level" in df else "",
+            "start_time": df["start_time"].to_numpy(dtype=np.int64),
+            "duration": df["duration"].to_numpy(dtype=float),
+        }, index=range(len(df)))
+        return rows.sort_values(["station", "filename", "start_time", "species"], ignore_index=True)
+
+    @staticmethod
+    def fingerprint(rows: pd.DataFrame, padding: Optional[float]) -> str:
+        keys = pd.util.hash_pandas_object(rows[["station", "filename", "start_time", "species"]], index=False)
+        return hashlib.sha1(keys.to_numpy().tobytes() + repr(padding).encode()).hexdigest()[:16]
+
+    @staticmethod
+    def _recordings(rows: pd.DataFrame) -> List[slice]:
+        """Row ranges of the recordings of the sorted detections"""
+        if rows.empty:
+            return []
+        stations, filenames = rows["station"].to_numpy(), rows["filename"].to_numpy()
+        starts = np.flatnonzero(np.r_[True, (stations[1:] != stations[:-1]) | (filenames[1:] != filenames[:-1])])
+        ends = np.r_[starts[1:], len(rows)]
+        return [slice(start, end) for start, end in zip(starts.tolist(), ends.tolist())]
+
+    @staticmethod
+    def _species_dir(species: str) -> str:
+        return re.sub(r"[^\w ,.\-]", "_", species)
+
+    @staticmethod
+    def _read_recording(filename: int, station: str):
+        from scipy.io import wavfile
+        path = AudioCache.path(filename, station)
+        if path.exists():
+            return AudioCache.read(path)
+        return wavfile.read(io.BytesIO(APIClient.station(station).download_audio(filename)))
+
+    @staticmethod
+    def _export_recording(rows: pd.DataFrame, clips_dir: Path, padding: Optional[float]) -> List[list]:
+        """Writes the clips of the detections of one recording, returns their manifest rows"""
+        from scipy.io import wavfile
+        station, filename = rows["station"].iat[0], int(rows["filename"].iat[0])
+        sample_rate, samples = AudioExporter._read_recording(filename, station)
+        audio_key = AudioCache.key(filename, station)
+        manifest_rows = []
+        for detection in rows.itertuples(index=False):
+            clip = AudioProcessor.cut_clip(sample_rate, samples, detection.start_time - filename, detection.duration,
+                                           padding)
+            name = f"{AudioExporter._species_dir(detection.species)}/{audio_key}_{detection.start_time}.wav"
+            path = clips_dir / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f"{path.name}.tmp")
+            wavfile.write(tmp_path, sample_rate, np.ascontiguousarray(clip.samples))
+            tmp_path.replace(path)
+            manifest_rows.append([
+                name, station, filename, detection.species, round(detection.confidence, 4), detection.confidence_level,
+                detection.start_time, detection.duration, clip.offset, clip.duration, sample_rate,
+            ])
+        return manifest_rows
+
+    @staticmethod
+    def _archive_fingerprint(archive: Path) -> Optional[str]:
+        try:
+            with zipfile.ZipFile(archive) as zf:
+                return zf.comment.decode()
+        except (OSError, zipfile.BadZipFile):
+            return None
+
+    @staticmethod
+    @instrumented("export")
+    def export(df: pd.DataFrame, archive: Path, padding: Optional[float] = None,
+               progress: Optional[Callable[[int, int], None]] = None) -> ExportResult:
+        """
+        Exports the clips of the detections of `df` to the zip `archive`
+        (`padding` seconds around each detection, Config.AUDIO_CLIP_PADDING
+        by default). `progress(done, total)` is called from the calling
+        thread as recordings complete.
+        """
+        if padding is None:
+            padding = Config.AUDIO_CLIP_PADDING
+        archive = Path(archive)
+        rows = AudioExporter._detections(df)
+        recordings = AudioExporter._recordings(rows)
+        fingerprint = AudioExporter.fingerprint(rows, padding)
+        if AudioExporter._archive_fingerprint(archive) == fingerprint:
+            logger.info(f"{archive} is up to date")
+            if progress:
+                progress(len(recordings), len(recordings))
+            return ExportResult(archive, len(rows), len(recordings), [])
+
+        # staging directory of a previous run of other detections: start over
+        parts = archive.with_name(f"{archive.name}.parts")
+        selection_path = parts / AudioExporter.SELECTION_NAME
+        if parts.exists() and (not selection_path.exists() or selection_path.read_text() != fingerprint):
+            shutil.rmtree(parts)
+        (parts / "clips").mkdir(parents=True, exist_ok=True)
+        selection_path.write_text(fingerprint)
+
+        manifest_path = parts / AudioExporter.MANIFEST_NAME
+        archive.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = archive.with_name(f"{archive.name}.tmp")
+        pool = ThreadPoolExecutor(max_workers=Config.EXPORT_WORKERS, thread_name_prefix="audio-export")
+        running: Dict[Future, str] = {}
+        failed = []
+        try:
+            # the archive is written by this thread as recordings complete, while the workers download
+            with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_DEFLATED,
+                                 compresslevel=Config.EXPORT_COMPRESSLEVEL) as zf:
+                exported = AudioExporter._pack_exported(manifest_path, parts / "clips", zf)
+                todo = [r for r in recordings
+                        if (rows["station"].iat[r.start], int(rows["filename"].iat[r.start])) not in exported]
+                resumed = done = len(recordings) - len(todo)
+                if resumed:
+                    logger.info(f"Resuming export to {archive}: {resumed} of {len(recordings)} recordings already exported")
+                if progress:
+                    progress(done, len(recordings))
+
+                with open(manifest_path, "a", newline="") as manifest:
+                    writer = csv.writer(manifest)
+                    if manifest.tell() == 0:
+                        writer.writerow(MANIFEST_COLUMNS)
+
+                    def collect(finished):
+                        nonlocal done
+                        for future in finished:
+                            audio_key = running.pop(future)
+                            try:
+                                manifest_rows = future.result()
+                                for row in manifest_rows:
+                                    zf.write(parts / "clips" / row[0], row[0])
+                                writer.writerows(manifest_rows)
+                                manifest.flush()
+                            except (requests.exceptions.RequestException, OSError, ValueError, RuntimeError) as e:
+                                logger.error(f"Error while exporting {audio_key}: {e}")
+                                failed.append(audio_key)
+                            done += 1
+                            if progress:
+                                progress(done, len(recordings))
+
+                    # a few recordings queued per worker, not the whole export
+                    for recording in todo:
+                        if len(running) >= 2 * Config.EXPORT_WORKERS:
+                            collect(wait(running, return_when=FIRST_COMPLETED).done)
+                        recording_rows = rows.iloc[recording]
+                        future = pool.submit(contextvars.copy_context().run, AudioExporter._export_recording,
+                                             recording_rows, parts / "clips", padding)
+                        running[future] = AudioCache.key(int(recording_rows["filename"].iat[0]),
+                                                         recording_rows["station"].iat[0])
+                    while running:
+                        collect(wait(running, return_when=FIRST_COMPLETED).done)
+
+                zf.write(manifest_path, AudioExporter.MANIFEST_NAME)
+                if pa is not None:
+                    AudioExporter._write_parquet(manifest_path, parts / AudioExporter.PARQUET_NAME)
+                    zf.write(parts / AudioExporter.PARQUET_NAME, AudioExporter.PARQUET_NAME)
+                if not failed:
+                    zf.comment = fingerprint.encode()     # complete archive
+                clips = sum(1 for name in zf.namelist() if name.endswith(".wav"))
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+        tmp_path.replace(archive)
+        if failed:
+            logger.warning(f"{len(failed)} recordings could not be exported, export again to retry them")
+        else:
+            shutil.rmtree(parts)
+        logger.info(f"Exported {clips} clips to {archive}")
+        return ExportResult(archive, clips, resumed, failed)
+
+    @staticmethod
+    def _pack_exported(manifest_path: Path, clips_dir: Path, zf: zipfile.ZipFile) -> set:
+        """Zips the clips of the manifest of an interrupted export, returns the (station, filename) of their recordings"""
+        if not manifest_path.exists():
+            return set()
+        exported = set()
+        with open(manifest_path, newline="") as manifest:
+            reader = csv.reader(manifest)
+            next(reader, None)
+            for row in reader:
+                if len(row) == len(MANIFEST_COLUMNS):
+                    zf.write(clips_dir / row[0], row[0])
+                    exported.add((row[1], int(row[2])))
+        return exported
+
+    @staticmethod
+    def _write_parquet(csv_path: Path, parquet_path: Path):
+        """Manifest CSV to Parquet one block at a time"""
+        types = {
+            "clip": pa.string(), "station": pa.string(), "filename": pa.int64(), "species": pa.string(),
+            "confidence": pa.float32(), "confidence_level": pa.string(), "start_time": pa.int64(),
+            "duration": pa.float32(), "clip_offset": pa.float64(), "clip_duration": pa.float64(),
+            "sample_rate": pa.int32(),
+        }
+        reader = pa_csv.open_csv(csv_path, convert_options=pa_csv.ConvertOptions(
+            column_types=types, strings_can_be_null=False, quoted_strings_can_be_null=False))
+        with pq.ParquetWriter(parquet_path, reader.schema) as writer:
+            for batch in reader:
+                writer.write_batch(batch)
+
+
+def _selected_detections(args) -> pd.DataFrame:
+    """Detections of the arguments, filtered as the dashboard table does"""
+    thresholds = dict(ThresholdRegistry.get(args.thresholds).thresholds)
+    df = DataProcessor.prepare_detections(DetectionCache.get(args.start, args.end, args.station))
+    df = Utils.add_confidence_level_column(DataProcessor.select_detections(df, thresholds), thresholds)
+    if df.empty:
+        return df
+    df = df[df["confidence_level"].isin(args.levels)]
+    if not args.include_non_species:
+        df = DataProcessor.filter_non_species(df, Config.NON_SPECIES_PREFIXES)
+    if args.species:
+        # case insensitive, on the scientific or the common name
+        wanted = [name.lower() for name in args.species]
+        names = df["species"].astype("category").cat.categories
+        matching = [name for name in names if any(w in name.lower() for w in wanted)]
+        df = df[df["species"].isin(matching)]
+    return df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the audio clips of the detections to a zip archive")
+    parser.add_argument("--start", type=date.fromisoformat, default=date.today(), help="first day (YYYY-MM-DD)")
+    parser.add_argument("--end", type=date.fromisoformat, default=date.today(), help="last day (YYYY-MM-DD)")
+    parser.add_argument("--station", nargs="+", help="stations of Config.STATIONS (all by default)")
+    parser.add_argument("--species", nargs="+", help="species names, or parts of them")
+    parser.add_argument("--levels", nargs="+", default=KEPT_CONFIDENCE_LEVELS, choices=KEPT_CONFIDENCE_LEVELS,
+                        help="confidence levels")
+    parser.add_argument("--thresholds", type=Path, help="threshold profile (Config.CUSTOM_THRESHOLDS_PATH by default)")
+    parser.add_argument("--include-non-species", action="store_true", help="also export None_, Wind_, ...")
+    parser.add_argument("--padding", type=float, help="seconds around each detection (Config.AUDIO_CLIP_PADDING by default)")
+    parser.add_argument("--out", type=Path, help="archive path (in Config.EXPORT_DIR by default)")
+    args = parser.parse_args()
+
+    detections = _selected_detections(args)
+    if detections.empty:
+        parser.exit(1, "No detections to export\n")
+    archive = args.out or Config.EXPORT_DIR / f"detections_{args.start}_{args.end}.zip"
+    logger.info(f"Exporting {len(detections)} detections to {archive}")
+
+    def log_progress(done: int, total: int):
+        if done == total or done % 100 == 0:
+            logger.info(f"{done}/{total} recordings")
+
+    result = AudioExporter.export(detections, archive, args.padding, log_progress)
+    raise SystemExit(1 if result.failed else 0)
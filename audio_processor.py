@@ -1,65 +1,262 @@
 from config import Config
+from instrumentation import instrumented
 import logging
 from pathlib import Path
 from api_client import APIClient
-from pydub import AudioSegment
+from http_session import HTTPSession
+from audio_cache import AudioCache
+from audio_segments import AudioSegments
 import streamlit as st
-import matplotlib.pyplot as plt
-from scipy.io import wavfile
-from scipy import signal
 import numpy as np
 import io
-from scipy.io import wavfile
-from scipy import signal
-import logging
-
-import matplotlib.patches as patches
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, NamedTuple, Optional, Tuple, Union
 
+# matplotlib and scipy are imported where they are used: they are most of the
+# start-up time of the dashboard and only needed once a row is selected
+if TYPE_CHECKING:
+    import matplotlib.pyplot as plt
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class AudioClip:
+    """
+    Window of a recording. `samples` may be given as a function, called on
+    first access only: a clip of a FLAC entry whose spectrogram is cached and
+    that is played from the Opus copy is never decoded.
+    """
+
+    def __init__(self, sample_rate: int, samples: Union[np.ndarray, Callable[[], np.ndarray]], offset: float,
+                 full: bool, frames: Optional[int] = None):
+        self.sample_rate = sample_rate
+        self._samples = samples     # view into the memory-mapped wav, or the decoded frames of the window
+        self.offset = offset        # seconds from the beginning of the recording
+        self.full = full            # True if the clip is the whole recording
+        self.frames = len(samples) if frames is None else frames
+
+    @property
+    def samples(self) -> np.ndarray:
+        if callable(self._samples):
+            self._samples = self._samples()
+        return self._samples
+
+    @property
+    def duration(self) -> float:
+        return self.frames / self.sample_rate
+
 class AudioProcessor:
     
     @staticmethod
-    def get_cached_audio_path(filename: int) -> Path:
-        return Config.AUDIO_CACHE_DIR / f"{filename}.wav"
+    def get_cached_audio_path(filename: int, station: Optional[str] = None) -> Path:
+        return AudioCache.path(filename, station)
 
     @staticmethod
-    def download_and_cache_audio(filename: int) -> bool:
-        file_path = AudioProcessor.get_cached_audio_path(filename)
-        if file_path.exists():
-            return True
+    @instrumented("audio.download")
+    def download_and_cache_audio(filename: int, station: Optional[str] = None,
+                                 window: Optional[Tuple[float, float]] = None) -> bool:
+        """
+        Makes the recording readable by load_clip: all of it, or with
+        Config.AUDIO_PARTIAL_DOWNLOAD and a (prediction_time,
+        prediction_duration) `window` only the segments around the window.
+        """
+        # a recording read by segments is not a miss of the AudioCache, AudioSegments.fetch counts its lookups
+        if not AudioPrefetcher._partial(window) or AudioCache.contains(filename, station):
+            if AudioCache.get(filename, station) is not None:
+                return True
         with st.spinner("Downloading audio..."):
-            audio_data = APIClient.fetch_audio(filename)
-            if audio_data:
-                try:
-                    file_path.write_bytes(audio_data)
-                    logger.info(f"Audio {filename}.wav has been saved.")
-                    return True
-                except Exception as e:
-                    logger.error(f"Error while downloading data: {e}")
-                    return False
+            try:
+                return AudioPrefetcher.fetch(filename, station, window)
+            except requests.exceptions.RequestException as e:
+                logger.error(f"Error while fetching audio {filename}: {e}")
+                st.error(f"Error while fetching audio {filename}: {e}")
+                return False
+            except OSError as e:
+                logger.error(f"Error while downloading data: {e}")
+                return False
+
+    @staticmethod
+    def save_audio(filename: int, audio_data: bytes, station: Optional[str] = None):
+        path = AudioCache.put(filename, audio_data, station)
+        AudioSegments.discard(filename, station)
+        logger.info(f"Audio {path.name} has been saved.")
                 
     @staticmethod
-    def extract_audio_segment(audio_data: bytes) -> io.BytesIO:
-        try:
-            audio_buffer = io.BytesIO(audio_data)
-            full_audio = AudioSegment.from_wav(audio_buffer)
+    @instrumented("audio.load_clip")
+    def load_clip(filename: int, prediction_time: float, prediction_duration: float,
+                  padding: Optional[float] = None, station: Optional[str] = None) -> AudioClip:
+        """
+        The prediction window plus `padding` seconds on each side of the
+        cached recording (Config.AUDIO_CLIP_PADDING by default, the whole
+        recording if that is None), or of its segments when only those were
+        downloaded. Nothing is decoded here: the samples are read when first
+        used, only the pages of the window of a memory-mapped WAV, the frames
+        of the window of a FLAC or the segments holding it.
+        """
+        if padding is None:
+            padding = Config.AUDIO_CLIP_PADDING
+        path = AudioProcessor.get_cached_audio_path(filename, station)
+        if path.exists():
+            sample_rate, frames = AudioCache.info(path)
+            read = lambda start, end: AudioCache.read(path, start, end)[1]
+        else:
+            sample_rate, frames = AudioSegments.info(filename, station)
+            read = lambda start, end: AudioSegments.read(filename, start, end, station)[1]
+        start, end = AudioProcessor.clip_bounds(sample_rate, frames, prediction_time, prediction_duration, padding)
+        return AudioClip(sample_rate, lambda: AudioProcessor._mono(read(start, end)),
+                         start / sample_rate, start == 0 and end == frames, frames=end - start)
+
+    @staticmethod
+    def clip_seconds(prediction_time: float, prediction_duration: float,
+                     padding: Optional[float]) -> Tuple[float, Optional[float]]:
+        """Seconds of the recording clip_bounds keeps, the end is None for the whole recording"""
+        if padding is None:
+            return 0.0, None
+        return prediction_time - padding, prediction_time + prediction_duration + padding
+
+    @staticmethod
+    def clip_bounds(sample_rate: int, frames: int, prediction_time: float, prediction_duration: float,
+                    padding: Optional[float]) -> Tuple[int, int]:
+        """First and last (excluded) frame of the prediction window plus `padding` seconds (all frames if None)"""
+        if padding is None:
+            return 0, frames
+        start = max(int((prediction_time - padding) * sample_rate), 0)
+        end = min(int(np.ceil((prediction_time + prediction_duration + padding) * sample_rate)), frames)
+        return min(start, end), end
+
+    @staticmethod
+    def _mono(samples: np.ndarray) -> np.ndarray:
+        return samples[:, 0] if samples.ndim > 1 else samples
+
+    @staticmethod
+    def cut_clip(sample_rate: int, samples: np.ndarray, prediction_time: float, prediction_duration: float,
+                 padding: Optional[float]) -> AudioClip:
+        """Prediction window plus `padding` seconds on each side of a decoded recording (all of it if None), as a view"""
+        samples = AudioProcessor._mono(samples)
+        start, end = AudioProcessor.clip_bounds(sample_rate, len(samples), prediction_time, prediction_duration, padding)
+        return AudioClip(sample_rate, samples[start:end], start / sample_rate, start == 0 and end == len(samples))
+
+    @staticmethod
+    @instrumented("audio.encode_wav")
+    def encode_wav(clip: AudioClip) -> io.BytesIO:
+        from scipy.io import wavfile
+        # copies only the samples of the clip
+        buffer = io.BytesIO()
+        wavfile.write(buffer, clip.sample_rate, np.ascontiguousarray(clip.samples))
+        buffer.seek(0)
+        return buffer
+
+class AudioPrefetcher:
+    """
+    Warms the audio cache in the background for the rows currently shown.
+
+    One bounded thread pool is shared by every session so the Pi never sees
+    more than Config.AUDIO_PREFETCH_WORKERS concurrent audio downloads from
+    prefetching; a recording already in flight is never requested twice.
+    Every recording is downloaded from its own station, stations whose
+    circuit is open are skipped. With Config.AUDIO_PARTIAL_DOWNLOAD and the
+    windows of the detections, only the segments around them are downloaded.
+    """
+
+    _pool = ThreadPoolExecutor(max_workers=Config.AUDIO_PREFETCH_WORKERS, thread_name_prefix="audio-prefetch")
+    _in_flight: Dict[str, Future] = {}     # by AudioCache.key, plus the window of partial downloads
+    _lock = threading.RLock()
+
+    @staticmethod
+    def _partial(window: Optional[Tuple[float, float]]) -> bool:
+        return window is not None and Config.AUDIO_PARTIAL_DOWNLOAD
+
+    @staticmethod
+    def _key(filename: int, station: Optional[str], window: Optional[Tuple[float, float]]) -> str:
+        key = AudioCache.key(filename, station)
+        return f"{key}@{window[0]:g}+{window[1]:g}" if AudioPrefetcher._partial(window) else key
+
+    @staticmethod
+    def _download(filename: int, station: Optional[str] = None, window: Optional[Tuple[float, float]] = None) -> bool:
+        if AudioCache.contains(filename, station):
+            return True
+        if AudioPrefetcher._partial(window):
+            AudioSegments.fetch(filename, *AudioProcessor.clip_seconds(*window, Config.AUDIO_CLIP_PADDING), station)
+        else:
+            AudioProcessor.save_audio(filename, APIClient.station(station).download_audio(filename), station)
+        return True
 
-            trimmed_audio = full_audio[:]
+    @classmethod
+    def _forget(cls, key: str, future: Future):
+        with cls._lock:
+            if cls._in_flight.get(key) is future:
+                del cls._in_flight[key]
 
-            output_buffer = io.BytesIO()
-            trimmed_audio.export(output_buffer, format="wav")
-            output_buffer.seek(0)
-            return output_buffer
+    @classmethod
+    def prefetch(cls, filenames: Iterable[int], stations: Optional[Iterable[str]] = None,
+                 windows: Optional[Iterable[Tuple[float, float]]] = None):
+        """
+        Queue the downloads of the given filenames (of the given stations, the
+        default one if None) not cached yet; `windows` are the
+        (prediction_time, prediction_duration) of the detections, for the
+        partial downloads.
+        """
+        filenames = [int(f) for f in filenames]
+        stations = [None] * len(filenames) if stations is None else list(stations)
+        windows = [None] * len(filenames) if windows is None else [(float(t), float(d)) for t, d in windows]
+        with cls._lock:
+            for filename, station, window in dict.fromkeys(zip(filenames, stations, windows)):
+                key = cls._key(filename, station, window)
+                if key in cls._in_flight or HTTPSession.is_circuit_open(APIClient.station(station).station) \
+                        or AudioCache.contains(filename, station):
+                    continue
+                future = cls._pool.submit(cls._download, filename, station, window)
+                cls._in_flight[key] = future
+                future.add_done_callback(lambda f, key=key: cls._forget(key, f))
+
+    @classmethod
+    def fetch(cls, filename: int, station: Optional[str] = None, window: Optional[Tuple[float, float]] = None) -> bool:
+        """
+        Blocking download for the script thread: joins a download already in
+        progress, otherwise downloads right away instead of queueing behind
+        the prefetches.
+        """
+        key = cls._key(filename, station, window)
+        with cls._lock:
+            future = cls._in_flight.get(key)
+            if future is not None and future.cancel():
+                future = None   # still queued, not worth waiting for
+            owner = future is None
+            if owner:
+                future = Future()
+                cls._in_flight[key] = future
+
+        if not owner:
+            return future.result()
+        try:
+            future.set_result(cls._download(filename, station, window))
         except Exception as e:
-            logging.error("Error while trying to extract segment from audio: {e}")
+            future.set_exception(e)
             raise
+        finally:
+            cls._forget(key, future)
+        return future.result()
+
+# STFT parameters of create_spectrogram_xc, part of the spectrogram cache key
+SPECTROGRAM_NPERSEG = 1024
+SPECTROGRAM_NOVERLAP = int(SPECTROGRAM_NPERSEG * 0.75)
+SPECTROGRAM_FMAX = 12000  # Hz
+
+class Spectrogram(NamedTuple):
+    freqs: np.ndarray
+    times: np.ndarray
+    Sxx_db: np.ndarray      # clipped to [vmin, vmax]
+    vmin: float
+    vmax: float
 
 class SpectrogramGenerator:
     @staticmethod
-    def create_spectrogram(audio_buffer: io.BytesIO) -> plt.Figure:
+    def create_spectrogram(audio_buffer: io.BytesIO) -> "plt.Figure":
+        import matplotlib.pyplot as plt
+        from scipy import signal
+        from scipy.io import wavfile
         try:
             sample_rate, samples = wavfile.read(audio_buffer)
             if len(samples.shape) > 1:
@@ -79,68 +276,127 @@ class SpectrogramGenerator:
             raise
 
     @staticmethod
-    def create_spectrogram_xc(audio_buffer: io.BytesIO, prediction_time: float, prediction_duration: float) -> plt.Figure:
+    def create_spectrogram_xc(audio_buffer: io.BytesIO, prediction_time: float, prediction_duration: float) -> "plt.Figure":
+        from scipy.io import wavfile
         try:
             sample_rate, samples = wavfile.read(audio_buffer)
-            if samples.ndim > 1:
-                samples = samples[:, 0]  # mono
-
-            # STFT params
-            # Hann window, relatively long window for better freq detail on whistles
-            nperseg = 1024 
-            noverlap = int(nperseg * 0.75)
-            window = "hann"
-
-            freqs, times, Sxx = signal.spectrogram(
-                samples,
-                fs=sample_rate,
-                window=window,
-                nperseg=nperseg,
-                noverlap=noverlap,
-                nfft=nperseg,
-                mode="psd",
-                scaling="density"
-            )
-
-            # convert to dB and clamp dynamic range (70–80 dB)
-            eps = 1e-12
-            Sxx_db = 10 * np.log10(Sxx + eps)
-            vmax = np.max(Sxx_db)
-            dyn_range = 80.0  # try 60–80 dB
-            vmin = vmax - dyn_range
-            Sxx_db = np.clip(Sxx_db, vmin, vmax)
-
-            # limit frequency 12 kHz
-            fmax = 12000  # Hz
-            fmask = freqs <= fmax
-            freqs_plot = freqs[fmask]
-            Sxx_db_plot = Sxx_db[fmask, :]
-
-            fig, ax = plt.subplots(figsize=(12, 6))
-            im = ax.pcolormesh(
-                times,
-                freqs_plot,
-                Sxx_db_plot,
-                # shading="gouraud",
-                cmap="gray_r",
-                vmin=vmin,
-                vmax=vmax
-            )
-            ax.set_ylabel("Frequency (Hz)")
-            ax.set_xlabel("Time (s)")
-            rect = patches.Rectangle(
-                (prediction_time, freqs_plot.min()),
-                prediction_duration,
-                freqs_plot.max() - freqs_plot.min(),
-                linewidth=1,
-                edgecolor='blue',
-                facecolor='none'
-            )
-            ax.add_patch(rect)
-
-
-            fig.tight_layout()
-            return fig
+            spectrogram = SpectrogramGenerator.compute_spectrogram_db(samples, sample_rate)
+            return SpectrogramGenerator.render_spectrogram(spectrogram, prediction_time, prediction_duration)
         except Exception as e:
             logger.error(f"Error while creating spectrogram: {e}")
             raise
+
+    @staticmethod
+    @instrumented("spectrogram.stft")
+    def compute_spectrogram_db(samples: np.ndarray, sample_rate: int,
+                               nperseg: int = SPECTROGRAM_NPERSEG,
+                               noverlap: int = SPECTROGRAM_NOVERLAP,
+                               fmax: int = SPECTROGRAM_FMAX,
+                               time_offset: float = 0.0) -> Spectrogram:
+        from scipy import signal
+        if samples.ndim > 1:
+            samples = samples[:, 0]  # mono
+
+        # STFT params
+        # Hann window, relatively long window for better freq detail on whistles
+        window = "hann"
+
+        freqs, times, Sxx = signal.spectrogram(
+            samples,
+            fs=sample_rate,
+            window=window,
+            nperseg=nperseg,
+            noverlap=noverlap,
+            nfft=nperseg,
+            mode="psd",
+            scaling="density"
+        )
+
+        # convert to dB and clamp dynamic range (70–80 dB)
+        eps = 1e-12
+        Sxx_db = 10 * np.log10(Sxx + eps)
+        vmax = np.max(Sxx_db)
+        dyn_range = 80.0  # try 60–80 dB
+        vmin = vmax - dyn_range
+        Sxx_db = np.clip(Sxx_db, vmin, vmax)
+
+        # limit frequency (12 kHz by default)
+        fmask = freqs <= fmax
+        return Spectrogram(freqs[fmask], times + time_offset, Sxx_db[fmask, :], float(vmin), float(vmax))
+
+    @staticmethod
+    @instrumented("spectrogram.render")
+    def render_spectrogram(spectrogram: Spectrogram, prediction_time: float, prediction_duration: float) -> "plt.Figure":
+        import matplotlib.patches as patches
+        import matplotlib.pyplot as plt
+        freqs_plot = spectrogram.freqs
+        fig, ax = plt.subplots(figsize=(12, 6))
+        im = ax.pcolormesh(
+            spectrogram.times,
+            freqs_plot,
+            spectrogram.Sxx_db,
+            # shading="gouraud",
+            cmap="gray_r",
+            vmin=spectrogram.vmin,
+            vmax=spectrogram.vmax
+        )
+        ax.set_ylabel("Frequency (Hz)")
+        ax.set_xlabel("Time (s)")
+        rect = patches.Rectangle(
+            (prediction_time, freqs_plot.min()),
+            prediction_duration,
+            freqs_plot.max() - freqs_plot.min(),
+            linewidth=1,
+            edgecolor='blue',
+            facecolor='none'
+        )
+        ax.add_patch(rect)
+
+
+        fig.tight_layout()
+        return fig
+
+    @staticmethod
+    @instrumented("spectrogram.render")
+    def render_spectrogram_raster(spectrogram: Spectrogram, prediction_time: float, prediction_duration: float,
+                                  width: int = None, height: int = None) -> np.ndarray:
+        """
+        Fast alternative to render_spectrogram: the dB matrix is mapped through
+        gray_r into a uint8 RGB array with NumPy and the prediction window is
+        drawn straight into the pixels. Time columns are max-pooled down to
+        `width` so short calls stay visible; frequency rows are resampled to
+        `height` with low frequencies at the bottom.
+        """
+        width = width or Config.SPECTROGRAM_RASTER_WIDTH
+        height = height or Config.SPECTROGRAM_RASTER_HEIGHT
+        Sxx_db = spectrogram.Sxx_db
+        n_freqs, n_times = Sxx_db.shape
+
+        if n_times > width:
+            starts = np.linspace(0, n_times, width, endpoint=False).astype(np.intp)
+            Sxx_db = np.maximum.reduceat(Sxx_db, starts, axis=1)
+        else:
+            Sxx_db = Sxx_db[:, np.linspace(0, n_times - 1, width).round().astype(np.intp)]
+        Sxx_db = Sxx_db[np.linspace(n_freqs - 1, 0, height).round().astype(np.intp), :]
+
+        # gray_r: vmin -> white, vmax -> black
+        scale = 255.0 / max(spectrogram.vmax - spectrogram.vmin, 1e-12)
+        levels = np.clip((np.asarray(Sxx_db, dtype=np.float32) - spectrogram.vmin) * scale, 0, 255).astype(np.uint8)
+        gray_r = np.arange(255, -1, -1, dtype=np.uint8)
+        image = np.repeat(gray_r[levels][:, :, np.newaxis], 3, axis=2)
+
+        # prediction window, blue, full frequency range as in render_spectrogram
+        times = spectrogram.times
+        t0, t1 = (times[0], times[-1]) if len(times) > 1 else (0.0, 1.0)
+        left, right = np.clip(
+            np.round((np.array([prediction_time, prediction_time + prediction_duration]) - t0) / (t1 - t0) * (width - 1)),
+            0, width - 1
+        ).astype(int)
+        blue = np.array([0, 0, 255], dtype=np.uint8)
+        line = Config.SPECTROGRAM_RASTER_LINE_WIDTH
+        image[:, left:left + line] = blue
+        image[:, max(right - line + 1, 0):right + 1] = blue
+        image[:line, left:right + 1] = blue
+        image[-line:, left:right + 1] = blue
+        return image
+
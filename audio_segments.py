@@ -0,0 +1,259 @@
+from config import Config
+from instrumentation import Instrumentation, instrumented
+import json
+import logging
+import math
+import os
+import shutil
+import struct
+import threading
+import numpy as np
+import requests
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Tuple
+from api_client import APIClient
+from audio_cache import AudioCache
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+HEADER_NAME = "header.json"
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+# (format tag, bits per sample) read straight from the bytes, with the dtype scipy's wavfile gives them
+PCM_DTYPES = {(1, 8): "u1", (1, 16): "<i2", (1, 32): "<i4", (3, 32): "<f4", (3, 64): "<f8"}
+
+class WavLayout(NamedTuple):
+    size: int           # bytes of the whole file
+    data_offset: int    # first byte of the samples
+    frames: int
+    sample_rate: int
+    channels: int
+    dtype: str
+
+    @property
+    def block_align(self) -> int:
+        return self.channels * np.dtype(self.dtype).itemsize
+
+    @staticmethod
+    def parse(head: bytes, size: int) -> "WavLayout":
+        """Layout of a PCM WAV of `size` bytes from its first bytes, ValueError if they do not reach the data chunk"""
+        if head[:4] != b"RIFF" or head[8:12] != b"WAVE":
+            raise ValueError("not a RIFF WAVE file")
+        fmt, pos = None, 12
+        while pos + 8 <= len(head):
+            chunk_id, chunk_size = head[pos:pos + 4], struct.unpack_from("<I", head, pos + 4)[0]
+            if chunk_id == b"fmt " and pos + 24 <= len(head):
+                format_tag, channels, sample_rate, _, _, bits = struct.unpack_from("<HHIIHH", head, pos + 8)
+                if format_tag == WAVE_FORMAT_EXTENSIBLE and pos + 34 <= len(head):
+                    format_tag = struct.unpack_from("<H", head, pos + 32)[0]     # first bytes of the SubFormat GUID
+                fmt = (format_tag, bits, channels, sample_rate)
+            elif chunk_id == b"data":
+                if fmt is None:
+                    raise ValueError("data chunk before the fmt chunk")
+                format_tag, bits, channels, sample_rate = fmt
+                dtype = PCM_DTYPES.get((format_tag, bits))
+                if dtype is None:
+                    raise ValueError(f"unsupported WAV encoding (format {format_tag}, {bits} bits)")
+                data_offset = pos + 8
+                # recorders that stream the file may leave the size of the data chunk unset
+                data_size = size - data_offset if chunk_size in (0, 0xFFFFFFFF) else min(chunk_size, size - data_offset)
+                return WavLayout(size, data_offset, data_size // (channels * bits // 8), sample_rate, channels, dtype)
+            pos += 8 + chunk_size + (chunk_size & 1)
+        raise ValueError(f"no data chunk in the first {len(head)} bytes")
+
+class AudioSegments:
+    """
+    Sparse cache of the recordings downloaded by byte range, one directory
+    per AudioCache.key in Config.AUDIO_SEGMENT_DIR.
+
+    The first Config.AUDIO_HEADER_BYTES of the WAV give its layout (kept as
+    header.json); then only the segments of Config.AUDIO_SEGMENT_SECONDS
+    covering a clip are requested, consecutive missing ones in a single Range
+    request, and kept one file each (<index>.pcm) so that the neighbouring
+    detections of a recording reuse them. A Pi that ignores Range answers
+    with the whole recording, which goes to the AudioCache as a normal
+    download; so does a WAV whose samples cannot be read by range (e.g.
+    24-bit PCM). The recordings read least recently are removed beyond
+    Config.AUDIO_SEGMENT_MAX_BYTES, the segments of a recording once it is
+    cached whole.
+    """
+
+    _lock = threading.Lock()    # eviction only, segment files are written atomically
+
+    @staticmethod
+    def _dir(filename: int, station: Optional[str] = None) -> Path:
+        return Config.AUDIO_SEGMENT_DIR / AudioCache.key(filename, station)
+
+    @staticmethod
+    def contains(filename: int, station: Optional[str] = None) -> bool:
+        return AudioSegments.contains_key(AudioCache.key(filename, station))
+
+    @staticmethod
+    def contains_key(key: str) -> bool:
+        """Whether segments of the recording with AudioCache.key `key` are cached"""
+        return (Config.AUDIO_SEGMENT_DIR / key / HEADER_NAME).exists()
+
+    @staticmethod
+    def layout(filename: int, station: Optional[str] = None) -> WavLayout:
+        with open(AudioSegments._dir(filename, station) / HEADER_NAME) as f:
+            return WavLayout(**json.load(f))
+
+    @staticmethod
+    def info(filename: int, station: Optional[str] = None) -> Tuple[int, int]:
+        """Sample rate and number of frames of a recording, as AudioCache.info"""
+        layout = AudioSegments.layout(filename, station)
+        return layout.sample_rate, layout.frames
+
+    @staticmethod
+    def _segment_frames(layout: WavLayout) -> int:
+        return max(int(Config.AUDIO_SEGMENT_SECONDS * layout.sample_rate), 1)
+
+    @staticmethod
+    def _segments(layout: WavLayout, start: int, stop: int) -> range:
+        """Indices of the segments holding the frames [start, stop)"""
+        frames = AudioSegments._segment_frames(layout)
+        return range(start // frames, (max(stop, start + 1) - 1) // frames + 1)
+
+    @staticmethod
+    def _byte_range(layout: WavLayout, first: int, last: int) -> Tuple[int, int]:
+        """First and last byte (included, as in a Range header) of the segments first..last"""
+        frames = AudioSegments._segment_frames(layout)
+        start = layout.data_offset + first * frames * layout.block_align
+        return start, layout.data_offset + min((last + 1) * frames, layout.frames) * layout.block_align - 1
+
+    @staticmethod
+    def _missing_runs(directory: Path, segments: range) -> List[Tuple[int, int]]:
+        """Consecutive segments not downloaded yet, as (first, last)"""
+        runs = []
+        for index in segments:
+            if (directory / f"{index}.pcm").exists():
+                continue
+            if runs and runs[-1][1] == index - 1:
+                runs[-1] = (runs[-1][0], index)
+            else:
+                runs.append((index, index))
+        return runs
+
+    @staticmethod
+    def _download_whole(filename: int, station: Optional[str], data: Optional[bytes] = None):
+        """Falls back to the AudioCache, with the body of a response that already holds the whole recording if any"""
+        if data is None:
+            data = APIClient.station(station).download_audio(filename)
+        path = AudioCache.put(filename, data, station)
+        AudioSegments.discard(filename, station)
+        logger.info(f"Audio {path.name} has been saved whole.")
+
+    @staticmethod
+    def _fetch_layout(filename: int, station: Optional[str]) -> Optional[WavLayout]:
+        """Layout of the recording, downloading its header if needed; None if the recording was cached whole instead"""
+        directory = AudioSegments._dir(filename, station)
+        if (directory / HEADER_NAME).exists():
+            return AudioSegments.layout(filename, station)
+        response = APIClient.station(station).download_audio_range(filename, 0, Config.AUDIO_HEADER_BYTES - 1)
+        if response.status_code != 206:
+            AudioSegments._download_whole(filename, station, response.content)
+            return None
+        try:
+            size = int(response.headers.get("Content-Range", "").rsplit("/", 1)[1])
+            layout = WavLayout.parse(response.content, size)
+        except (IndexError, ValueError) as e:
+            logger.info(f"Audio {filename} cannot be read by range ({e}), downloading it whole")
+            AudioSegments._download_whole(filename, station)
+            return None
+        directory.mkdir(parents=True, exist_ok=True)
+        AudioCache._write_atomic(directory / HEADER_NAME, json.dumps(layout._asdict()).encode())
+        return layout
+
+    @staticmethod
+    @instrumented("audio.segments")
+    def fetch(filename: int, start: float, end: Optional[float], station: Optional[str] = None):
+        """
+        Downloads the segments of the recording holding the seconds [start,
+        end) (to its end if `end` is None) that are not cached yet. Afterwards
+        either the segments or the whole recording in the AudioCache can be
+        read. Raises requests exceptions.
+        """
+        layout = AudioSegments._fetch_layout(filename, station)
+        if layout is None:
+            return
+        first = max(int(start * layout.sample_rate), 0)
+        last = layout.frames if end is None else min(int(math.ceil(end * layout.sample_rate)), layout.frames)
+        directory = AudioSegments._dir(filename, station)
+        runs = AudioSegments._missing_runs(directory, AudioSegments._segments(layout, min(first, last), last))
+        Instrumentation.count("cache_misses" if runs else "cache_hits")
+
+        client = APIClient.station(station)
+        for first_segment, last_segment in runs:
+            byte_start, byte_end = AudioSegments._byte_range(layout, first_segment, last_segment)
+            response = client.download_audio_range(filename, byte_start, byte_end)
+            if response.status_code != 206:
+                AudioSegments._download_whole(filename, station, response.content)
+                return
+            data = response.content
+            if len(data) != byte_end - byte_start + 1:
+                raise requests.exceptions.ContentDecodingError(
+                    f"Audio {filename}: got {len(data)} bytes for range {byte_start}-{byte_end}"
+                )
+            segment_bytes = AudioSegments._segment_frames(layout) * layout.block_align
+            for i, index in enumerate(range(first_segment, last_segment + 1)):
+                AudioCache._write_atomic(directory / f"{index}.pcm", data[i * segment_bytes:(i + 1) * segment_bytes])
+        if runs:
+            AudioSegments._enforce_limit(keep=directory.name)
+
+    @staticmethod
+    def read(filename: int, start: int = 0, stop: Optional[int] = None,
+             station: Optional[str] = None) -> Tuple[int, np.ndarray]:
+        """Sample rate and frames [start, stop) of a recording from its segments, as AudioCache.read"""
+        layout = AudioSegments.layout(filename, station)
+        stop = layout.frames if stop is None else min(stop, layout.frames)
+        start = min(start, stop)
+        if start == stop:
+            return layout.sample_rate, np.zeros((0, layout.channels) if layout.channels > 1 else 0, dtype=layout.dtype)
+        directory = AudioSegments._dir(filename, station)
+        segments = AudioSegments._segments(layout, start, stop)
+        data = b"".join((directory / f"{index}.pcm").read_bytes() for index in segments)
+        os.utime(directory / HEADER_NAME)   # last access, for the eviction
+        samples = np.frombuffer(data, dtype=layout.dtype).reshape(-1, layout.channels)
+        if layout.channels == 1:
+            samples = samples[:, 0]
+        offset = segments.start * AudioSegments._segment_frames(layout)
+        return layout.sample_rate, samples[start - offset:stop - offset]
+
+    @staticmethod
+    def discard(filename: int, station: Optional[str] = None):
+        shutil.rmtree(AudioSegments._dir(filename, station), ignore_errors=True)
+
+    @staticmethod
+    def clear():
+        """Removes every recording of the segments cache, as AudioCache.clear does for the whole ones"""
+        with AudioSegments._lock:
+            keys = [directory.name for directory in Config.AUDIO_SEGMENT_DIR.iterdir() if directory.is_dir()]
+            for key in keys:
+                shutil.rmtree(Config.AUDIO_SEGMENT_DIR / key, ignore_errors=True)
+        AudioCache.notify_evicted(keys)
+
+    @staticmethod
+    def _enforce_limit(keep: str):
+        """Removes the recordings read least recently until the segments fit in Config.AUDIO_SEGMENT_MAX_BYTES"""
+        with AudioSegments._lock:
+            recordings = []
+            for directory in Config.AUDIO_SEGMENT_DIR.iterdir():
+                try:
+                    last_access = (directory / HEADER_NAME).stat().st_mtime
+                    size = sum(path.stat().st_size for path in directory.iterdir())
+                except OSError:
+                    continue    # removed meanwhile
+                recordings.append((last_access, directory, size))
+            total = sum(size for _, _, size in recordings)
+            evicted = []
+            for _, directory, size in sorted(recordings, key=lambda recording: recording[0]):
+                if total <= Config.AUDIO_SEGMENT_MAX_BYTES:
+                    break
+                if directory.name == keep:
+                    continue
+                shutil.rmtree(directory, ignore_errors=True)
+                total -= size
+                evicted.append(directory.name)
+        if evicted:
+            logger.info(f"Evicted {len(evicted)} recordings from the audio segments")
+            AudioCache.notify_evicted(evicted)
@@ -0,0 +1,134 @@
+"""
+Exporting the clips of a set of detections, against a local stub of the Pi
+API with some latency: one detection at a time as clicking through the table
+does (download to the audio cache, cut, encode, zip) vs AudioExporter. Checks the
+archive against the recordings, the peak memory of exports of different
+sizes and the resume of an interrupted export.
+
+Run from the repository root:  python -m benchmarks.bench_audio_export
+"""
+import io
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from scipy.io import wavfile
+
+from config import Config
+from audio_export import AudioExporter
+from audio_processor import AudioPrefetcher, AudioProcessor
+from data_processor import DataProcessor
+from benchmarks.stub_pi import StubPi
+from benchmarks.synthetic import make_clip, make_payload
+
+RECORDINGS = 120
+DETECTIONS_PER_RECORDING = 4
+SAMPLE_RATE = 16_000
+LATENCY = 0.05   # seconds per request of the stub
+START_TS = 1_750_000_020
+
+class Interrupted(Exception):
+    pass
+
+def detections_frame(payload) -> pd.DataFrame:
+    return DataProcessor.compact(pd.DataFrame(payload))
+
+def one_at_a_time(df: pd.DataFrame, archive: Path):
+    """What exporting by hand amounts to: every detection selected, downloaded if needed, cut, saved, then zipped"""
+    with zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=Config.EXPORT_COMPRESSLEVEL) as zf:
+        for i, (filename, start_time, duration) in enumerate(zip(df["filename"], df["start_time"], df["duration"])):
+            AudioPrefetcher.fetch(int(filename))
+            clip = AudioProcessor.load_clip(int(filename), int(start_time) - int(filename), float(duration))
+            zf.writestr(f"{i}_{filename}_{start_time}.wav", AudioProcessor.encode_wav(clip).getvalue())
+
+def peak_memory(fn) -> int:
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def main():
+    samples = make_clip(60, sample_rate=SAMPLE_RATE)
+    buffer = io.BytesIO()
+    wavfile.write(buffer, SAMPLE_RATE, samples)
+    recording = buffer.getvalue()   # the same minute for every recording
+
+    payload = make_payload(RECORDINGS * DETECTIONS_PER_RECORDING * 2, start_ts=START_TS, span_seconds=RECORDINGS * 60)
+    df = detections_frame(payload).drop_duplicates(["start_time", "filename", "species"])
+    filenames = np.unique(df["filename"].to_numpy())[:RECORDINGS]
+    df = df[df["filename"].isin(filenames)].reset_index(drop=True)
+    audio = {int(f): recording for f in filenames}
+
+    with tempfile.TemporaryDirectory() as workdir, StubPi(payload, latency=LATENCY, audio=audio) as stub:
+        workdir = Path(workdir)
+        Config.STATIONS = {"stub": stub.api_base}
+        Config.EXPORT_WORKERS = 4
+        Config.AUDIO_PLAYBACK_FORMAT = "wav"   # no Opus copies encoded in background by the clicks
+        Config.AUDIO_CACHE_DIR = workdir / "audio"
+        Config.AUDIO_CACHE_DIR.mkdir()
+        print(f"{len(df)} detections in {len(filenames)} recordings, {LATENCY * 1000:.0f} ms per request")
+
+        start = time.perf_counter()
+        one_at_a_time(df, workdir / "by_hand.zip")
+        t_by_hand = time.perf_counter() - start
+        print(f"  one at a time     {t_by_hand:6.2f} s")
+
+        Config.AUDIO_CACHE_DIR = workdir / "empty_audio_cache"   # nothing cached, as for a new selection
+        Config.AUDIO_CACHE_DIR.mkdir()
+        before = len(stub.requests)
+        start = time.perf_counter()
+        result = AudioExporter.export(df, workdir / "export.zip")
+        t_export = time.perf_counter() - start
+        print(f"  AudioExporter     {t_export:6.2f} s   {len(stub.requests) - before} requests, "
+              f"{result.archive.stat().st_size / 2**20:.1f} MB archive")
+        assert result.clips == len(df) and not result.failed and len(stub.requests) - before == len(filenames)
+        assert not list(Config.AUDIO_CACHE_DIR.glob("*.wav"))
+
+        # clips and manifest match the recordings
+        with zipfile.ZipFile(result.archive) as zf:
+            manifest = pd.read_csv(zf.open(AudioExporter.MANIFEST_NAME))
+            assert len(manifest) == len(df) and len(set(manifest["clip"])) == len(df)
+            assert len(pd.read_parquet(io.BytesIO(zf.read(AudioExporter.PARQUET_NAME)))) == len(df)
+            for row in manifest.sample(10, random_state=0).itertuples():
+                sample_rate, clip = wavfile.read(io.BytesIO(zf.read(row.clip)))
+                expected = AudioProcessor.cut_clip(SAMPLE_RATE, samples, row.start_time - row.filename, row.duration,
+                                                   Config.AUDIO_CLIP_PADDING)
+                assert sample_rate == SAMPLE_RATE and np.array_equal(clip, expected.samples)
+                assert row.clip_offset == expected.offset
+        print("  clips match the recordings")
+
+        # exporting the same detections again: nothing to do
+        before = len(stub.requests)
+        assert AudioExporter.export(df, result.archive).resumed == len(filenames) and len(stub.requests) == before
+
+        # peak memory does not grow with the number of clips
+        half = df[df["filename"].isin(filenames[:RECORDINGS // 2])]
+        peaks = [peak_memory(lambda: AudioExporter.export(part, workdir / f"memory_{len(part)}.zip")) for part in (half, df)]
+        print(f"  peak memory {peaks[0] / 2**20:.1f} MB ({len(half)} clips), {peaks[1] / 2**20:.1f} MB ({len(df)} clips)")
+        assert peaks[1] < peaks[0] * 1.5
+
+        # an export interrupted halfway only downloads the rest when started again
+        def interrupt(done, total):
+            if done >= total // 2:
+                raise Interrupted()
+        try:
+            AudioExporter.export(df, workdir / "resumed.zip", progress=interrupt)
+        except Interrupted:
+            pass
+        before = len(stub.requests)
+        result = AudioExporter.export(df, workdir / "resumed.zip")
+        print(f"  resumed export: {result.resumed} recordings kept, {len(stub.requests) - before} downloaded")
+        assert result.clips == len(df) and result.resumed >= len(filenames) // 2
+        assert len(stub.requests) - before == len(filenames) - result.resumed
+        assert not (workdir / "resumed.zip.parts").exists()
+
+    print(f"  speedup {t_by_hand / t_export:.1f}x")
+
+if __name__ == "__main__":
+    main()
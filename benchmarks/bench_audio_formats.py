@@ -0,0 +1,97 @@
+"""
+Audio cache formats: recordings cached as WAV (played as a WAV clip) vs
+FLAC with an Opus copy for playback. Reports the disk footprint, the time
+spent transcoding on download, the bytes st.audio sends to the browser per
+view and the time to get the samples of a clip, and checks that FLAC gives
+back the same samples and spectrogram as WAV.
+
+Run from the repository root:  python -m benchmarks.bench_audio_formats
+"""
+import io
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from scipy.io import wavfile
+
+from config import Config
+from audio_cache import AudioCache
+from audio_processor import AudioProcessor, SpectrogramGenerator
+from benchmarks.synthetic import make_clip
+
+RECORDINGS = 20
+SECONDS = 15
+SAMPLE_RATE = 48_000
+VIEWS = 5   # clips looked at per recording
+START_TS = 1_750_000_000
+
+def run(workdir: Path, cache_format: str, playback_format: str, recordings: dict) -> dict:
+    Config.AUDIO_CACHE_FORMAT, Config.AUDIO_PLAYBACK_FORMAT = cache_format, playback_format
+    Config.AUDIO_CACHE_DIR = workdir / cache_format
+    Config.AUDIO_CACHE_DIR.mkdir()
+
+    start = time.perf_counter()
+    for filename, data in recordings.items():
+        AudioCache.put(filename, data)
+    t_put = time.perf_counter() - start
+    if playback_format == "opus":
+        # encoded in background by the cache
+        while not all(AudioCache.playback_path(filename) for filename in recordings):
+            time.sleep(0.01)
+    t_playback = time.perf_counter() - start - t_put
+    disk = sum(path.stat().st_size for path in Config.AUDIO_CACHE_DIR.iterdir() if path.name != AudioCache.INDEX_NAME)
+
+    sent, t_lazy, t_decode, clips = 0, 0.0, 0.0, {}
+    for filename in recordings:
+        for prediction_time in np.linspace(1, SECONDS - 4, VIEWS):
+            start = time.perf_counter()
+            clip = AudioProcessor.load_clip(filename, prediction_time, 3.0)
+            t_lazy += time.perf_counter() - start     # spectrogram cached: nothing else needed for FLAC
+            playback_path = AudioCache.playback_path(filename)
+            sent += playback_path.stat().st_size if playback_path else len(AudioProcessor.encode_wav(clip).getvalue())
+            start = time.perf_counter()
+            clips[(filename, prediction_time)] = np.array(clip.samples)
+            t_decode += time.perf_counter() - start
+    views = len(recordings) * VIEWS
+    return {"put": t_put / len(recordings), "playback": t_playback / len(recordings), "disk": disk,
+            "sent": sent / views, "lazy": t_lazy / views, "decode": t_decode / views, "clips": clips}
+
+def compare(name: str, gain: float):
+    """WAV vs FLAC + Opus on recordings scaled by `gain`, returns the results of both"""
+    recordings = {}
+    for i in range(RECORDINGS):
+        buffer = io.BytesIO()
+        wavfile.write(buffer, SAMPLE_RATE, (make_clip(SECONDS, SAMPLE_RATE, seed=i) * gain).astype(np.int16))
+        recordings[START_TS + i * 60] = buffer.getvalue()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        wav = run(Path(workdir), "wav", "wav", recordings)
+        flac = run(Path(workdir), "flac", "opus", recordings)
+
+    print(f"{name}: {RECORDINGS} recordings of {SECONDS} s at {SAMPLE_RATE} Hz, {VIEWS} clips viewed per recording")
+    print(f"  {'':22s} {'disk':>9s} {'put':>9s} {'opus (bg)':>10s} {'sent/view':>10s} "
+          f"{'clip, spectrogram cached':>25s} {'clip samples':>13s}")
+    for label, result in (("WAV", wav), ("FLAC + Opus playback", flac)):
+        print(f"  {label:22s} {result['disk'] / 2**20:6.1f} MB {result['put'] * 1000:6.1f} ms "
+              f"{result['playback'] * 1000:7.1f} ms {result['sent'] / 1024:7.1f} KB "
+              f"{result['lazy'] * 1000:22.2f} ms {result['decode'] * 1000:10.2f} ms")
+    print(f"  disk {flac['disk'] / wav['disk']:.0%} of WAV, {flac['sent'] / wav['sent']:.0%} of the bytes sent to the browser")
+    assert flac["disk"] < wav["disk"] and flac["sent"] < wav["sent"]
+    return wav, flac
+
+def main():
+    compare("Full scale", 1.0)
+    # closer to a field recording: background noise some 24 dB lower
+    wav, flac = compare("Quiet", 1 / 16)
+
+    # lossless: same samples, same spectrogram
+    for key, samples in wav["clips"].items():
+        assert np.array_equal(samples, flac["clips"][key])
+    key = next(iter(wav["clips"]))
+    spectrograms = [SpectrogramGenerator.compute_spectrogram_db(result["clips"][key], SAMPLE_RATE) for result in (wav, flac)]
+    assert np.array_equal(spectrograms[0].Sxx_db, spectrograms[1].Sxx_db)
+    print("  same samples and spectrograms")
+
+if __name__ == "__main__":
+    main()
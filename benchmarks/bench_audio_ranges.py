@@ -0,0 +1,92 @@
+"""
+Opening the detections of a set of recordings, against a local stub of the
+Pi API with some latency and a limited bandwidth: whole recordings
+downloaded vs only the segments around each detection (HTTP Range), and
+the fallback to whole downloads when the server ignores Range. Reports
+time, bytes and requests, and checks the clips are the same either way.
+
+Run from the repository root:  python -m benchmarks.bench_audio_ranges
+"""
+import io
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from scipy.io import wavfile
+
+from config import Config
+from audio_cache import AudioCache
+from audio_processor import AudioPrefetcher, AudioProcessor
+from audio_segments import AudioSegments
+from benchmarks.stub_pi import StubPi
+from benchmarks.synthetic import make_clip
+
+RECORDINGS = 20
+SECONDS = 60
+SAMPLE_RATE = 48_000
+LATENCY = 0.02                  # seconds per request of the stub
+BANDWIDTH = 4 * 2**20           # bytes per second, a Pi on Wi-Fi
+START_TS = 1_750_000_020
+
+def open_detections(workdir: Path, name: str, detections, partial: bool) -> dict:
+    """Every detection opened as from the table: download, then the clip samples"""
+    Config.AUDIO_PARTIAL_DOWNLOAD = partial
+    Config.AUDIO_CACHE_DIR = workdir / name / "audio"
+    Config.AUDIO_SEGMENT_DIR = workdir / name / "segments"
+    Config.AUDIO_CACHE_DIR.mkdir(parents=True)
+    clips = {}
+    start = time.perf_counter()
+    for filename, prediction_time, duration in detections:
+        AudioPrefetcher.fetch(filename, window=(prediction_time, duration))
+        clip = AudioProcessor.load_clip(filename, prediction_time, duration)
+        clips[(filename, prediction_time)] = np.array(clip.samples)
+    return {"time": time.perf_counter() - start, "clips": clips}
+
+def main():
+    rng = np.random.default_rng(0)
+    audio, detections = {}, []
+    for i in range(RECORDINGS):
+        samples = make_clip(SECONDS, SAMPLE_RATE, seed=i)
+        if i == 0:
+            samples = np.stack([samples, samples[::-1]], axis=1)    # one stereo recording
+        buffer = io.BytesIO()
+        wavfile.write(buffer, SAMPLE_RATE, samples)
+        filename = START_TS + i * 60
+        audio[filename] = buffer.getvalue()
+        first = float(rng.integers(0, SECONDS - 12))
+        detections += [(filename, first, 3.0), (filename, first + 3, 3.0),     # two neighbours, one elsewhere
+                       (filename, float(rng.integers(0, SECONDS - 3)), 3.0)]
+
+    Config.AUDIO_PLAYBACK_FORMAT = "wav"    # no Opus copies encoded in background
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for name, partial, ranges in (("whole recordings", False, True), ("Range segments", True, True),
+                                      ("Range ignored", True, False)):
+            with StubPi(latency=LATENCY, audio=audio, ranges=ranges, bandwidth=BANDWIDTH) as stub:
+                Config.STATIONS = {"stub": stub.api_base}
+                result = open_detections(Path(workdir), name.replace(" ", "_"), detections, partial)
+                result.update(bytes=stub.bytes_sent, requests=len(stub.requests),
+                              whole=sum(AudioCache.contains(f) for f in audio),
+                              segmented=sum(AudioSegments.contains(f) for f in audio))
+                results[name] = result
+
+    print(f"{len(detections)} detections in {RECORDINGS} recordings of {SECONDS} s at {SAMPLE_RATE} Hz, "
+          f"{LATENCY * 1000:.0f} ms per request, {BANDWIDTH / 2**20:.0f} MB/s")
+    for name, result in results.items():
+        print(f"  {name:18s} {result['time']:6.2f} s  {result['bytes'] / 2**20:7.1f} MB  {result['requests']:3d} requests  "
+              f"({result['whole']} recordings cached whole, {result['segmented']} in segments)")
+    whole, ranged, ignored = results.values()
+    print(f"  {ranged['bytes'] / whole['bytes']:.0%} of the bytes, speedup {whole['time'] / ranged['time']:.1f}x")
+    assert ranged["bytes"] < whole["bytes"] / 2 and ranged["segmented"] == RECORDINGS and not ranged["whole"]
+    # the header and one run of segments per detection at most, fewer when neighbours share them
+    assert ranged["requests"] < RECORDINGS + len(detections)
+    assert ignored["whole"] == RECORDINGS and ignored["requests"] == RECORDINGS and not ignored["segmented"]
+
+    # same clips either way
+    for key, samples in whole["clips"].items():
+        assert np.array_equal(samples, ranged["clips"][key]) and np.array_equal(samples, ignored["clips"][key])
+    print("  same clips")
+
+if __name__ == "__main__":
+    main()
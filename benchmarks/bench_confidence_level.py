@@ -0,0 +1,50 @@
+"""
+Row-wise vs vectorized Utils.add_confidence_level_column.
+
+Run from the repository root:  python -m benchmarks.bench_confidence_level
+"""
+import time
+from config import Config
+from data_processor import DataProcessor
+from utils import Utils
+from benchmarks.synthetic import make_detections
+
+SIZES = (10_000, 100_000, 1_000_000)
+
+def add_confidence_level_column_rowwise(df, confidence_thresholds):
+    # the original implementation, two DataFrame.apply(axis=1) passes
+    df_copy = df.copy()
+    df_copy["confidence_level"] = df_copy.apply(
+        lambda row: Utils.calculate_confidence_level(
+            row["confidence"],
+            confidence_thresholds.get(row["species"], Config.DEFAULT_THRESHOLD_VALUE)
+        ),
+        axis=1
+    )
+    df_copy["threshold"] = df_copy.apply(
+        lambda row: confidence_thresholds.get(row["species"], Config.DEFAULT_THRESHOLD_VALUE),
+        axis=1
+    )
+    return df_copy
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+def main():
+    thresholds = DataProcessor.get_confidence_thresholds(Config.CUSTOM_THRESHOLDS_PATH)
+    # drop one species so the default threshold path is exercised too
+    thresholds.pop(next(iter(thresholds)))
+
+    print(f"{'rows':>10} {'row-wise (s)':>14} {'vectorized (s)':>15} {'speedup':>9}")
+    for n_rows in SIZES:
+        df = make_detections(n_rows)
+        expected, t_old = timed(add_confidence_level_column_rowwise, df, thresholds)
+        result, t_new = timed(Utils.add_confidence_level_column, df.copy(), thresholds)
+        assert (expected["confidence_level"] == result["confidence_level"]).all()
+        assert (expected["threshold"] == result["threshold"]).all()
+        print(f"{n_rows:>10} {t_old:>14.3f} {t_new:>15.4f} {t_old / t_new:>8.0f}x")
+
+if __name__ == "__main__":
+    main()
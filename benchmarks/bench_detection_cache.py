@@ -0,0 +1,75 @@
+"""
+Several sessions refreshing the same range at once, against a local stub of
+the Pi API with some latency: every session syncing and loading the whole
+range (what happened once st.cache_data expired or was cleared by "Refresh")
+vs the shared DetectionCache, where they join a single sync of the open day
+and the closed days are served from memory.
+
+Run from the repository root:  python -m benchmarks.bench_detection_cache
+"""
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from config import Config
+from data_processor import DataProcessor
+from detection_cache import DetectionCache
+from detection_store import DetectionStore
+from benchmarks.stub_pi import StubPi
+from benchmarks.synthetic import make_payload
+
+SESSIONS = 8
+DAYS = 30
+ROWS_PER_DAY = 3_000
+LATENCY = 0.05   # seconds per request of the stub
+
+def concurrent_sessions(fn):
+    """Wall time of SESSIONS concurrent calls, and the result of the first one"""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=SESSIONS) as pool:
+        results = list(pool.map(lambda _: fn(), range(SESSIONS)))
+    return time.perf_counter() - start, results[0]
+
+def main():
+    now = int(time.time())
+    start_ts = now - DAYS * 86_400
+    payload = make_payload(DAYS * ROWS_PER_DAY, start_ts=start_ts, span_seconds=DAYS * 86_400)
+    start_date, end_date = datetime.fromtimestamp(start_ts).date(), datetime.now().date()
+
+    with tempfile.TemporaryDirectory() as workdir, StubPi(payload, latency=LATENCY) as stub:
+        Config.STATIONS = {"stub": stub.api_base}
+        Config.DETECTION_STORE_PATH = Path(workdir) / "detections.sqlite"
+        DetectionStore.sync(start_date, end_date)   # the store is already warm in both cases
+        DetectionCache.get(start_date, end_date)
+
+        before = len(stub.requests)
+        t_direct, direct = concurrent_sessions(lambda: DetectionStore.fetch_detections(start_date, end_date))
+        direct_requests = len(stub.requests) - before
+
+        DetectionCache.invalidate()     # "Refresh"
+        before = len(stub.requests)
+        t_cache, cached = concurrent_sessions(lambda: DetectionCache.get(start_date, end_date))
+        cache_requests = len(stub.requests) - before
+        summary = DetectionCache.summary()
+
+    print(f"{SESSIONS} sessions refreshing {DAYS + 1} days ({len(payload)} detections), {LATENCY * 1000:.0f} ms per request")
+    print(f"  every session syncs and loads  {t_direct:6.2f} s   {direct_requests:3d} requests")
+    print(f"  shared DetectionCache          {t_cache:6.2f} s   {cache_requests:3d} requests "
+          f"({summary['closed']} of {summary['partitions']} partitions closed)")
+    assert cache_requests <= direct_requests / SESSIONS + 1
+
+    # same detections either way
+    expected = DataProcessor.compact(pd.DataFrame(direct)).sort_values(["start_time", "filename", "species"], ignore_index=True)
+    got = cached.sort_values(["start_time", "filename", "species"], ignore_index=True)
+    assert len(got) == len(expected)
+    assert np.array_equal(got["start_time"].to_numpy(), expected["start_time"].to_numpy())
+    assert (got["species"].astype(str).to_numpy() == expected["species"].astype(str).to_numpy()).all()
+    print("  same detections")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Cost of selecting a row of the detections table: the whole script re-run
+(what every selection did before the page was split into fragments) vs the
+detections panel fragment alone (table page plus the audio path), read from
+the rerun traces of the dashboard run with AppTest against a local stub of
+the Pi API.
+
+Run from the repository root:  python -m benchmarks.bench_fragments
+"""
+import io
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from scipy.io import wavfile
+from streamlit.testing.v1 import AppTest
+from streamlit.util import AttributeDictionary
+
+from config import Config
+from instrumentation import Instrumentation
+from benchmarks.stub_pi import StubPi
+from benchmarks.synthetic import make_clip, make_payload
+
+DAYS = 7
+ROWS_PER_DAY = 5_000
+SELECTIONS = 8
+SAMPLE_RATE = 16_000
+APP = str(Path(__file__).resolve().parent.parent / "app.py")
+
+def main():
+    now = int(time.time())
+    payload = make_payload(DAYS * ROWS_PER_DAY, start_ts=now - DAYS * 86_400, span_seconds=DAYS * 86_400 - 3600)
+    buffer = io.BytesIO()
+    wavfile.write(buffer, SAMPLE_RATE, make_clip(60, SAMPLE_RATE))
+    audio = {d["filename"]: buffer.getvalue() for d in payload}
+
+    with tempfile.TemporaryDirectory() as workdir, StubPi(payload, audio=audio) as stub:
+        workdir = Path(workdir)
+        Config.STATIONS = {"pi": stub.api_base}
+        Config.DETECTION_STORE_PATH = workdir / "detections.sqlite"
+        Config.AUDIO_CACHE_DIR = workdir / "audio"
+        Config.AUDIO_SEGMENT_DIR = workdir / "segments"
+        Config.SPECTROGRAM_CACHE_DIR = workdir / "spectrograms"
+        Config.AUDIO_CACHE_DIR.mkdir()
+        Config.SPECTROGRAM_CACHE_DIR.mkdir()
+
+        at = AppTest.from_file(APP, default_timeout=300)
+        at.run()    # first load: sync and pipeline
+        assert not at.exception, at.exception
+        full, panel = [], []
+        for row in range(SELECTIONS):
+            at.session_state["detections_table"] = AttributeDictionary(
+                {"selection": AttributeDictionary({"rows": [row], "columns": []})}
+            )
+            at.run()
+            assert not at.exception and any(header.value == "🎵 Audio Analysis" for header in at.header)
+            trace = Instrumentation.log()[-1]
+            full.append(trace["total_seconds"])
+            panel.append(trace["stages"]["detections_panel"]["seconds"])
+
+    full_ms, panel_ms = statistics.median(full) * 1000, statistics.median(panel) * 1000
+    print(f"{SELECTIONS} row selections, {DAYS} days of detections ({len(payload)} rows)")
+    print(f"  whole script re-run      {full_ms:8.1f} ms")
+    print(f"  detections panel alone   {panel_ms:8.1f} ms   (table page and audio path)")
+    print(f"  {full_ms / panel_ms:.1f}x less work per selection")
+    assert panel_ms < full_ms
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Memory footprint of the processed detections frame: the former schema
+(object species, per-row date/time objects, int64 timestamps, float64
+confidence, object confidence levels) vs the compact one of
+DataProcessor.compact, on 1M synthetic rows.
+
+Run from the repository root:  python -m benchmarks.bench_memory
+"""
+import time
+import numpy as np
+import pandas as pd
+from config import Config
+from data_processor import DataProcessor
+from utils import Utils, CONFIDENCE_LEVELS
+from benchmarks.synthetic import make_payload
+
+ROWS = 1_000_000
+
+def legacy_process(detections, thresholds):
+    # the pipeline before the compact schema, same rows kept
+    df = pd.DataFrame(detections)
+    df = DataProcessor.apply_group_thresholds(df, thresholds)
+    df = df.assign(datetime=pd.to_datetime(df['start_time'], unit='s', utc=True).dt.tz_convert('Europe/Rome'))
+    df = df.assign(date=df['datetime'].dt.date, time=df['datetime'].dt.time)
+    df = df.sort_values(by="datetime", ascending=False)
+    df = Utils.add_confidence_level_column(df, thresholds)
+    df["confidence_level"] = df["confidence_level"].astype(object)
+    return df
+
+def compact_process(detections, thresholds):
+    df = DataProcessor.process_detections(detections, thresholds)
+    return DataProcessor.add_display_columns(Utils.add_confidence_level_column(df, thresholds))
+
+def main():
+    detections = make_payload(ROWS, span_seconds=ROWS)
+    thresholds = DataProcessor.get_confidence_thresholds(Config.CUSTOM_THRESHOLDS_PATH)
+
+    frames = {}
+    for name, process in (("before", legacy_process), ("after", compact_process)):
+        start = time.perf_counter()
+        frames[name] = process(detections, thresholds)
+        print(f"{name:<7} built in {time.perf_counter() - start:6.2f} s, {len(frames[name])} rows")
+
+    usage = pd.DataFrame({
+        name: df.memory_usage(deep=True, index=False) / 2**20 for name, df in frames.items()
+    })
+    usage.loc["total"] = usage.sum()
+    dtypes = pd.DataFrame({name: df.dtypes.astype(str) for name, df in frames.items()})
+    print(pd.concat([usage.round(1).add_suffix(" (MiB)"), dtypes.add_suffix(" dtype")], axis=1).fillna("").to_string())
+    print(f"compact frame is {usage.loc['total', 'before'] / usage.loc['total', 'after']:.1f}x smaller")
+
+    # same detections kept, same confidences
+    before, after = frames["before"], frames["after"]
+    key = ["start_time", "species"]
+    before = before.sort_values(key, kind="stable").reset_index(drop=True)
+    after = after.astype({"species": str, "start_time": np.int64}).sort_values(key, kind="stable").reset_index(drop=True)
+    assert (before["start_time"].to_numpy() == after["start_time"].to_numpy()).all()
+    assert (before["species"].to_numpy() == after["species"].to_numpy()).all()
+    assert np.array_equal(before["confidence"], after["confidence"])
+    assert list(after["confidence_level"].cat.categories) == CONFIDENCE_LEVELS
+    print("same detections kept")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+System metrics in the sidebar: one blocking request per rerun (as
+display_system_metrics used to do) vs reading the rings of the background
+MetricsPoller, with several tabs rerunning against a local stub of the Pi
+API that answers after some latency. Reports the time a rerun spends on the
+metrics and the requests the Pi receives.
+
+Run from the repository root:  python -m benchmarks.bench_metrics
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from config import Config
+from api_client import APIClient
+from metrics_poller import MetricsPoller, MetricsRing, METRIC_FIELDS
+from benchmarks.stub_pi import StubPi
+
+TABS = 5
+RERUNS_PER_TAB = 20
+RERUN_EVERY = 0.25   # seconds between two reruns of a tab
+LATENCY = 0.2        # seconds per metrics request of the stub
+
+def run_tabs(read_metrics) -> np.ndarray:
+    """Every tab reruns RERUNS_PER_TAB times, returns the seconds spent on the metrics by each rerun"""
+    def tab():
+        spent = []
+        for _ in range(RERUNS_PER_TAB):
+            start = time.perf_counter()
+            read_metrics()
+            spent.append(time.perf_counter() - start)
+            time.sleep(max(RERUN_EVERY - spent[-1], 0))
+        return spent
+    with ThreadPoolExecutor(max_workers=TABS) as pool:
+        return np.concatenate(list(pool.map(lambda _: tab(), range(TABS))))
+
+def main():
+    # the ring keeps the last samples in order once it wraps
+    ring = MetricsRing(4)
+    for i in range(10):
+        ring.append(float(i), {"cpu_usage": i, "is_recording": True})
+    times, values = ring.ordered()
+    assert times.tolist() == [6.0, 7.0, 8.0, 9.0] and values[:, 0].tolist() == [6.0, 7.0, 8.0, 9.0]
+    assert np.isnan(values[0, METRIC_FIELDS.index("temperature")]) and values[0, -1] == 1.0
+
+    with StubPi(latency=LATENCY) as stub:
+        Config.STATIONS = {"stub": stub.api_base}
+        Config.METRICS_POLL_INTERVAL = 1.0
+        duration = RERUNS_PER_TAB * RERUN_EVERY
+
+        before = len(stub.requests)
+        blocking = run_tabs(lambda: APIClient.station().system_metrics())
+        blocking_requests = len(stub.requests) - before
+
+        MetricsPoller.ensure_started()
+        time.sleep(LATENCY * 2)     # first sample
+        before = len(stub.requests)
+        polled = run_tabs(lambda: (MetricsPoller.latest("stub"), MetricsPoller.history("stub", last=60)))
+        polled_requests = len(stub.requests) - before
+
+    print(f"{TABS} tabs, {RERUNS_PER_TAB} reruns each over ~{duration:.0f} s, {LATENCY * 1000:.0f} ms per request")
+    print(f"  blocking per rerun  metrics {np.mean(blocking) * 1000:8.2f} ms/rerun   {blocking_requests:4d} requests")
+    print(f"  background poller   metrics {np.mean(polled) * 1000:8.2f} ms/rerun   {polled_requests:4d} requests")
+    assert polled_requests < blocking_requests
+    assert MetricsPoller.latest("stub")["cpu_usage"] == 12.5
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+End-to-end benchmark of the dashboard data pipeline on synthetic BirdNET
+workloads: fetch -> local store -> process_detections ->
+add_confidence_level_column -> filter_non_species -> display columns ->
+(and the cost of switching threshold profile on prepared detections) ->
+table styling (one page and the unpaginated 'Rows to show' default), plus the
+audio/spectrogram path on a synthetic WAV. Every stage is timed and, in a
+separate run, traced for peak Python memory. Results are written as JSON so
+runs can be compared over time.
+
+Run from the repository root:
+    python -m benchmarks.bench_pipeline --days 1 7 30 365 --output results.json
+"""
+import argparse
+import io
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+from scipy.io import wavfile
+
+from config import Config
+from api_client import APIClient
+from audio_cache import AudioCache
+from audio_processor import AudioProcessor, SpectrogramGenerator
+from data_processor import DataProcessor
+from detection_store import DetectionStore
+from ui_components import UIComponents
+from utils import Utils
+from benchmarks.stub_pi import StubPi
+from benchmarks.synthetic import make_payload, make_clip
+
+START_TS = 1_750_000_000
+TABLE_ROWS = 2500      # default of the 'Rows to show' slider
+CLIP_SECONDS = 60
+SAMPLE_RATE = 48_000
+
+def measure(stage: str, fn, trace_memory: bool = True) -> tuple:
+    start = time.perf_counter()
+    result = fn()
+    record = {"stage": stage, "seconds": time.perf_counter() - start}
+    if trace_memory:
+        # separate run, tracemalloc slows Python code down
+        tracemalloc.start()
+        fn()
+        record["peak_mib"] = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    if hasattr(result, "__len__"):
+        record["output_rows"] = len(result)
+    return result, record
+
+def fresh_store_sync(start_date, end_date, workdir: Path):
+    Config.DETECTION_STORE_PATH = Path(tempfile.mkdtemp(dir=workdir)) / "detections.sqlite"
+    return DetectionStore.sync(start_date, end_date)
+
+def bench_detections(days: int, rows_per_day: int, thresholds, workdir: Path, trace_memory: bool) -> list:
+    end_ts = START_TS + days * 86_400 - 1
+    payload = make_payload(days * rows_per_day, start_ts=START_TS, span_seconds=days * 86_400)
+    start_date = datetime.fromtimestamp(START_TS).date()
+    end_date = datetime.fromtimestamp(end_ts).date()
+    records = []
+
+    with StubPi(payload) as stub:
+        Config.STATIONS = {"stub": stub.api_base}
+        _, record = measure("fetch", lambda: APIClient.station().fetch_detections_between(START_TS, end_ts), trace_memory)
+        records.append(record)
+        _, record = measure("store_sync", lambda: fresh_store_sync(start_date, end_date, workdir), trace_memory)
+        records.append(record)
+
+    detections, record = measure("store_load", lambda: DetectionStore.load(start_date, end_date), trace_memory)
+    records.append(record)
+    df, record = measure("process_detections",
+                         lambda: DataProcessor.process_detections(detections, thresholds), trace_memory)
+    records.append(record)
+    df, record = measure("add_confidence_level_column",
+                         lambda: Utils.add_confidence_level_column(df, thresholds), trace_memory)
+    records.append(record)
+    # app.py path: prepared once per refresh, then only re-selected when thresholds change
+    prepared, record = measure("prepare_detections", lambda: DataProcessor.prepare_detections(detections), trace_memory)
+    records.append(record)
+    other_profile = {species: min(value * 1.5, 1.0) for species, value in thresholds.items()}
+    _, record = measure("threshold_profile_switch", lambda: Utils.add_confidence_level_column(
+        DataProcessor.select_detections(prepared, other_profile), other_profile), trace_memory)
+    records.append(record)
+    df_view, record = measure("filter_non_species",
+                              lambda: DataProcessor.filter_non_species(df, Config.NON_SPECIES_PREFIXES), trace_memory)
+    records.append(record)
+    df_view, record = measure("display_columns",
+                              lambda: DataProcessor.add_display_columns(df_view), trace_memory)
+    records.append(record)
+    # to_html renders every cell through the Styler, as st.dataframe does when serializing it
+    _, record = measure("table_styling_page",
+                        lambda: UIComponents.build_detections_table(df_view.head(Config.TABLE_PAGE_SIZE)).to_html(),
+                        trace_memory)
+    records.append(record)
+    _, record = measure("table_styling_unpaginated",
+                        lambda: UIComponents.build_detections_table(df_view.head(TABLE_ROWS)).to_html(), trace_memory)
+    records.append(record)
+
+    for record in records:
+        record.update(scale_days=days, input_rows=len(payload))
+    return records
+
+def bench_audio(workdir: Path, trace_memory: bool) -> list:
+    filename = START_TS
+    buffer = io.BytesIO()
+    wavfile.write(buffer, SAMPLE_RATE, make_clip(CLIP_SECONDS, SAMPLE_RATE))
+    AudioCache.put(filename, buffer.getvalue())
+    prediction_time, prediction_duration = CLIP_SECONDS / 2, 3.0
+    records = []
+
+    clip, record = measure("load_clip",
+                           lambda: AudioProcessor.load_clip(filename, prediction_time, prediction_duration), trace_memory)
+    records.append(record)
+    _, record = measure("encode_wav", lambda: AudioProcessor.encode_wav(clip), trace_memory)
+    records.append(record)
+    spectrogram, record = measure("stft", lambda: SpectrogramGenerator.compute_spectrogram_db(
+        clip.samples, clip.sample_rate, time_offset=clip.offset), trace_memory)
+    records.append(record)
+    _, record = measure("render_raster", lambda: SpectrogramGenerator.render_spectrogram_raster(
+        spectrogram, prediction_time, prediction_duration), trace_memory)
+    records.append(record)
+
+    def render_matplotlib():
+        fig = SpectrogramGenerator.render_spectrogram(spectrogram, prediction_time, prediction_duration)
+        png = io.BytesIO()
+        fig.savefig(png, format="png", bbox_inches="tight", dpi=200)
+        plt.close(fig)
+        return png.getvalue()
+    render_matplotlib()     # warm up fonts and colormaps
+    _, record = measure("render_matplotlib", render_matplotlib, trace_memory)
+    records.append(record)
+
+    for record in records:
+        record.update(clip_seconds=CLIP_SECONDS, padding=Config.AUDIO_CLIP_PADDING)
+    return records
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": sys.version.split()[0],
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, nargs="+", default=[1, 7, 30, 365], help="date range sizes to run")
+    parser.add_argument("--rows-per-day", type=int, default=5_000)
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc runs")
+    parser.add_argument("--output", type=Path, default=Path("benchmarks/results") / f"pipeline-{datetime.now():%Y%m%d-%H%M%S}.json")
+    args = parser.parse_args()
+
+    thresholds = DataProcessor.get_confidence_thresholds(Config.CUSTOM_THRESHOLDS_PATH)
+    Config.REQUEST_TIMEOUT = 300
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        workdir = Path(workdir)
+        Config.AUDIO_CACHE_DIR = workdir / "audio"
+        Config.SPECTROGRAM_CACHE_DIR = workdir / "spectrograms"
+        Config.AUDIO_CACHE_DIR.mkdir()
+        Config.SPECTROGRAM_CACHE_DIR.mkdir()
+
+        for days in args.days:
+            results += bench_detections(days, args.rows_per_day, thresholds, workdir, not args.no_memory)
+        results += bench_audio(workdir, not args.no_memory)
+
+    for record in results:
+        scale = f"{record['scale_days']}d" if "scale_days" in record else f"{record['clip_seconds']}s clip"
+        memory = f"{record['peak_mib']:8.1f} MiB" if "peak_mib" in record else ""
+        print(f"{scale:>10} {record['stage']:<28} {record['seconds']:9.4f} s {memory}")
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(json.dumps({"environment": environment(), "results": results}, indent=2))
+    print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
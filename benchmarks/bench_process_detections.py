@@ -0,0 +1,31 @@
+"""
+Per-datetime None_ suppression: DataProcessor.apply_group_thresholds on
+growing frames. Its equivalence with the reference groupby/iterrows loop is
+checked by tests/test_data_processor.py.
+
+Run from the repository root:  python -m benchmarks.bench_process_detections
+"""
+import time
+from config import Config
+from data_processor import DataProcessor
+from benchmarks.synthetic import make_detections
+
+TIMING_SIZES = (10_000, 100_000, 1_000_000)
+
+def make_workload(n_rows, seed=0):
+    # about three classes per 3 s window, so None_ shares windows with other species
+    return make_detections(n_rows, seed=seed, span_seconds=n_rows)
+
+def main():
+    thresholds = DataProcessor.get_confidence_thresholds(Config.CUSTOM_THRESHOLDS_PATH)
+
+    print(f"{'rows':>10} {'vectorized (s)':>15} {'kept':>10}")
+    for n_rows in TIMING_SIZES:
+        df = make_workload(n_rows)
+        start = time.perf_counter()
+        result = DataProcessor.apply_group_thresholds(df, thresholds)
+        elapsed = time.perf_counter() - start
+        print(f"{n_rows:>10} {elapsed:>15.4f} {len(result):>10}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Long-range overview: raw detections (load every row and aggregate them)
+vs the rollup tables of the detection store, over a year of
+synthetic data served by a local stub of the Pi API. Also reports the
+cost of maintaining the rollups during sync.
+
+Run from the repository root:  python -m benchmarks.bench_rollups
+"""
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+
+from config import Config
+from detection_store import DetectionStore, CONFIDENCE_BINS
+from detection_rollups import DetectionRollups
+from benchmarks.stub_pi import StubPi
+from benchmarks.synthetic import make_payload
+
+START_TS = 1_750_000_000
+DAYS = 365
+ROWS_PER_DAY = 3_000
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+def sync_store(workdir: Path, name: str, start_date, end_date, rollups: bool) -> float:
+    Config.DETECTION_STORE_PATH = workdir / name
+    if rollups:
+        _, elapsed = timed(lambda: DetectionStore.sync(start_date, end_date))
+        return elapsed
+    with patch("detection_store.ROLLUP_UPDATES", ()):
+        _, elapsed = timed(lambda: DetectionStore.sync(start_date, end_date))
+    return elapsed
+
+def main():
+    payload = make_payload(DAYS * ROWS_PER_DAY, start_ts=START_TS, span_seconds=DAYS * 86_400)
+    start_date = datetime.fromtimestamp(START_TS).date()
+    end_date = start_date + timedelta(days=DAYS - 1)
+
+    with tempfile.TemporaryDirectory() as workdir, StubPi(payload) as stub:
+        workdir = Path(workdir)
+        Config.STATIONS = {"stub": stub.api_base}
+        Config.REQUEST_TIMEOUT = 300
+
+        t_plain = sync_store(workdir, "plain.sqlite", start_date, end_date, rollups=False)
+        t_rollups = sync_store(workdir, "rollups.sqlite", start_date, end_date, rollups=True)
+        print(f"sync {len(payload)} rows     rollup updates off {t_plain:6.2f} s   on {t_rollups:6.2f} s")
+        with sqlite3.connect(Config.DETECTION_STORE_PATH) as conn:
+            for table in ("detections", "rollup_hours", "rollup_confidence"):
+                (count,) = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()
+                print(f"  {table:<18} {count:>9} rows")
+
+        def raw_overview():
+            df = pd.DataFrame(DetectionStore.load(start_date, end_date))
+            df = df[df["species"] != "None_"]
+            daily = df.groupby(df["start_time"].map(lambda t: datetime.fromtimestamp(t).date())).size()
+            histogram = np.bincount(np.clip((df["confidence"].fillna(0) * CONFIDENCE_BINS).astype(int), 0, CONFIDENCE_BINS - 1)
+                                    // 5, minlength=CONFIDENCE_BINS // 5)   # bins of 0.05, the default width
+            return daily, df["species"].nunique(), histogram
+
+        def rollup_overview():
+            return (DetectionRollups.daily(start_date, end_date, ("None_",)),
+                    DetectionRollups.species(start_date, end_date, ("None_",)),
+                    DetectionRollups.confidence_histogram(start_date, end_date, ("None_",)))
+
+        (raw_daily, raw_species, raw_histogram), t_raw = timed(raw_overview)
+        (daily, species, histogram), t_rollup = timed(rollup_overview)
+        print(f"{DAYS} day overview  raw rows {t_raw:6.2f} s   rollups {t_rollup:6.3f} s   ({t_raw / t_rollup:.0f}x)")
+
+        # the rollups are exact: compare with the raw rows (None_ excluded, no thresholds)
+        assert (daily["detections"].to_numpy()[:len(raw_daily)] == raw_daily.to_numpy()).all()
+        assert len(species) == raw_species
+        assert (histogram["detections"].to_numpy() == raw_histogram).all()
+        print("daily counts, species and confidence histogram match the raw rows")
+
+if __name__ == "__main__":
+    main()
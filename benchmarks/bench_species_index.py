@@ -0,0 +1,108 @@
+"""
+Moving one threshold slider: select_detections, add_confidence_level_column
+and the level filter on the whole prepared frame (what app.py did on every
+change) vs SpeciesIndex.select, which only redoes the slice of the species
+whose threshold changed, and SpeciesIndex.select_rows with only the first
+page of the table built (what app.py does). Then the threshold sweep (detections kept per
+species at every threshold from 0 to 1) as repeated filtering vs
+SpeciesIndex.sweep. Checks both give the same frames and counts.
+
+Run from the repository root:  python -m benchmarks.bench_species_index
+"""
+import statistics
+import time
+
+import numpy as np
+import pandas as pd
+
+from config import Config
+from data_processor import DataProcessor
+from species_index import SpeciesIndex
+from utils import Utils, CONFIDENCE_LEVELS
+from benchmarks.synthetic import make_detections
+
+ROWS = 1_000_000
+MOVES = 20
+LEVELS = ["medium", "high", "very_high"]
+
+def whole_frame(prepared, thresholds, levels):
+    df = Utils.add_confidence_level_column(DataProcessor.select_detections(prepared, thresholds), thresholds)
+    return df[df["confidence_level"].isin(levels)]
+
+def first_page(index, thresholds, levels):
+    """The rows app.py builds: header counts and the first page of the table"""
+    selection = index.select_rows(thresholds, levels)
+    selection.species_count()
+    return selection.frame(slice(0, Config.TABLE_PAGE_SIZE))
+
+def repeated_filtering(prepared, thresholds, grid, species):
+    """Sweep by filtering the frame once per threshold, every species at that threshold"""
+    counts = {}
+    for t in grid:
+        kept = DataProcessor.select_detections(prepared, {**{s: t for s in species}, "None_": thresholds["None_"]})
+        counts[round(t, 6)] = kept["species"].value_counts()
+    return pd.DataFrame(counts).reindex(species).fillna(0).astype(np.int64)
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+def main():
+    prepared = DataProcessor.add_display_columns(DataProcessor.prepare_detections(make_detections(ROWS)))
+    thresholds = DataProcessor.get_confidence_thresholds(Config.CUSTOM_THRESHOLDS_PATH)
+    thresholds.setdefault("None_", Config.DEFAULT_THRESHOLD_VALUE)
+
+    index, t_build = timed(SpeciesIndex, prepared)
+    _, t_first = timed(index.select, thresholds, LEVELS)
+    page_index = SpeciesIndex(prepared)     # its own state, moved with the same thresholds
+    first_page(page_index, thresholds, LEVELS)
+    print(f"{ROWS} detections of {len(index.names)} species, index built in {t_build * 1000:.0f} ms, "
+          f"first selection {t_first * 1000:.0f} ms")
+
+    rng = np.random.default_rng(0)
+    species = [name for name in index.names if name != "None_"]
+    t_whole, t_index, t_page = [], [], []
+    for move in range(MOVES):
+        thresholds[species[rng.integers(len(species))]] = round(float(rng.uniform(0.05, 0.95)), 2)
+        expected, elapsed = timed(whole_frame, prepared, thresholds, LEVELS)
+        t_whole.append(elapsed)
+        result, elapsed = timed(index.select, thresholds, LEVELS)
+        t_index.append(elapsed)
+        pd.testing.assert_frame_equal(result, expected)
+        page, elapsed = timed(first_page, page_index, thresholds, LEVELS)
+        t_page.append(elapsed)
+        pd.testing.assert_frame_equal(page, expected.head(Config.TABLE_PAGE_SIZE))
+
+    whole_ms, index_ms = statistics.median(t_whole) * 1000, statistics.median(t_index) * 1000
+    page_ms = statistics.median(t_page) * 1000
+    print(f"  one species threshold moved, median of {MOVES}")
+    print(f"    whole frame      {whole_ms:8.1f} ms")
+    print(f"    species index    {index_ms:8.1f} ms")
+    print(f"    first page only  {page_ms:8.1f} ms")
+    print(f"    speedup {whole_ms / index_ms:.1f}x, {whole_ms / page_ms:.1f}x building the first page only")
+
+    # the None_ threshold changes the suppressed groups of every species
+    thresholds["None_"] = 0.5
+    expected, t_none_whole = timed(whole_frame, prepared, thresholds, LEVELS)
+    result, t_none_index = timed(index.select, thresholds, LEVELS)
+    pd.testing.assert_frame_equal(result, expected)
+    page, t_none_page = timed(first_page, page_index, thresholds, LEVELS)
+    pd.testing.assert_frame_equal(page, expected.head(Config.TABLE_PAGE_SIZE))
+    print(f"  None_ threshold moved: whole frame {t_none_whole * 1000:.0f} ms, species index {t_none_index * 1000:.0f} ms, "
+          f"first page only {t_none_page * 1000:.0f} ms")
+    # every level, a species of no profile (default threshold)
+    thresholds.pop(species[0], None)
+    pd.testing.assert_frame_equal(index.select(thresholds), whole_frame(prepared, thresholds, CONFIDENCE_LEVELS))
+    print("  same frames")
+
+    grid = np.linspace(0.0, 1.0, int(round(1 / Config.THRESHOLD_SWEEP_STEP)) + 1)
+    expected, t_filter = timed(repeated_filtering, prepared, thresholds, grid, species)
+    sweep, t_sweep = timed(index.sweep, thresholds)
+    pd.testing.assert_frame_equal(sweep.loc[species], expected, check_names=False, check_column_type=False)
+    print(f"  sweep of {len(grid)} thresholds: repeated filtering {t_filter:.2f} s, species index "
+          f"{t_sweep * 1000:.1f} ms ({t_filter / t_sweep:.0f}x), same counts")
+    assert index_ms < whole_ms and page_ms < whole_ms and t_none_page < t_none_whole and t_sweep < t_filter
+
+if __name__ == "__main__":
+    main()
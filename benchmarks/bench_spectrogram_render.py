@@ -0,0 +1,56 @@
+"""
+matplotlib pcolormesh rendering vs the NumPy raster renderer, on the
+spectrogram of a synthetic clip. Times include the PNG encoding that
+st.pyplot / st.image perform before sending the image to the browser.
+
+Run from the repository root:  python -m benchmarks.bench_spectrogram_render
+"""
+import io
+import time
+import tracemalloc
+import matplotlib.pyplot as plt
+import scipy.signal   # imported by the first STFT otherwise, not part of its time
+from PIL import Image
+from audio_processor import SpectrogramGenerator
+from benchmarks.synthetic import make_clip
+
+DURATIONS = (3, 15, 60)
+SAMPLE_RATE = 48_000
+
+def render_matplotlib(spectrogram):
+    fig = SpectrogramGenerator.render_spectrogram(spectrogram, 1.0, 3.0)
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", bbox_inches="tight", dpi=200)   # what st.pyplot does
+    plt.close(fig)
+    return buffer.getvalue()
+
+def render_raster(spectrogram):
+    image = SpectrogramGenerator.render_spectrogram_raster(spectrogram, 1.0, 3.0)
+    buffer = io.BytesIO()
+    Image.fromarray(image).save(buffer, format="PNG")    # what st.image does with arrays
+    return buffer.getvalue()
+
+def measure(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    fn(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 2**20
+
+def main():
+    print(f"{'clip':>6} {'STFT (s)':>9} {'matplotlib (s)':>15} {'peak MiB':>9} {'raster (s)':>11} {'peak MiB':>9}")
+    for seconds in DURATIONS:
+        samples = make_clip(seconds, SAMPLE_RATE)
+        start = time.perf_counter()
+        spectrogram = SpectrogramGenerator.compute_spectrogram_db(samples, SAMPLE_RATE)
+        t_stft = time.perf_counter() - start
+        render_matplotlib(spectrogram)     # warm up font cache and colormaps
+        t_mpl, m_mpl = measure(render_matplotlib, spectrogram)
+        t_raster, m_raster = measure(render_raster, spectrogram)
+        print(f"{seconds:>5}s {t_stft:>9.3f} {t_mpl:>15.3f} {m_mpl:>9.1f} {t_raster:>11.3f} {m_raster:>9.1f}")
+
+if __name__ == "__main__":
+    main()
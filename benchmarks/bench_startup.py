@@ -0,0 +1,90 @@
+"""
+Cold start of the dashboard: a fresh interpreter importing the modules of
+app.py, as the first session after a restart does, with matplotlib, scipy
+and soundfile deferred until a row is selected ("lazy", the current tree)
+vs imported up front ("eager", as the modules did before). Reports the
+import time, the wall time of the process and its peak RSS, the cost of the
+first spectrogram once they are needed, and checks that none of them is
+loaded by the imports alone.
+
+Run from the repository root:  python -m benchmarks.bench_startup [--runs N]
+"""
+import argparse
+import ast
+import json
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+# imported by the audio panel only
+DEFERRED = ["matplotlib.pyplot", "scipy.signal", "scipy.io.wavfile", "soundfile"]
+
+CHILD = """
+import importlib, json, resource, sys, time
+start = time.perf_counter()
+for name in {modules!r}:
+    try:
+        importlib.import_module(name)
+    except ImportError:
+        pass    # soundfile is optional
+imports = time.perf_counter() - start
+loaded = [name for name in {deferred!r} if name in sys.modules]
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+# first row selected: spectrogram of a clip as the raster renderer draws it
+import numpy as np
+from audio_processor import SpectrogramGenerator
+samples = np.random.default_rng(0).standard_normal(16000 * 9).astype(np.float32)
+start = time.perf_counter()
+spectrogram = SpectrogramGenerator.compute_spectrogram_db(samples, 16000)
+SpectrogramGenerator.render_spectrogram_raster(spectrogram, 3.0, 3.0)
+first_audio = time.perf_counter() - start
+print(json.dumps(dict(imports=imports, loaded=loaded, rss=rss, first_audio=first_audio)))
+"""
+
+def app_modules() -> list:
+    """Modules imported at the top of app.py, in order"""
+    tree = ast.parse((ROOT / "app.py").read_text())
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module:
+            modules.append(node.module)
+    return list(dict.fromkeys(modules))
+
+def cold_start(modules: list) -> dict:
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", CHILD.format(modules=modules, deferred=DEFERRED)],
+                            cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    result = json.loads(output.splitlines()[-1])
+    result["wall"] = time.perf_counter() - start - result["first_audio"]
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="cold starts per variant, the median is reported")
+    args = parser.parse_args()
+
+    modules = app_modules()
+    results = {}
+    for name, variant in (("eager", DEFERRED + modules), ("lazy", modules)):
+        runs = [cold_start(variant) for _ in range(args.runs)]
+        results[name] = {key: statistics.median(run[key] for run in runs) for key in ("imports", "wall", "rss", "first_audio")}
+        results[name]["loaded"] = runs[0]["loaded"]
+
+    print(f"Cold start of app.py's modules ({', '.join(modules)}), median of {args.runs} runs")
+    for name, result in results.items():
+        print(f"  {name:6s} imports {result['imports'] * 1000:7.0f} ms  process {result['wall'] * 1000:7.0f} ms  "
+              f"peak RSS {result['rss'] / 2**20:6.1f} MB  first spectrogram {result['first_audio'] * 1000:6.0f} ms")
+    eager, lazy = results["eager"], results["lazy"]
+    print(f"  {eager['imports'] / lazy['imports']:.1f}x faster imports, "
+          f"{(eager['rss'] - lazy['rss']) / 2**20:.1f} MB less until a row is selected")
+    assert not lazy["loaded"], f"imported at start-up: {lazy['loaded']}"
+    assert lazy["imports"] < eager["imports"] and lazy["rss"] < eager["rss"]
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Several stations: a fast one, a slow one (answers after Config.STATION_TIMEOUT)
+and an offline one, served by local stubs of the Pi API. Compares syncing
+them one after the other with the concurrent fan-out of
+DetectionStore.fetch_detections, checks the merged frame (station column,
+None_ groups kept apart per station) and the per-station audio cache keys.
+
+Run from the repository root:  python -m benchmarks.bench_stations
+"""
+import socket
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from config import Config
+from audio_cache import AudioCache
+from audio_processor import AudioPrefetcher
+from data_processor import DataProcessor
+from detection_store import DetectionStore
+from benchmarks.stub_pi import StubPi
+from benchmarks.synthetic import make_payload
+
+START_TS = 1_750_000_000
+DAYS = 7
+ROWS_PER_DAY = 3_000
+SLOW_LATENCY = 1.5   # seconds per request of the slow station
+STATION_TIMEOUT = 1.0
+
+def closed_port_url() -> str:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{sock.getsockname()[1]}/api"
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+def main():
+    payload = make_payload(DAYS * ROWS_PER_DAY, start_ts=START_TS, span_seconds=DAYS * 86_400)
+    start_date = datetime.fromtimestamp(START_TS).date()
+    end_date = datetime.fromtimestamp(max(d["start_time"] for d in payload)).date()
+    thresholds = DataProcessor.get_confidence_thresholds(Config.CUSTOM_THRESHOLDS_PATH)
+    stored = len({(d["start_time"], d["filename"], d["species"]) for d in payload})   # duplicates are stored once
+    audio = {int(payload[0]["filename"]): b"RIFF-north"}
+
+    with tempfile.TemporaryDirectory() as workdir, \
+            StubPi(payload, audio=audio) as fast, \
+            StubPi(payload, latency=SLOW_LATENCY, audio={f: b"RIFF-south" for f in audio}) as slow:
+        workdir = Path(workdir)
+        Config.AUDIO_CACHE_DIR = workdir / "audio"
+        Config.AUDIO_CACHE_DIR.mkdir()
+        Config.REQUEST_TIMEOUT = 30
+        Config.STATION_TIMEOUT = STATION_TIMEOUT
+        Config.STATIONS = {"north": fast.api_base, "south": slow.api_base, "east": closed_port_url()}
+
+        # one after the other: every rerun waits for the slow station and the offline one's retries
+        Config.DETECTION_STORE_PATH = workdir / "sequential" / "detections.sqlite"
+        _, t_sequential = timed(lambda: [DetectionStore.sync(start_date, end_date, s) for s in Config.STATIONS])
+
+        # fan-out: the rerun waits at most STATION_TIMEOUT, the slow station keeps syncing in background
+        Config.DETECTION_STORE_PATH = workdir / "fan_out" / "detections.sqlite"
+        detections, t_fan_out = timed(lambda: DetectionStore.fetch_detections(start_date, end_date))
+        print(f"3 stations ({DAYS} days, {len(payload)} rows each, one slow, one offline)")
+        print(f"  sequential sync {t_sequential:6.2f} s   fan-out {t_fan_out:6.2f} s")
+        counts = pd.Series([d["station"] for d in detections]).value_counts()
+        print(f"  first rerun: {counts.to_dict()}")
+        assert t_fan_out < t_sequential and t_fan_out < STATION_TIMEOUT + 1.0
+        assert counts.get("north") == stored and "east" not in counts
+
+        # a later rerun with more patience joins the background sync of the slow station
+        Config.STATION_TIMEOUT = 30
+        detections = DetectionStore.fetch_detections(start_date, end_date, ("north", "south"))
+        counts = pd.Series([d["station"] for d in detections]).value_counts()
+        print(f"  later rerun: {counts.to_dict()}")
+        assert counts.get("south") == stored
+
+        # the merged frame keeps the None_ groups of each station apart
+        merged = DataProcessor.process_detections(detections, thresholds)
+        single = DataProcessor.process_detections(DetectionStore.load(start_date, end_date, "north"), thresholds)
+        assert isinstance(merged["station"].dtype, pd.CategoricalDtype)
+        for station in ("north", "south"):
+            rows = merged[merged["station"] == station]
+            assert len(rows) == len(single)
+            assert np.array_equal(np.sort(rows["start_time"].to_numpy()), np.sort(single["start_time"].to_numpy()))
+        print(f"  merged frame {len(merged)} rows, {len(single)} kept per station as with one station")
+
+        # same filename on two stations: two cache entries
+        filename = next(iter(audio))
+        for station in ("north", "south"):
+            AudioPrefetcher.fetch(filename, station)
+        assert AudioCache.path(filename, "north").read_bytes() == b"RIFF-north"
+        assert AudioCache.path(filename, "south").read_bytes() == b"RIFF-south"
+        print(f"  audio cache keys: {AudioCache.key(filename, 'north')}, {AudioCache.key(filename, 'south')}")
+
+if __name__ == "__main__":
+    main()
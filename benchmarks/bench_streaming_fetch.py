@@ -0,0 +1,63 @@
+"""
+Single-request fetch vs windowed, concurrent streaming fetch against a
+local stub of the Pi API (with per-request latency), the detections
+processed afterwards in both cases. The dashboard consumes the stream in
+DetectionStore.sync, inserting every window as it arrives.
+
+Windows are fetched in ceil(windows / workers) rounds, each paying the
+request latency once: with the defaults (day windows, 8 workers) a week is
+one round. Parsing and serving share this interpreter with the stub, so
+the stream does not beat one request on CPU; what it saves is latency and
+the peak memory of the whole payload.
+
+Run from the repository root:  python -m benchmarks.bench_streaming_fetch
+"""
+import time
+import tracemalloc
+from config import Config
+from api_client import APIClient
+from data_processor import DataProcessor
+from benchmarks.stub_pi import StubPi
+from benchmarks.synthetic import make_payload
+
+DAYS = 7
+ROWS = 300_000
+LATENCY = 0.5
+
+def measure(fn):
+    # timed and memory-traced in separate runs, tracemalloc slows Python code down
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak / 2**20
+
+def main():
+    start_ts = 1_750_000_000
+    end_ts = start_ts + DAYS * 86_400 - 1
+    detections = make_payload(ROWS, start_ts=start_ts, span_seconds=DAYS * 86_400)
+    thresholds = DataProcessor.get_confidence_thresholds(Config.CUSTOM_THRESHOLDS_PATH)
+
+    with StubPi(detections, latency=LATENCY) as stub:
+        Config.STATIONS = {"stub": stub.api_base}
+        Config.REQUEST_TIMEOUT = 60
+
+        single, t_single, m_single = measure(lambda: DataProcessor.process_detections(
+            APIClient.station().fetch_detections_between(start_ts, end_ts), thresholds))
+        print(f"single request                           {t_single:7.2f} s  peak {m_single:7.1f} MiB  {len(single)} rows kept")
+
+        for window, workers in ((Config.STREAM_WINDOW_SECONDS, Config.STREAM_MAX_WORKERS), (86_400, 4), (3_600 * 6, 8)):
+            streamed, t_stream, m_stream = measure(lambda: DataProcessor.process_detections(
+                [record for _, records in APIClient.station().stream_detections(start_ts, end_ts, window, workers)
+                 for record in records],
+                thresholds))
+            assert len(streamed) == len(single)
+            rounds = -(-(end_ts - start_ts + 1) // window // workers)
+            print(f"stream {window // 3600:>2} h windows, {workers} workers, rounds {rounds}  {t_stream:7.2f} s  "
+                  f"peak {m_stream:7.1f} MiB  {len(streamed)} rows kept")
+
+if __name__ == "__main__":
+    main()
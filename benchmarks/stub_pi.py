@@ -0,0 +1,117 @@
+"""
+Local stand-in for the Raspberry Pi API, for offline tests and benchmarks.
+
+    with StubPi(detections) as stub:
+        Config.STATIONS = {"stub": stub.api_base}
+        ...
+"""
+import json
+import re
+import threading
+import time
+import numpy as np
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+class StubPi:
+    def __init__(self, detections=None, latency: float = 0.0, metrics=None, audio=None,
+                 ranges: bool = True, bandwidth: float = None):
+        """
+        Args:
+            detections: list of detection dicts served by /birds/classifications.
+            latency: seconds slept before answering each request.
+            metrics: dict served by /system_metrics.
+            audio: {filename: wav bytes} served by /birds/audio/<filename>.
+            ranges: whether audio requests with a Range header get a 206 with
+                those bytes only (False: the whole file, as a server ignoring Range).
+            bandwidth: bytes per second of the responses, None for no limit.
+        """
+        self.detections = []
+        self.add(detections or [])
+        self.latency = latency
+        self.metrics = metrics or {
+            "cpu_usage": 12.5, "ram_usage": 40.1, "disk_usage": 33.0,
+            "temperature": 45.2, "is_recording": True,
+        }
+        self.audio = audio or {}
+        self.ranges = ranges
+        self.bandwidth = bandwidth
+        self.requests = []
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def add(self, detections):
+        """Serve `detections` too from now on, as detections the Pi uploads late"""
+        self.detections = sorted(self.detections + list(detections), key=lambda d: d["start_time"])
+        self.start_times = np.array([d["start_time"] for d in self.detections], dtype=np.int64)
+
+    @property
+    def api_base(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/api"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _classifications(self, query):
+        since = int(query.get("since", [0])[0])
+        until = int(query.get("until", [2**62])[0])
+        lo = np.searchsorted(self.start_times, since, side="left")
+        hi = np.searchsorted(self.start_times, until, side="right")
+        return self.detections[lo:hi]
+
+    def _make_handler(stub):
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body: bytes, content_type: str, headers=None):
+                with stub._lock:
+                    stub.bytes_sent += len(body)
+                if stub.bandwidth:
+                    time.sleep(len(body) / stub.bandwidth)
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                stub.requests.append(self.path)
+                if stub.latency:
+                    time.sleep(stub.latency)
+
+                if url.path == "/api/birds/classifications":
+                    rows = stub._classifications(parse_qs(url.query))
+                    self._send(200, json.dumps(rows).encode(), "application/json")
+                elif url.path == "/api/system_metrics":
+                    self._send(200, json.dumps(stub.metrics).encode(), "application/json")
+                elif url.path.startswith("/api/birds/audio/"):
+                    data = stub.audio.get(int(url.path.rsplit("/", 1)[1]))
+                    match = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+                    if data is None:
+                        self._send(404, b"not found", "text/plain")
+                    elif match and stub.ranges:
+                        start = int(match[1])
+                        end = min(int(match[2]) if match[2] else len(data) - 1, len(data) - 1)
+                        if start > end:
+                            self._send(416, b"", "audio/wav", {"Content-Range": f"bytes */{len(data)}"})
+                        else:
+                            self._send(206, data[start:end + 1], "audio/wav",
+                                       {"Content-Range": f"bytes {start}-{end}/{len(data)}", "Accept-Ranges": "bytes"})
+                    else:
+                        self._send(200, data, "audio/wav")
+                else:
+                    self._send(404, b"not found", "text/plain")
+        return Handler
@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+from config import Config
+
+def load_species():
+    """Species of the thresholds file plus the non-species classes it lacks"""
+    species = list(pd.read_csv(Config.CUSTOM_THRESHOLDS_PATH)["species"])
+    return species + [prefix for prefix in Config.NON_SPECIES_PREFIXES if prefix not in species]
+
+def make_detections(n_rows: int, seed: int = 0, start_ts: int = 1_750_000_000, span_seconds: int = 86_400):
+    """
+    Synthetic BirdNET detections shaped like /api/birds/classifications.
+
+    Recordings are one minute long, split into 3 s prediction windows; every
+    window holds one or more species (None_ included) with random confidence.
+    """
+    rng = np.random.default_rng(seed)
+    species = np.array(load_species(), dtype=object)
+    start_time = start_ts + rng.integers(0, span_seconds // 3, n_rows) * 3
+    return pd.DataFrame({
+        "filename": start_time - start_time % 60,
+        "start_time": start_time,
+        "duration": np.full(n_rows, 3),
+        "species": species[rng.integers(0, len(species), n_rows)],
+        "confidence": rng.random(n_rows),
+    })
+
+def make_payload(n_rows: int, seed: int = 0, start_ts: int = 1_750_000_000, span_seconds: int = 86_400):
+    """Same as make_detections, as the list of JSON-ready dicts the API returns"""
+    df = make_detections(n_rows, seed=seed, start_ts=start_ts, span_seconds=span_seconds)
+    return [
+        {"filename": int(f), "start_time": int(t), "duration": int(d), "species": s, "confidence": float(c)}
+        for f, t, d, s, c in zip(df["filename"], df["start_time"], df["duration"], df["species"], df["confidence"])
+    ]
+
+def make_clip(seconds: float, sample_rate: int = 48_000, seed: int = 0) -> np.ndarray:
+    """int16 mono clip: background noise plus a few frequency-swept whistles"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    clip = rng.standard_normal(len(t)) * 0.05
+    for start in rng.uniform(0, max(seconds - 1, 0), max(int(seconds / 3), 1)):
+        mask = (t >= start) & (t < start + 0.5)
+        sweep = 3000 + 4000 * (t[mask] - start)
+        clip[mask] += 0.5 * np.sin(2 * np.pi * np.cumsum(sweep) / sample_rate)
+    return (clip / np.abs(clip).max() * 32767).astype(np.int16)
@@ -3,14 +3,67 @@ from pathlib import Path
 class Config:
   RASPBERRY_IP = "10.91.179.101" 
   API_BASE = f"http://{RASPBERRY_IP}:5001/api"
+  STATIONS = {"pi": API_BASE}   # recorder name -> API base, the first one is the default station
+  STATION_TIMEOUT = 10   # seconds a rerun waits for the stations, slower ones are shown from what is stored
+  STATION_MAX_WORKERS = 8
   REFRESH_RATE = 15000
   AUDIO_CACHE_DIR = Path("data/downloaded_audio")
-  CUSTOM_THRESHOLDS_PATH = Path("data/species_confidence.csv")
+  AUDIO_CACHE_MAX_BYTES = 2 * 1024**3
+  AUDIO_CACHE_MAX_AGE = 30 * 86400   # seconds since last access
+  AUDIO_CLIP_PADDING = 2.0   # seconds played and analysed around a detection, None for the whole recording
+  AUDIO_CACHE_FORMAT = "flac"   # "flac" (lossless, smaller) or "wav"; FLAC and Opus need the soundfile package
+  AUDIO_PLAYBACK_FORMAT = "opus"   # "opus" (a small copy sent to the browser) or "wav" (the clip as is)
+  AUDIO_PARTIAL_DOWNLOAD = True   # download only the segments around a detection (HTTP Range), not the whole recording
+  AUDIO_SEGMENT_DIR = Path("data/audio_segments")
+  AUDIO_SEGMENT_SECONDS = 2.0   # granularity of the partial downloads, segments are shared by neighbouring detections
+  AUDIO_SEGMENT_MAX_BYTES = 256 * 1024**2
+  AUDIO_HEADER_BYTES = 4096   # first bytes requested to find where the samples of a WAV start
+  SPECTROGRAM_CACHE_DIR = Path("data/spectrograms")
+  SPECTROGRAM_CACHE_PNG = True   # also cache the rendered image, not only the dB matrix
+  SPECTROGRAM_RENDERER = "raster"   # "raster" (NumPy, fast) or "matplotlib" (axes and colorbar)
+  SPECTROGRAM_RASTER_WIDTH = 1600
+  SPECTROGRAM_RASTER_HEIGHT = 600
+  SPECTROGRAM_RASTER_LINE_WIDTH = 2
+  AUDIO_PREFETCH_ROWS = 20   # top rows of the table whose audio is downloaded in background
+  AUDIO_PREFETCH_WORKERS = 2
+  EXPORT_DIR = Path("data/exports")   # archives of the bulk clip export
+  EXPORT_WORKERS = 4   # recordings downloaded and cut at the same time by an export
+  EXPORT_COMPRESSLEVEL = 1   # zip deflate level of the export archives, 1 (fast) to 9 (small)
+  CUSTOM_THRESHOLDS_PATH = Path("data/species_confidence.csv")   # default threshold profile
+  THRESHOLD_PROFILES_GLOB = "species_confidence*.csv"   # other profiles, next to the default one
+  THRESHOLD_SWEEP_STEP = 0.01   # thresholds of the sweep view, from 0 to 1
+  THRESHOLD_SWEEP_SPECIES = 5   # species drawn by default in the sweep chart, the most detected
+  DETECTION_STORE_PATH = Path("data/detections.sqlite")
+  DETECTION_SYNC_OVERLAP = 60   # seconds re-fetched behind the high-water mark
+  DETECTION_CLOSE_GRACE = 6 * 3600   # a day is closed once the station has detections this long after its end
+  TABLE_PAGE_SIZES = (50, 100, 250, 500)   # rows per page choices of the detections table
+  TABLE_PAGE_SIZE = 100
+  OVERVIEW_RANGES_DAYS = (30, 90, 365)   # choices of the long-range overview
   DEFAULT_THRESHOLD_VALUE = 0.2
   REQUEST_TIMEOUT = 5
-  CACHE_TTL_DETECTIONS = 15
-  CACHE_TTL_METRICS = 5
+  HTTP_POOL_SIZE = 8
+  HTTP_GZIP = True
+  HTTP_MAX_RETRIES = 2
+  HTTP_BACKOFF_BASE = 0.25   # seconds, doubled at every retry (with jitter)
+  HTTP_BACKOFF_MAX = 2.0
+  CIRCUIT_FAILURE_THRESHOLD = 3   # consecutive failed attempts before failing fast
+  CIRCUIT_COOLDOWN = 30   # seconds
+  STREAM_WINDOW_SECONDS = 86400   # detections are fetched one day per request
+  STREAM_MAX_WORKERS = 8   # a week of day windows in one round of requests, at most HTTP_POOL_SIZE
+  STREAM_CHUNK_SIZE = 64 * 1024
+  CACHE_TTL_DETECTIONS = 15   # seconds before the open days (today) are synced again
+  DETECTION_CACHE_MAX_ROWS = 5_000_000   # detections kept in memory by DetectionCache, shared by every session
+  METRICS_POLL_INTERVAL = 5   # seconds between two samples of the system metrics, shared by every session
+  METRICS_HISTORY_SIZE = 720   # samples kept per station (one hour)
+  METRICS_SPARKLINE_SAMPLES = 60   # samples drawn in the sidebar sparklines
+  METRICS_IDLE_TIMEOUT = 300   # seconds without readers before the poller stops
+  INSTRUMENTATION_PANEL = True   # per-stage timings of the last rerun in the sidebar
+  INSTRUMENTATION_LOG_SIZE = 500   # reruns kept in memory for the export
+  INSTRUMENTATION_LOG_PATH = None   # e.g. Path("data/rerun_timings.jsonl") to also append every rerun to disk
+  INSTRUMENTATION_LOG_MAX_BYTES = 10 * 1024**2
   NON_SPECIES_PREFIXES = ("None_", "Wind_", "Rain_", "Insect_", "Vegetation_")
 
 
 Config.AUDIO_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+Config.SPECTROGRAM_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+Config.AUDIO_SEGMENT_DIR.mkdir(parents=True, exist_ok=True)
@@ -1,41 +1,33 @@
-import streamlit as st
+import numpy as np
 import pandas as pd
-from typing import List, Dict, Any
+from pandas.api.types import union_categoricals
+from typing import List, Dict, Any, Union
 import logging 
-from config import Config
-import os
+from instrumentation import instrumented
+from threshold_registry import ThresholdRegistry
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# compact in-memory schema of the detection frames, see DataProcessor.compact
+COMPACT_DTYPES = {
+    "station": "category",
+    "species": "category",
+    "confidence": np.float64,   # as sent by the Pi, float32 would move detections equal to a threshold below it
+    "start_time": np.uint32,    # unix seconds, fits until 2106
+    "filename": np.uint32,
+    "duration": np.float32,
+}
+
 class DataProcessor:
   
     @staticmethod
-    def load_confidence_thresholds() -> Dict[str, float]:
-        if not Config.CUSTOM_THRESHOLDS_PATH.exists():
-            logger.warning("Custom thresholds file not found, using defaults")
-            return {}
-
-        try:
-            df = pd.read_csv(Config.CUSTOM_THRESHOLDS_PATH)
-            return dict(zip(df.iloc[:, 0], df.iloc[:, 1]))
-        except Exception as e:
-            logger.error("Error while retrieving confidence score: {e}")
-            return {}
-        
-    @staticmethod
-    def get_confidence_thresholds(thresholds_path: str = "/data/species_confidence.csv"):
-        try:
-            if os.path.exists(thresholds_path):
-                df = pd.read_csv(thresholds_path)
-                return dict(zip(df["species"], df["threshold"]))
-            else:
-                logger.warning(f"Threshold folder not loaded. Using a default threshold of 0.2")
-                return {}
-        except Exception as e:
-            logger.error("Error while fetching species threshold")
-        
+    def get_confidence_thresholds(thresholds_path: str = None) -> Dict[str, float]:
+        """Thresholds of the profile at `thresholds_path` (Config.CUSTOM_THRESHOLDS_PATH by default), see ThresholdRegistry"""
+        return dict(ThresholdRegistry.get(thresholds_path).thresholds)
+
     @staticmethod
+    @instrumented("process_detections")
     def process_detections(detections: List[Dict[str, Any]], 
                            confidence_thresholds: Dict[str, float] = None) -> pd.DataFrame:
         """
@@ -54,56 +46,134 @@ class DataProcessor:
         if confidence_thresholds is None:
             confidence_thresholds = {}
 
-        df = pd.DataFrame(detections)
+        df = DataProcessor.compact(pd.DataFrame(detections))
+        df = DataProcessor.apply_group_thresholds(df, confidence_thresholds)
+        return DataProcessor._add_datetime_columns(df)
+
+    @staticmethod
+    def compact(df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Detections as built from the API records, with the compact schema of
+        COMPACT_DTYPES: categorical species, float32 duration, uint32
+        timestamps. Unknown extra columns are left as they are.
+        """
+        if df.empty:
+            return df
+        return df.astype({column: dtype for column, dtype in COMPACT_DTYPES.items() if column in df.columns})
 
-        df['datetime'] = pd.to_datetime(df['start_time'], unit='s', utc=True)
-        df['datetime'] = df['datetime'].dt.tz_convert('Europe/Rome')
+    @staticmethod
+    def concat(frames: List[pd.DataFrame]) -> pd.DataFrame:
+        """
+        pd.concat of compact frames keeping the categorical columns
+        categorical (their categories are united, pd.concat would fall back
+        to object when they differ).
+        """
+        frames = [df for df in frames if len(df)]
+        if len(frames) <= 1:
+            return frames[0] if frames else pd.DataFrame()
+        categorical = [column for column, dtype in frames[0].dtypes.items() if isinstance(dtype, pd.CategoricalDtype)]
+        df = pd.concat([frame.drop(columns=categorical) for frame in frames], ignore_index=True)
+        for column in categorical:
+            df[column] = union_categoricals([frame[column] for frame in frames])
+        return df[frames[0].columns]
 
-        df['date'] = df['datetime'].dt.date
-        df['time'] = df['datetime'].dt.time
+    @staticmethod
+    def _add_datetime_columns(df: pd.DataFrame) -> pd.DataFrame:
+        # a single tz-aware column, date and time are derived from it when displayed
+        df = df.assign(datetime=pd.to_datetime(df['start_time'].astype(np.int64), unit='s', utc=True).dt.tz_convert('Europe/Rome'))
 
         df.sort_values(by="datetime", ascending=False, inplace=True)
-        
+        return df
+
+    @staticmethod
+    def apply_group_thresholds(df: pd.DataFrame, confidence_thresholds: Dict[str, float]) -> pd.DataFrame:
+        """
+        Vectorized version of the per-datetime logic of process_detections.
+
+        Rows sharing the same start_time (and station) form a group; the confidence of the
+        first 'None_' row of each group is broadcast to the whole group with
+        groupby-transform, then everything is decided with boolean masks.
+        'None_' rows are never kept, so groups holding only 'None_' disappear.
+        """
         if df.empty:
             return df
-        
-        # final_rows = []
-        # for datetime_group, group_df in df.groupby("datetime"):
-        #     # cerca none nel gruppo
-        #     none_rows = group_df[group_df["species"] == "None_"]
-        #     other_species_rows = group_df[group_df["species"] != "None_"]
-
-        #     # caso solo None 
-        #     if len(none_rows) > 0 and len(other_species_rows) == 0:
-        #         continue    # skip this datetime
-
-        #     # caso none con altre specie
-        #     if len(none_rows) > 0:
-        #         none_confidence = none_rows.iloc[0]["confidence"]
-        #         none_threshold = confidence_thresholds.get("None_", 0.2)
-
-        #         if none_confidence >= none_threshold:
-        #             continue    # skip this datetime
-
-        #     # controlla le altre specie
-        #     for _, row in other_species_rows.iterrows():
-        #         species = row["species"]
-        #         confidence = row["confidence"]
-        #         threshold = confidence_thresholds.get(species, 0.2)
-
-        #         # if confidence >= threshold:
-        #         final_rows.append(row)
-        final_rows = df
-        # if final_rows:
-        result_df = pd.DataFrame(final_rows)
-        result_df.sort_values(by="datetime", ascending=False, inplace=True)
-        return result_df
-
-        return pd.DataFrame(columns=df.columns)
-    
+        return df[DataProcessor._threshold_mask(DataProcessor._add_group_columns(df), confidence_thresholds)]
+
+    @staticmethod
+    def _add_group_columns(df: pd.DataFrame) -> pd.DataFrame:
+        # threshold independent inputs of _threshold_mask
+        codes = ThresholdRegistry.codes(df["species"])
+        group = df["start_time"].to_numpy().astype(np.int64)
+        if "station" in df.columns:
+            # same start_time on two stations: two groups, station code above the 32 timestamp bits
+            group = group | (pd.factorize(df["station"])[0].astype(np.int64) << 32)
+        # confidence of the first None_ row of every group, NaN included (a NaN None_ suppresses nothing)
+        is_none = (df["species"] == "None_").to_numpy()
+        none_confidence = pd.Series(df["confidence"].to_numpy()[is_none], index=group[is_none])
+        none_confidence = none_confidence[~none_confidence.index.duplicated()]
+        return df.assign(
+            species_code=codes.astype(np.int16) if codes.max(initial=0) < 2**15 else codes,
+            group_none_confidence=none_confidence.reindex(group).to_numpy(),
+        )
+
+    @staticmethod
+    def _threshold_mask(df: pd.DataFrame, confidence_thresholds: Dict[str, float]) -> np.ndarray:
+        # None_ registered first, the array must hold its threshold even if neither the profile nor the frame has it
+        none_code = ThresholdRegistry.codes(pd.Series(["None_"]))[0]
+        thresholds = ThresholdRegistry.array(confidence_thresholds)
+        codes = df["species_code"].to_numpy()
+
+        is_none = codes == none_code
+        suppressed = df["group_none_confidence"].to_numpy() >= thresholds[none_code]   # NaN (no None_ in group) -> False
+        above_threshold = df["confidence"].to_numpy(dtype=float) >= thresholds[codes]
+        return ~is_none & ~suppressed & above_threshold
+
+    @staticmethod
+    @instrumented("prepare_detections")
+    def prepare_detections(detections: Union[List[Dict[str, Any]], pd.DataFrame]) -> pd.DataFrame:
+        """
+        Everything of process_detections that does not depend on the
+        thresholds, done once per data refresh: the result goes through
+        select_detections every time thresholds change, without rebuilding
+        the frame or regrouping it. Takes the API records or a frame of
+        them (e.g. from DetectionCache).
+        """
+        if len(detections) == 0:
+            return pd.DataFrame()
+        df = DataProcessor._add_group_columns(DataProcessor.compact(pd.DataFrame(detections)))
+        return DataProcessor._add_datetime_columns(df)
+
+    @staticmethod
+    @instrumented("select_detections")
+    def select_detections(df: pd.DataFrame, confidence_thresholds: Dict[str, float] = None) -> pd.DataFrame:
+        """Rows of a prepare_detections frame kept by the logic of process_detections"""
+        if df.empty:
+            return df
+        return df[DataProcessor._threshold_mask(df, confidence_thresholds or {})]
+
+    @staticmethod
+    @instrumented("display_columns")
+    def add_display_columns(df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Adds 'species_display', the species names as shown in the table
+        (categorical, formatted once per species), used to sort and filter it.
+        Other display values are derived per page by the table.
+        """
+        if df.empty:
+            return df
+        species = df["species"].astype("category")
+        labels = species.cat.categories.str.replace("_", ", ")
+        return df.assign(species_display=species.map(dict(zip(species.cat.categories, labels))))
+
     @staticmethod
+    @instrumented("filter_non_species")
     def filter_non_species(df, non_species_list):
         if df.empty or "species" not in df.columns:
             return df
-        mask = ~df["species"].astype(str).str.startswith(non_species_list)
+        species = df["species"]
+        if isinstance(species.dtype, pd.CategoricalDtype):
+            # one startswith per category instead of one per row
+            keep = ~species.cat.categories.str.startswith(tuple(non_species_list))
+            return df[keep[species.cat.codes.to_numpy()]]
+        mask = ~species.astype(str).str.startswith(non_species_list)
         return df[mask]
@@ -0,0 +1,160 @@
+from config import Config
+from instrumentation import Instrumentation, instrumented
+import logging
+import threading
+import time
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+from api_client import APIClient
+from data_processor import DataProcessor
+from detection_store import DetectionStore
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class Partition(NamedTuple):
+    frame: pd.DataFrame     # compact detections of one station and day
+    fetched_at: float       # time.monotonic() of the load, -inf once invalidated
+    closed: bool            # the station moved past the day and it was synced: it never changes again
+
+class DetectionCache:
+    """
+    Process-wide detections cache shared by every session, one partition per
+    (station, day) read from the detection stores.
+
+    Closed days (as recorded by the store of the station) have no TTL. Open
+    days (today, or days a station could not be synced yet) are synced again
+    once older than Config.CACHE_TTL_DETECTIONS or after
+    DetectionCache.invalidate. Sessions
+    asking for the same stale partitions at the same time share one sync: the
+    first one runs it, the others wait for its result. Beyond
+    Config.DETECTION_CACHE_MAX_ROWS the least recently used partitions are
+    dropped (they are read again from disk when needed). DetectionCache.resync
+    reopens days already closed, to fetch detections a station uploaded late.
+    """
+
+    _lock = threading.Lock()
+    _partitions: "OrderedDict[Tuple[str, date], Partition]" = OrderedDict()    # least recently used first
+    _in_flight: Dict[tuple, Future] = {}
+
+    @staticmethod
+    def _days(start_date: date, end_date: date) -> List[date]:
+        return [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+
+    @staticmethod
+    def _is_stale(partition: Optional[Partition], now: float) -> bool:
+        return partition is None or (not partition.closed and now - partition.fetched_at > Config.CACHE_TTL_DETECTIONS)
+
+    @classmethod
+    @instrumented("detection_cache")
+    def get(cls, start_date: date, end_date: date, stations: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        """Compact detections of the range from the given stations (all by default), stale partitions synced first"""
+        stations = tuple(client.station for client in APIClient.stations(stations))
+        keys = [(s, day) for s in stations for day in cls._days(start_date, end_date)]
+        now = time.monotonic()
+        frames = {}
+        with cls._lock:
+            for key in keys:
+                partition = cls._partitions.get(key)
+                if not cls._is_stale(partition, now):
+                    cls._partitions.move_to_end(key)
+                    frames[key] = partition.frame
+        stale = [key for key in keys if key not in frames]
+        if stale:
+            Instrumentation.count("cache_misses")
+            stale_days = [day for _, day in stale]
+            loaded = cls._refresh(min(stale_days), max(stale_days), tuple(dict.fromkeys(s for s, _ in stale)))
+            frames.update((key, loaded[key].frame) for key in stale)
+        else:
+            Instrumentation.count("cache_hits")
+
+        result = DataProcessor.concat([frames[key] for key in keys])
+        with cls._lock:
+            # only once the result is built, the partitions of the range are kept
+            cls._evict(keep=keys)
+        return result
+
+    @classmethod
+    def _refresh(cls, start_date: date, end_date: date, stations: Tuple[str, ...]) -> Dict[Tuple[str, date], Partition]:
+        """Sync and reload the range, joining an identical refresh already running; the partitions loaded"""
+        key = (start_date, end_date, stations)
+        with cls._lock:
+            future = cls._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = cls._in_flight[key] = Future()
+        if not owner:
+            Instrumentation.count("coalesced")
+            return future.result()
+        try:
+            partitions = cls._load(start_date, end_date, stations)
+            future.set_result(partitions)
+            return partitions
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with cls._lock:
+                del cls._in_flight[key]
+
+    @classmethod
+    def _load(cls, start_date: date, end_date: date, stations: Tuple[str, ...]) -> Dict[Tuple[str, date], Partition]:
+        DetectionStore.sync_stations(start_date, end_date, stations)
+        fetched_at = time.monotonic()
+        partitions = {}
+        for client in APIClient.stations(stations):
+            closed = DetectionStore.closed_days(start_date, end_date, client.station)
+            df = DataProcessor.compact(pd.DataFrame(DetectionStore.load_or_fetch(start_date, end_date, client)))
+            start_times = df["start_time"].to_numpy() if len(df) else np.zeros(0, dtype=np.uint32)
+            for day in cls._days(start_date, end_date):
+                day_start, day_end = DetectionStore._day_bounds(day)
+                lo = np.searchsorted(start_times, day_start, side="left")
+                hi = np.searchsorted(start_times, day_end, side="right")
+                partitions[(client.station, day)] = Partition(df.iloc[lo:hi].reset_index(drop=True), fetched_at, day in closed)
+
+        with cls._lock:
+            for key, partition in partitions.items():
+                cls._partitions[key] = partition
+                cls._partitions.move_to_end(key)
+        return partitions
+
+    @classmethod
+    def _evict(cls, keep: Iterable[Tuple[str, date]]):
+        keep = set(keep)
+        rows = sum(len(partition.frame) for partition in cls._partitions.values())
+        for key in list(cls._partitions):
+            if rows <= Config.DETECTION_CACHE_MAX_ROWS:
+                break
+            if key not in keep:
+                rows -= len(cls._partitions.pop(key).frame)
+
+    @classmethod
+    def invalidate(cls):
+        """Manual refresh: the open partitions are synced again on next use, closed ones are kept"""
+        with cls._lock:
+            for key, partition in cls._partitions.items():
+                if not partition.closed:
+                    cls._partitions[key] = partition._replace(fetched_at=float("-inf"))
+
+    @classmethod
+    def resync(cls, start_date: date, end_date: date, stations: Optional[Iterable[str]] = None):
+        """Every day of the range synced again whole on next use, closed ones included (see DetectionStore.reopen)"""
+        stations = tuple(client.station for client in APIClient.stations(stations))
+        for station in stations:
+            DetectionStore.reopen(start_date, end_date, station)
+        with cls._lock:
+            for key in [(s, day) for s in stations for day in cls._days(start_date, end_date)]:
+                cls._partitions.pop(key, None)
+
+    @classmethod
+    def summary(cls) -> Dict[str, int]:
+        with cls._lock:
+            return {
+                "partitions": len(cls._partitions),
+                "closed": sum(partition.closed for partition in cls._partitions.values()),
+                "rows": sum(len(partition.frame) for partition in cls._partitions.values()),
+            }
@@ -0,0 +1,110 @@
+from instrumentation import instrumented
+import logging
+import numpy as np
+import pandas as pd
+from datetime import date
+from typing import Iterable, Optional
+from api_client import APIClient
+from detection_store import DetectionStore, CONFIDENCE_BINS
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class DetectionRollups:
+    """
+    Summaries of the detection store answered from its rollup tables:
+    per-day, per-hour and per-species counts, confidence histograms and
+    first/last-seen times. The rollups are kept up to date by the store on
+    every sync, so a query costs the same for a day or a year of detections
+    and never touches the raw rows. Call DetectionStore.sync_stations for the
+    range first, as DetectionStore.fetch_detections does.
+
+    Every query runs on the store of each station in `stations` (all of them
+    by default) and the partial results are combined.
+    """
+
+    @staticmethod
+    def _query(sql: str, params: tuple, stations: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        frames = []
+        for client in APIClient.stations(stations):
+            with DetectionStore._connect(client.station) as conn:
+                frames.append(pd.read_sql_query(sql, conn, params=params))
+        return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+    @staticmethod
+    def _exclude(df: pd.DataFrame, exclude_prefixes: Iterable[str]) -> pd.DataFrame:
+        exclude_prefixes = tuple(exclude_prefixes)
+        if not exclude_prefixes or df.empty:
+            return df
+        return df[~df["species"].str.startswith(exclude_prefixes)]
+
+    @staticmethod
+    @instrumented("rollups.daily")
+    def daily(start_date: date, end_date: date, exclude_prefixes: Iterable[str] = (),
+              stations: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        """Detections and distinct species per day, every day of the range included"""
+        df = DetectionRollups._query(
+            "SELECT day, species, SUM(detections) AS detections FROM rollup_hours "
+            "WHERE day BETWEEN ? AND ? GROUP BY day, species",
+            (start_date.isoformat(), end_date.isoformat()), stations
+        )
+        df = DetectionRollups._exclude(df, exclude_prefixes)
+        daily = df.groupby("day").agg(detections=("detections", "sum"), species=("species", "nunique"))
+        daily.index = pd.to_datetime(daily.index)
+        return daily.reindex(pd.date_range(start_date, end_date, name="day"), fill_value=0)
+
+    @staticmethod
+    @instrumented("rollups.hourly")
+    def hourly(start_date: date, end_date: date, exclude_prefixes: Iterable[str] = (),
+               stations: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        """Detections per hour of the day over the range, hours 0-23"""
+        df = DetectionRollups._query(
+            "SELECT hour, species, SUM(detections) AS detections FROM rollup_hours "
+            "WHERE day BETWEEN ? AND ? GROUP BY hour, species",
+            (start_date.isoformat(), end_date.isoformat()), stations
+        )
+        df = DetectionRollups._exclude(df, exclude_prefixes)
+        hourly = df.groupby("hour")[["detections"]].sum()
+        return hourly.reindex(pd.RangeIndex(24, name="hour"), fill_value=0)
+
+    @staticmethod
+    @instrumented("rollups.species")
+    def species(start_date: date, end_date: date, exclude_prefixes: Iterable[str] = (),
+                stations: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        """Detections, mean confidence and first/last seen per species, most detected first"""
+        df = DetectionRollups._query(
+            "SELECT species, SUM(detections) AS detections, SUM(confidence_sum) AS confidence_sum, "
+            "MIN(first_seen) AS first_seen, MAX(last_seen) AS last_seen FROM rollup_hours "
+            "WHERE day BETWEEN ? AND ? GROUP BY species",
+            (start_date.isoformat(), end_date.isoformat()), stations
+        )
+        # a species seen by several stations has one row per station
+        df = df.groupby("species", as_index=False).agg(
+            detections=("detections", "sum"), confidence_sum=("confidence_sum", "sum"),
+            first_seen=("first_seen", "min"), last_seen=("last_seen", "max"),
+        )
+        df.insert(2, "mean_confidence", df.pop("confidence_sum") / df["detections"])
+        df = DetectionRollups._exclude(df, exclude_prefixes)
+        for column in ("first_seen", "last_seen"):
+            df[column] = pd.to_datetime(df[column], unit="s", utc=True).dt.tz_convert("Europe/Rome")
+        return df.sort_values("detections", ascending=False, ignore_index=True)
+
+    @staticmethod
+    @instrumented("rollups.confidence")
+    def confidence_histogram(start_date: date, end_date: date, exclude_prefixes: Iterable[str] = (),
+                             bin_width: float = 0.05, stations: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        """Detections per confidence bin of `bin_width` (a multiple of 0.01), every bin of 0-1 included"""
+        df = DetectionRollups._query(
+            "SELECT species, bin, SUM(detections) AS detections FROM rollup_confidence "
+            "WHERE day BETWEEN ? AND ? GROUP BY species, bin",
+            (start_date.isoformat(), end_date.isoformat()), stations
+        )
+        df = DetectionRollups._exclude(df, exclude_prefixes)
+
+        group = max(int(round(bin_width * CONFIDENCE_BINS)), 1)
+        counts = np.bincount(df["bin"].to_numpy(dtype=int) // group, weights=df["detections"].to_numpy(),
+                             minlength=-(-CONFIDENCE_BINS // group))
+        return pd.DataFrame({
+            "confidence": np.arange(len(counts)) * group / CONFIDENCE_BINS,
+            "detections": counts.astype(int),
+        })
@@ -0,0 +1,353 @@
+from config import Config
+from instrumentation import instrumented
+import logging
+import sqlite3
+import threading
+import requests
+import streamlit as st
+from contextlib import contextmanager
+from api_client import APIClient
+from datetime import datetime, date, time, timedelta
+from pathlib import Path
+from typing import List, Dict, Any, Iterable, Optional, Set
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DETECTION_COLUMNS = ("start_time", "filename", "species", "confidence", "duration")
+
+# Rollups: pre-aggregated counts updated with every batch of new detections,
+# so long-range summaries never read raw rows (see detection_rollups.py).
+# Bump ROLLUP_SCHEMA_VERSION when they change: they are rebuilt on next connect.
+ROLLUP_SCHEMA_VERSION = 1
+CONFIDENCE_BINS = 100   # histogram bins of width 0.01
+ROLLUP_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS rollup_hours (
+        day TEXT NOT NULL,
+        hour INTEGER NOT NULL,
+        species TEXT NOT NULL,
+        detections INTEGER NOT NULL,
+        confidence_sum REAL NOT NULL,
+        first_seen INTEGER NOT NULL,
+        last_seen INTEGER NOT NULL,
+        PRIMARY KEY (day, hour, species)
+    ) WITHOUT ROWID""",
+    # keyed by species and bin first: a histogram over a long range is one ordered scan, no sort
+    """CREATE TABLE IF NOT EXISTS rollup_confidence (
+        day TEXT NOT NULL,
+        species TEXT NOT NULL,
+        bin INTEGER NOT NULL,
+        detections INTEGER NOT NULL,
+        PRIMARY KEY (species, bin, day)
+    ) WITHOUT ROWID""",
+)
+# add the rows of {source} to the rollups ("WHERE true" keeps ON CONFLICT unambiguous after a SELECT)
+ROLLUP_UPDATES = (
+    """INSERT INTO rollup_hours (day, hour, species, detections, confidence_sum, first_seen, last_seen)
+    SELECT day, CAST(strftime('%H', start_time, 'unixepoch', 'localtime') AS INTEGER), species,
+           COUNT(*), SUM(COALESCE(confidence, 0)), MIN(start_time), MAX(start_time)
+    FROM {source} WHERE true GROUP BY 1, 2, 3
+    ON CONFLICT (day, hour, species) DO UPDATE SET
+        detections = detections + excluded.detections,
+        confidence_sum = confidence_sum + excluded.confidence_sum,
+        first_seen = MIN(first_seen, excluded.first_seen),
+        last_seen = MAX(last_seen, excluded.last_seen)""",
+    f"""INSERT INTO rollup_confidence (day, species, bin, detections)
+    SELECT day, species, MIN(MAX(CAST(COALESCE(confidence, 0) * {CONFIDENCE_BINS} AS INTEGER), 0), {CONFIDENCE_BINS - 1}),
+           COUNT(*)
+    FROM {{source}} WHERE true GROUP BY 1, 2, 3
+    ON CONFLICT (species, bin, day) DO UPDATE SET detections = detections + excluded.detections""",
+)
+
+class DetectionStore:
+    """
+    Persistent local copy of the detections served by the stations.
+
+    Every station has its own SQLite file (see DetectionStore.path), rows are
+    partitioned by (local) day. For every day the
+    store remembers the highest `start_time` already synced and whether the day
+    is closed, i.e. the station had detections more than
+    Config.DETECTION_CLOSE_GRACE after its end at the last sync. Closed days
+    are served from disk only (DetectionStore.reopen forces a new sync), today
+    is topped up with the detections newer than its high-water mark, past days
+    still open are fetched again whole. Every batch of new rows also updates
+    the rollup tables.
+    """
+
+    # one sync at a time per station, a later one waits and only fetches what is left
+    _sync_locks: Dict[str, threading.Lock] = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def path(station: Optional[str] = None) -> Path:
+        """Store of `station`: Config.DETECTION_STORE_PATH for the default station, a sibling file for the others"""
+        if station is None or station == next(iter(Config.STATIONS)):
+            return Config.DETECTION_STORE_PATH
+        path = Config.DETECTION_STORE_PATH
+        return path.with_name(f"{path.stem}_{station}{path.suffix}")
+
+    @staticmethod
+    @contextmanager
+    def _connect(station: Optional[str] = None):
+        path = DetectionStore.path(station)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(path, timeout=Config.REQUEST_TIMEOUT)
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS detections (
+                day TEXT NOT NULL,
+                start_time INTEGER NOT NULL,
+                filename INTEGER NOT NULL,
+                species TEXT NOT NULL,
+                confidence REAL,
+                duration REAL,
+                PRIMARY KEY (day, start_time, filename, species)
+            )"""
+        )
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS synced_days (
+                day TEXT PRIMARY KEY,
+                high_water INTEGER NOT NULL,
+                closed INTEGER NOT NULL DEFAULT 0
+            )"""
+        )
+        if conn.execute("PRAGMA user_version").fetchone()[0] < ROLLUP_SCHEMA_VERSION:
+            DetectionStore._create_rollups(conn)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _create_rollups(conn: sqlite3.Connection):
+        """Create the rollup tables and trigger, backfilled from the rows already stored"""
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # another session may have done it while we waited for the lock
+            if conn.execute("PRAGMA user_version").fetchone()[0] < ROLLUP_SCHEMA_VERSION:
+                for statement in ROLLUP_SCHEMA:
+                    conn.execute(statement)
+                conn.execute("DELETE FROM rollup_hours")
+                conn.execute("DELETE FROM rollup_confidence")
+                for statement in ROLLUP_UPDATES:
+                    conn.execute(statement.format(source="detections"))
+                conn.execute(f"PRAGMA user_version = {ROLLUP_SCHEMA_VERSION}")
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+
+    @staticmethod
+    def _day_bounds(day: date) -> tuple:
+        return (
+            int(datetime.combine(day, time.min).timestamp()),
+            int(datetime.combine(day, time.max).timestamp()),
+        )
+
+    @staticmethod
+    def _day_key(start_time: int) -> str:
+        return datetime.fromtimestamp(start_time).date().isoformat()
+
+    @staticmethod
+    def sync(start_date: date, end_date: date, station: Optional[str] = None) -> bool:
+        """
+        Bring the local store of `station` (the default one if None) up to
+        date for the given date range.
+
+        Only the span from the oldest open day (from its high-water mark
+        minus Config.DETECTION_SYNC_OVERLAP seconds for today, to catch late
+        classifications) to the end of the range is requested, streamed in
+        day windows. Returns
+        False if the station could not be reached, in which case the sync
+        state is left untouched.
+        """
+        client = APIClient.station(station)
+        try:
+            DetectionStore._sync(start_date, end_date, client)
+            return True
+        except (requests.exceptions.RequestException, ValueError) as e:
+            st.error(f"Error while fetching info from {client.station}: {e}")
+            return False
+
+    @staticmethod
+    def sync_stations(start_date: date, end_date: date,
+                      stations: Optional[Iterable[str]] = None) -> Dict[str, Exception]:
+        """
+        Sync the stores of every station concurrently, waiting at most
+        Config.STATION_TIMEOUT. Returns the stations that failed, or are
+        still syncing in background, with their error.
+        """
+        synced = APIClient.fan_out(lambda client: DetectionStore._sync(start_date, end_date, client), stations)
+        for station, error in synced.errors.items():
+            st.warning(f"Station {station} not synced, showing the detections stored so far: {error}")
+        return synced.errors
+
+    @staticmethod
+    @instrumented("store.sync")
+    def _sync(start_date: date, end_date: date, client: APIClient):
+        """DetectionStore.sync raising the request errors, safe to call outside the script thread"""
+        with DetectionStore._lock:
+            lock = DetectionStore._sync_locks.setdefault(client.station, threading.Lock())
+        with lock:
+            DetectionStore._sync_locked(start_date, end_date, client)
+
+    @staticmethod
+    def _sync_locked(start_date: date, end_date: date, client: APIClient):
+        now = int(datetime.now().timestamp())
+        days = [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+
+        with DetectionStore._connect(client.station) as conn:
+            state = {
+                row[0]: (row[1], bool(row[2]))
+                for row in conn.execute(
+                    "SELECT day, high_water, closed FROM synced_days WHERE day BETWEEN ? AND ?",
+                    (start_date.isoformat(), end_date.isoformat())
+                )
+            }
+
+            open_days = []
+            for day in days:
+                day_start, day_end = DetectionStore._day_bounds(day)
+                if day_start > now:
+                    break
+                high_water, closed = state.get(day.isoformat(), (None, False))
+                if closed:
+                    continue
+                # a day over but not closed yet is fetched whole: late detections can be older than its high-water mark
+                if high_water is None or day_end < now:
+                    since = day_start
+                else:
+                    since = max(day_start, high_water - Config.DETECTION_SYNC_OVERLAP)
+                open_days.append((day, since))
+
+            if not open_days:
+                return
+
+            since = min(s for _, s in open_days)
+            until = min(DetectionStore._day_bounds(open_days[-1][0])[1], now)
+            synced = 0
+            # windows are inserted as they arrive, state only moves once all of them did
+            for _, detections in client.stream_detections(since, until):
+                DetectionStore._insert(conn, detections)
+                synced += len(detections)
+
+            # a day is closed once the station has detections well past its end, not on the clock alone:
+            # a station with a backlog or back from an outage still uploads the detections of past days
+            (latest,) = conn.execute("SELECT MAX(start_time) FROM detections").fetchone()
+            for day, _ in open_days:
+                day_start, day_end = DetectionStore._day_bounds(day)
+                key = day.isoformat()
+                (high_water,) = conn.execute(
+                    "SELECT COALESCE(MAX(start_time), ?) FROM detections WHERE day = ?", (day_start, key)
+                ).fetchone()
+                closed = latest is not None and latest > day_end + Config.DETECTION_CLOSE_GRACE
+                conn.execute(
+                    "INSERT OR REPLACE INTO synced_days (day, high_water, closed) VALUES (?, ?, ?)",
+                    (key, high_water, int(closed))
+                )
+
+        logger.info(f"Synced {synced} detections of {client.station} since {since}")
+
+    @staticmethod
+    def reopen(start_date: date, end_date: date, station: Optional[str] = None):
+        """Forget the sync state of the days of the range: the next sync fetches them again whole"""
+        station = APIClient.station(station).station
+        with DetectionStore._lock:
+            lock = DetectionStore._sync_locks.setdefault(station, threading.Lock())
+        with lock, DetectionStore._connect(station) as conn:
+            conn.execute("DELETE FROM synced_days WHERE day BETWEEN ? AND ?", (start_date.isoformat(), end_date.isoformat()))
+        logger.info(f"Days from {start_date} to {end_date} of {station} will be synced again")
+
+    @staticmethod
+    def _insert(conn: sqlite3.Connection, detections: List[Dict[str, Any]]):
+        """Insert the detections not stored yet and add them to the rollups"""
+        rows = [
+            (
+                DetectionStore._day_key(int(d["start_time"])),
+                int(d["start_time"]),
+                int(d["filename"]),
+                d["species"],
+                d.get("confidence"),
+                d.get("duration"),
+            )
+            for d in detections
+        ]
+        # staged first, so that only the rows actually new (not the re-synced overlap) reach the rollups
+        conn.execute(
+            """CREATE TEMP TABLE IF NOT EXISTS incoming (
+                day TEXT NOT NULL,
+                start_time INTEGER NOT NULL,
+                filename INTEGER NOT NULL,
+                species TEXT NOT NULL,
+                confidence REAL,
+                duration REAL,
+                PRIMARY KEY (day, start_time, filename, species)
+            )"""
+        )
+        conn.execute("DELETE FROM incoming")
+        conn.executemany(
+            "INSERT OR IGNORE INTO incoming (day, start_time, filename, species, confidence, duration) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            rows
+        )
+        conn.execute(
+            "DELETE FROM incoming WHERE EXISTS (SELECT 1 FROM detections d WHERE d.day = incoming.day "
+            "AND d.start_time = incoming.start_time AND d.filename = incoming.filename AND d.species = incoming.species)"
+        )
+        conn.execute(
+            "INSERT INTO detections (day, start_time, filename, species, confidence, duration) "
+            "SELECT day, start_time, filename, species, confidence, duration FROM incoming"
+        )
+        for statement in ROLLUP_UPDATES:
+            conn.execute(statement.format(source="incoming"))
+
+    @staticmethod
+    @instrumented("store.load")
+    def load(start_date: date, end_date: date, station: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Stored detections of `station` (the default one if None), each with its `station` name"""
+        station = APIClient.station(station).station
+        with DetectionStore._connect(station) as conn:
+            cursor = conn.execute(
+                f"SELECT ?, {', '.join(DETECTION_COLUMNS)} FROM detections "
+                "WHERE day BETWEEN ? AND ? ORDER BY start_time",
+                (station, start_date.isoformat(), end_date.isoformat())
+            )
+            return [dict(zip(("station",) + DETECTION_COLUMNS, row)) for row in cursor]
+
+    @staticmethod
+    def fetch_detections(start_date: date, end_date: date,
+                         stations: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Sync the range with every station (or the given ones) concurrently and
+        return it from the local stores, merged. A station that is offline or
+        slower than Config.STATION_TIMEOUT is served from what it has stored.
+        """
+        clients = APIClient.stations(stations)
+        DetectionStore.sync_stations(start_date, end_date, [client.station for client in clients])
+        detections = []
+        for client in clients:
+            detections += DetectionStore.load_or_fetch(start_date, end_date, client)
+        return detections
+
+    @staticmethod
+    def closed_days(start_date: date, end_date: date, station: Optional[str] = None) -> Set[date]:
+        """Days of the range fully synced from `station`, they will not change anymore"""
+        try:
+            with DetectionStore._connect(station) as conn:
+                rows = conn.execute(
+                    "SELECT day FROM synced_days WHERE closed AND day BETWEEN ? AND ?",
+                    (start_date.isoformat(), end_date.isoformat())
+                ).fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Detection store of {station} unavailable: {e}")
+            return set()
+        return {date.fromisoformat(day) for (day,) in rows}
+
+    @staticmethod
+    def load_or_fetch(start_date: date, end_date: date, client: APIClient) -> List[Dict[str, Any]]:
+        """DetectionStore.load, falling back to a full fetch from the station if its store is unavailable"""
+        try:
+            return DetectionStore.load(start_date, end_date, client.station)
+        except sqlite3.Error as e:
+            logger.error(f"Detection store of {client.station} unavailable, falling back to a full fetch: {e}")
+            return [dict(d, station=client.station) for d in client.fetch_detections(start_date, end_date)]
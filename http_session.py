@@ -0,0 +1,133 @@
+from config import Config
+from instrumentation import Instrumentation
+import logging
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from typing import Dict, Any, List
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS_CODES = (502, 503, 504)
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised without touching the network while a station is considered unreachable"""
+
+class HTTPSession:
+    """
+    Process-wide HTTP layer shared by every APIClient call.
+
+    - one requests.Session with a pooled, keep-alive adapter, a pool per station;
+    - bounded retries with exponential backoff and full jitter on connection
+      errors, timeouts and 502/503/504;
+    - a circuit breaker per station: after Config.CIRCUIT_FAILURE_THRESHOLD
+      consecutive failed attempts every call to that station fails fast for
+      Config.CIRCUIT_COOLDOWN seconds, then a single trial call decides
+      whether it closes again. Other stations are not affected;
+    - request, error and latency counters per endpoint.
+    """
+
+    _session = None
+    _lock = threading.Lock()
+    _consecutive_failures: Dict[str, int] = {}
+    _open_until: Dict[str, float] = {}
+    _stats: Dict[str, Dict[str, float]] = {}
+
+    @classmethod
+    def session(cls) -> requests.Session:
+        with cls._lock:
+            if cls._session is None:
+                session = requests.Session()
+                # one keep-alive pool per station, fewer would make their pools evict each other
+                adapter = HTTPAdapter(pool_connections=max(len(Config.STATIONS), 1), pool_maxsize=Config.HTTP_POOL_SIZE)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.headers["Accept-Encoding"] = "gzip, deflate" if Config.HTTP_GZIP else "identity"
+                cls._session = session
+            return cls._session
+
+    @classmethod
+    def get(cls, endpoint: str, url: str, circuit: str = "default", **kwargs) -> requests.Response:
+        """
+        GET `url` through the shared session, `endpoint` names the counters
+        and `circuit` the breaker (one per station).
+        Raises the last requests exception once retries are exhausted.
+        """
+        for attempt in range(Config.HTTP_MAX_RETRIES + 1):
+            if cls.is_circuit_open(circuit):
+                cls._record(endpoint, 0.0, error=True, fast_fail=True)
+                raise CircuitOpenError(f"Circuit open, skipping request to {url}")
+
+            start = time.monotonic()
+            try:
+                response = cls.session().get(url, **kwargs)
+                if response.status_code in RETRY_STATUS_CODES:
+                    response.close()
+                    response.raise_for_status()
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout,
+                    requests.exceptions.HTTPError) as e:
+                cls._record(endpoint, time.monotonic() - start, error=True)
+                cls._failure(circuit)
+                if attempt == Config.HTTP_MAX_RETRIES:
+                    raise
+                delay = random.uniform(0, min(Config.HTTP_BACKOFF_MAX, Config.HTTP_BACKOFF_BASE * 2 ** attempt))
+                logger.warning(f"{endpoint}: attempt {attempt + 1} failed ({e}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+            else:
+                cls._record(endpoint, time.monotonic() - start, error=response.status_code >= 400)
+                cls._success(circuit)
+                if not kwargs.get("stream"):
+                    Instrumentation.count("bytes", len(response.content))
+                return response
+
+    @classmethod
+    def _failure(cls, circuit: str):
+        with cls._lock:
+            cls._consecutive_failures[circuit] = cls._consecutive_failures.get(circuit, 0) + 1
+            if cls._consecutive_failures[circuit] >= Config.CIRCUIT_FAILURE_THRESHOLD:
+                cls._open_until[circuit] = time.monotonic() + Config.CIRCUIT_COOLDOWN
+                logger.error(f"{circuit} unreachable, failing fast for {Config.CIRCUIT_COOLDOWN}s")
+
+    @classmethod
+    def _success(cls, circuit: str):
+        with cls._lock:
+            cls._consecutive_failures.pop(circuit, None)
+            cls._open_until.pop(circuit, None)
+
+    @classmethod
+    def _record(cls, endpoint: str, latency: float, error: bool, fast_fail: bool = False):
+        with cls._lock:
+            stats = cls._stats.setdefault(
+                endpoint,
+                {"requests": 0, "errors": 0, "fast_fails": 0, "total_latency": 0.0, "last_latency": 0.0}
+            )
+            stats["requests"] += 1
+            stats["errors"] += int(error)
+            stats["fast_fails"] += int(fast_fail)
+            if not fast_fail:
+                stats["total_latency"] += latency
+                stats["last_latency"] = latency
+
+    @classmethod
+    def is_circuit_open(cls, circuit: str = None) -> bool:
+        """Whether calls to `circuit` fail fast, with None whether any circuit does"""
+        return bool(cls.open_circuits()) if circuit is None else time.monotonic() < cls._open_until.get(circuit, 0.0)
+
+    @classmethod
+    def open_circuits(cls) -> List[str]:
+        now = time.monotonic()
+        return [circuit for circuit, until in list(cls._open_until.items()) if now < until]
+
+    @classmethod
+    def stats(cls) -> Dict[str, Dict[str, Any]]:
+        """Counters per endpoint, with the mean latency of the requests actually sent"""
+        with cls._lock:
+            result = {}
+            for endpoint, stats in cls._stats.items():
+                sent = stats["requests"] - stats["fast_fails"]
+                result[endpoint] = dict(stats, mean_latency=stats["total_latency"] / sent if sent else 0.0)
+            return result
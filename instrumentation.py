@@ -0,0 +1,166 @@
+from config import Config
+import contextvars
+import functools
+import json
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class RerunTrace:
+    """Stages and counters recorded during one run of the Streamlit script, or of one of its fragments"""
+
+    def __init__(self, fragment: Optional[str] = None):
+        self.fragment = fragment
+        self.started_at = datetime.now()
+        self.started = time.perf_counter()
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, **values: float):
+        with self._lock:
+            record = self.stages.setdefault(stage, {"calls": 0, "seconds": 0.0})
+            for key, value in values.items():
+                record[key] = record.get(key, 0) + value
+
+    def to_dict(self) -> Dict[str, Any]:
+        summary = {
+            "started_at": self.started_at.isoformat(timespec="milliseconds"),
+            "total_seconds": time.perf_counter() - self.started,
+            "stages": self.stages,
+        }
+        if self.fragment is not None:
+            summary["fragment"] = self.fragment
+        return summary
+
+_current_trace: contextvars.ContextVar[Optional[RerunTrace]] = contextvars.ContextVar("rerun_trace", default=None)
+_current_stage: contextvars.ContextVar[str] = contextvars.ContextVar("rerun_stage", default="other")
+
+class Instrumentation:
+    """
+    Lightweight per-rerun instrumentation.
+
+    app.py opens a trace at the top of the script and closes it at the end;
+    in between, `stage()` / `@instrumented` record wall time and `count()`
+    adds counters (bytes transferred, cache hits and misses) to the innermost
+    running stage. The trace lives in a ContextVar, so worker threads started
+    with `contextvars.copy_context().run` report to the rerun that started
+    them. A fragment re-run on its own opens a trace named after it (see
+    `fragment_rerun`). Without an open trace every call is a no-op. Finished
+    reruns are kept in a rolling in-memory log and, if
+    Config.INSTRUMENTATION_LOG_PATH is set, appended to it as JSON lines.
+    """
+
+    _log: deque = deque(maxlen=Config.INSTRUMENTATION_LOG_SIZE)
+    _log_lock = threading.Lock()
+
+    @staticmethod
+    def start_rerun(fragment: Optional[str] = None) -> RerunTrace:
+        trace = RerunTrace(fragment)
+        _current_trace.set(trace)
+        return trace
+
+    @classmethod
+    @contextmanager
+    def fragment_rerun(cls, name: str):
+        """
+        Wraps the body of a fragment: timed as the stage `name` when it runs
+        with the whole script, traced and logged as a rerun of its own when
+        the fragment re-runs alone.
+        """
+        if _current_trace.get() is not None:
+            with cls.stage(name):
+                yield
+            return
+        cls.start_rerun(fragment=name)
+        try:
+            with cls.stage(name):
+                yield
+        finally:
+            cls.finish_rerun()
+
+    @classmethod
+    def finish_rerun(cls) -> Optional[Dict[str, Any]]:
+        trace = _current_trace.get()
+        if trace is None:
+            return None
+        _current_trace.set(None)
+        summary = trace.to_dict()
+        with cls._log_lock:
+            cls._log.append(summary)
+            if Config.INSTRUMENTATION_LOG_PATH is not None:
+                try:
+                    cls._append_to_file(summary)
+                except OSError as e:
+                    logger.warning(f"Could not write instrumentation log: {e}")
+        return summary
+
+    @staticmethod
+    def _append_to_file(summary: Dict[str, Any]):
+        path = Config.INSTRUMENTATION_LOG_PATH
+        if path.exists() and path.stat().st_size > Config.INSTRUMENTATION_LOG_MAX_BYTES:
+            path.replace(path.with_name(path.name + ".1"))     # keep one rotated file
+        with path.open("a") as f:
+            f.write(json.dumps(summary) + "\n")
+
+    @staticmethod
+    @contextmanager
+    def stage(name: str, cached: bool = False):
+        """
+        Time the block as `name`. With cached=True the block wraps a cached
+        call: it counts as a cache hit unless a miss was counted inside.
+        """
+        trace = _current_trace.get()
+        if trace is None:
+            yield
+            return
+        misses_before = trace.stages.get(name, {}).get("cache_misses", 0)
+        token = _current_stage.set(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            _current_stage.reset(token)
+            trace.add(name, calls=1, seconds=time.perf_counter() - start)
+            if cached and trace.stages[name].get("cache_misses", 0) == misses_before:
+                trace.add(name, cache_hits=1)
+
+    @staticmethod
+    def count(counter: str, value: float = 1, stage: str = None):
+        """Add to a counter of `stage`, the innermost running stage by default"""
+        trace = _current_trace.get()
+        if trace is None:
+            return
+        trace.add(stage or _current_stage.get(), **{counter: value})
+
+    @staticmethod
+    def current() -> Optional[RerunTrace]:
+        return _current_trace.get()
+
+    @classmethod
+    def log(cls) -> List[Dict[str, Any]]:
+        with cls._log_lock:
+            return list(cls._log)
+
+    @classmethod
+    def export_log(cls) -> str:
+        """Rolling log of the last reruns, one JSON object per line"""
+        return "\n".join(json.dumps(summary) for summary in cls.log()) + "\n"
+
+def instrumented(name: str):
+    """Decorator form of Instrumentation.stage"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _current_trace.get() is None:
+                return fn(*args, **kwargs)
+            with Instrumentation.stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
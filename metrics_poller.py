@@ -0,0 +1,118 @@
+from config import Config
+import logging
+import threading
+import time
+import numpy as np
+import pandas as pd
+from api_client import APIClient
+from typing import Dict, Optional
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# fields of /system_metrics kept in the history, is_recording as 0/1
+METRIC_FIELDS = ("cpu_usage", "ram_usage", "disk_usage", "temperature", "is_recording")
+
+class MetricsRing:
+    """
+    Fixed-size history of the metrics of one station: sample times and one
+    float32 row of METRIC_FIELDS per sample (NaN for a missing field), the
+    oldest sample overwritten once Config.METRICS_HISTORY_SIZE are stored.
+    """
+
+    def __init__(self, size: int):
+        self.times = np.zeros(size, dtype=np.float64)
+        self.values = np.full((size, len(METRIC_FIELDS)), np.nan, dtype=np.float32)
+        self.next = 0
+        self.count = 0
+        self.last_error: Optional[str] = None
+
+    def append(self, timestamp: float, metrics: Dict[str, float]):
+        self.times[self.next] = timestamp
+        # None or missing -> NaN, True/False -> 1/0
+        self.values[self.next] = np.array([metrics.get(field) for field in METRIC_FIELDS], dtype=float)
+        self.next = (self.next + 1) % len(self.times)
+        self.count = min(self.count + 1, len(self.times))
+        self.last_error = None
+
+    def ordered(self, last: Optional[int] = None) -> tuple:
+        """Copies of (times, values) of the last `last` samples (all by default), oldest first"""
+        n = self.count if last is None else min(last, self.count)
+        positions = (self.next - n + np.arange(n)) % len(self.times)
+        return self.times[positions], self.values[positions]
+
+class MetricsPoller:
+    """
+    Background thread sampling the system metrics of every station each
+    Config.METRICS_POLL_INTERVAL seconds into a MetricsRing per station.
+
+    One poller serves every session: the sidebar only reads the rings, so a
+    rerun never waits on the network and more open tabs do not mean more
+    requests to the stations. The thread stops by itself once nobody has read
+    the metrics for Config.METRICS_IDLE_TIMEOUT seconds and is started again
+    by the next reader.
+    """
+
+    _lock = threading.Lock()
+    _thread: Optional[threading.Thread] = None
+    _rings: Dict[str, MetricsRing] = {}
+    _last_read = 0.0
+
+    @classmethod
+    def ensure_started(cls):
+        with cls._lock:
+            cls._last_read = time.monotonic()
+            if cls._thread is None or not cls._thread.is_alive():
+                cls._thread = threading.Thread(target=cls._run, name="metrics-poller", daemon=True)
+                cls._thread.start()
+
+    @classmethod
+    def _run(cls):
+        logger.info(f"Metrics poller started, every {Config.METRICS_POLL_INTERVAL}s")
+        while time.monotonic() - cls._last_read < Config.METRICS_IDLE_TIMEOUT:
+            started = time.monotonic()
+            try:
+                cls.poll()
+            except RuntimeError:
+                break   # station pool shut down, the interpreter is exiting
+            time.sleep(max(Config.METRICS_POLL_INTERVAL - (time.monotonic() - started), 0))
+        logger.info("Metrics poller stopped, no readers")
+
+    @classmethod
+    def poll(cls):
+        """One sample of every station, the stations that fail keep their previous samples"""
+        sampled = APIClient.fan_out(lambda client: client.system_metrics(), timeout=Config.METRICS_POLL_INTERVAL)
+        now = time.time()
+        with cls._lock:
+            for station, metrics in sampled.results.items():
+                cls._ring(station).append(now, metrics)
+            for station, error in sampled.errors.items():
+                cls._ring(station).last_error = str(error)
+
+    @classmethod
+    def _ring(cls, station: str) -> MetricsRing:
+        ring = cls._rings.get(station)
+        if ring is None or len(ring.times) != Config.METRICS_HISTORY_SIZE:
+            ring = cls._rings[station] = MetricsRing(Config.METRICS_HISTORY_SIZE)
+        return ring
+
+    @classmethod
+    def latest(cls, station: str) -> Optional[Dict[str, float]]:
+        """Last sample of the station with its `timestamp` and `error` (of the polls after it), None if none yet"""
+        cls.ensure_started()
+        with cls._lock:
+            ring = cls._rings.get(station)
+            if ring is None or not ring.count:
+                return None
+            times, values = ring.ordered(last=1)
+            return dict(zip(METRIC_FIELDS, values[0].tolist()), timestamp=times[0], error=ring.last_error)
+
+    @classmethod
+    def history(cls, station: str, last: Optional[int] = None) -> pd.DataFrame:
+        """Last `last` samples of the station (all by default), indexed by local time, oldest first"""
+        cls.ensure_started()
+        with cls._lock:
+            ring = cls._rings.get(station)
+            times, values = ring.ordered(last) if ring is not None else (np.zeros(0), np.zeros((0, len(METRIC_FIELDS))))
+        index = pd.to_datetime(times, unit="s", utc=True).tz_convert("Europe/Rome")
+        return pd.DataFrame(values, index=index, columns=list(METRIC_FIELDS))
@@ -0,0 +1,197 @@
+from config import Config
+from instrumentation import Instrumentation, instrumented
+from threshold_registry import ThresholdRegistry
+from utils import Utils, CONFIDENCE_LEVELS
+import logging
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterable, Optional
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class Selection:
+    """
+    Rows of a prepared frame kept by SpeciesIndex.select_rows, as positions
+    with their confidence level and threshold. Only the rows shown are built
+    into a frame (frame()): a page of the table, the first rows of the
+    unpaginated one, the rows of an export.
+    """
+
+    def __init__(self, df: pd.DataFrame, positions: np.ndarray, levels: np.ndarray, thresholds: np.ndarray):
+        self.df = df
+        self.positions = positions      # rows of df kept, in the order of df
+        self.levels = levels            # index in CONFIDENCE_LEVELS of every row kept
+        self.thresholds = thresholds
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def _subset(self, rows) -> "Selection":
+        return Selection(self.df, self.positions[rows], self.levels[rows], self.thresholds[rows])
+
+    def column(self, name: str) -> pd.Series:
+        """One column of df for the rows kept"""
+        return self.df[name].iloc[self.positions]
+
+    def species_count(self) -> int:
+        return int(np.count_nonzero(np.bincount(self.df["species_code"].to_numpy()[self.positions]))) if len(self) else 0
+
+    def exclude(self, prefixes: Iterable[str]) -> "Selection":
+        """Rows whose species does not start with one of `prefixes`, as DataProcessor.filter_non_species"""
+        if not len(self):
+            return self
+        species = self.df["species"].astype("category")
+        keep = ~species.cat.categories.str.startswith(tuple(prefixes))
+        return self._subset(np.flatnonzero(keep[species.cat.codes.to_numpy()[self.positions]]))
+
+    @instrumented("species_index.frame")
+    def frame(self, rows=None) -> pd.DataFrame:
+        """
+        The rows kept (those at `rows` of the selection only, an array or a
+        slice) with their 'confidence_level' and 'threshold'.
+        """
+        selection = self if rows is None else self._subset(rows)
+        return self.df.iloc[selection.positions].assign(
+            confidence_level=pd.Categorical.from_codes(selection.levels, CONFIDENCE_LEVELS),
+            threshold=selection.thresholds,
+        )
+
+class SpeciesIndex:
+    """
+    Rows of a prepare_detections frame partitioned by species, every slice
+    sorted by confidence; built once per data refresh.
+
+    select() gives what select_detections and add_confidence_level_column
+    give on the whole frame, select_rows() the same rows as a Selection that
+    only builds the frame of the rows shown. Both keep the rows kept, their
+    confidence level and threshold of the previous call: when thresholds
+    change only the slices of the species whose threshold changed are
+    redone, a searchsorted for the first confidence above the threshold and
+    the levels of the rows after it. The None_ threshold decides which groups
+    are suppressed for every species, changing it redoes one comparison per
+    row, not the levels.
+
+    sweep() counts the detections of each species kept at every threshold
+    of a grid, with one searchsorted per species on the same slices.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self.none_code = ThresholdRegistry.codes(pd.Series(["None_"]))[0]
+        if df.empty:
+            self.order = np.zeros(0, dtype=np.intp)
+            self.codes = np.zeros(0, dtype=np.int32)
+            self.bounds = np.zeros(1, dtype=np.intp)
+            self.names = []
+            self._confidences = self._none_confidences = self._group_none = np.zeros(0)
+        else:
+            codes = df["species_code"].to_numpy()
+            confidences = df["confidence"].to_numpy(dtype=float)
+            rows = np.flatnonzero(~np.isnan(confidences))   # NaN is never above a threshold
+            # by species code, then by confidence
+            self.order = rows[np.lexsort((confidences[rows], codes[rows]))]
+            sorted_codes = codes[self.order]
+            self.codes, starts = np.unique(sorted_codes, return_index=True)
+            self.bounds = np.append(starts, len(self.order))     # slice of the i-th species: bounds[i]:bounds[i + 1]
+            self.names = [str(name) for name in df["species"].to_numpy()[self.order[starts]]]
+            self._confidences = confidences[self.order]
+            self._group_none = df["group_none_confidence"].to_numpy(dtype=float)
+            self._none_confidences = self._group_none[self.order]
+
+        # state of the last select(), per row of df
+        self._applied: Optional[np.ndarray] = None    # thresholds of self.codes
+        self._applied_none: Optional[float] = None
+        self._unsuppressed = np.zeros(len(df), dtype=bool)   # group not suppressed by None_
+        self._above = np.zeros(len(df), dtype=bool)          # confidence above the threshold of its species
+        self._levels = np.zeros(len(df), dtype=np.int8)
+        self._thresholds = np.zeros(len(df))
+
+    def _slice(self, i: int) -> slice:
+        return slice(self.bounds[i], self.bounds[i + 1])
+
+    def select(self, confidence_thresholds: Dict[str, float],
+               levels: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        """
+        Rows kept with `confidence_thresholds` with their 'confidence_level'
+        and 'threshold', those of `levels` only if given; the same frame as
+        add_confidence_level_column(select_detections(df, ...), ...).
+        """
+        if self.df.empty:
+            return Utils.add_confidence_level_column(self.df.copy(), confidence_thresholds)
+        return self.select_rows(confidence_thresholds, levels).frame()
+
+    @instrumented("species_index.select")
+    def select_rows(self, confidence_thresholds: Dict[str, float],
+                    levels: Optional[Iterable[str]] = None) -> Selection:
+        """The rows of select() as a Selection, without building their frame"""
+        if self.df.empty:
+            return Selection(self.df, np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.int8), np.zeros(0))
+        values = ThresholdRegistry.array(confidence_thresholds)
+        thresholds, none_threshold = values[self.codes], values[self.none_code]
+
+        if none_threshold != self._applied_none:
+            # NaN (no None_ in the group) -> not suppressed
+            self._unsuppressed = ~(self._group_none >= none_threshold)
+        if self._applied is None:
+            changed = np.arange(len(self.codes))
+            self._select_all(thresholds)
+        else:
+            changed = np.flatnonzero(thresholds != self._applied)
+            self._select_species(changed, thresholds)
+        Instrumentation.count("species_changed", len(changed))
+        self._applied, self._applied_none = thresholds, none_threshold
+
+        mask = self._above & self._unsuppressed
+        if levels is not None:
+            # a comparison per level left out, cheaper than a lookup of every row
+            for code in set(range(len(CONFIDENCE_LEVELS))) - {CONFIDENCE_LEVELS.index(level) for level in levels}:
+                mask &= self._levels != code
+        positions = np.flatnonzero(mask)    # order of df
+        # levels and thresholds copied: the next select_rows updates them in place
+        return Selection(self.df, positions, self._levels[positions], self._thresholds[positions])
+
+    def _select_all(self, thresholds: np.ndarray):
+        """Every slice at once, on the sorted arrays"""
+        row_thresholds = np.repeat(thresholds, np.diff(self.bounds))
+        above = self._confidences >= row_thresholds
+        above[np.repeat(self.codes == self.none_code, np.diff(self.bounds))] = False   # None_ rows are never kept
+        self._above[self.order] = above
+        self._levels[self.order] = Utils.confidence_level_codes(self._confidences, row_thresholds)
+        self._thresholds[self.order] = row_thresholds
+
+    def _select_species(self, changed: np.ndarray, thresholds: np.ndarray):
+        """The slices of the species `changed` only, from the first confidence above their threshold"""
+        for i in changed:
+            part = self._slice(i)
+            rows = self.order[part]
+            self._above[rows] = False
+            if self.codes[i] == self.none_code:
+                continue    # None_ rows are never kept
+            threshold = thresholds[i]
+            first = np.searchsorted(self._confidences[part], threshold, side="left")
+            above = rows[first:]
+            self._above[above] = True
+            self._levels[above] = Utils.confidence_level_codes(self._confidences[part][first:], threshold)
+            self._thresholds[above] = threshold
+
+    @instrumented("species_index.sweep")
+    def sweep(self, confidence_thresholds: Dict[str, float], step: float = None) -> pd.DataFrame:
+        """
+        Detections of every species (rows, None_ left out) kept at each
+        threshold from 0 to 1 in steps of `step` (columns,
+        Config.THRESHOLD_SWEEP_STEP by default), the None_ threshold of
+        `confidence_thresholds` applied.
+        """
+        step = step or Config.THRESHOLD_SWEEP_STEP
+        grid = np.linspace(0.0, 1.0, int(round(1 / step)) + 1)
+        values = ThresholdRegistry.array(confidence_thresholds)
+        unsuppressed = ~(self._none_confidences >= values[self.none_code])
+        species = [i for i in range(len(self.codes)) if self.codes[i] != self.none_code]
+        counts = np.zeros((len(species), len(grid)), dtype=np.int64)
+        for row, i in enumerate(species):
+            part = self._slice(i)
+            confidences = self._confidences[part][unsuppressed[part]]    # still sorted
+            counts[row] = len(confidences) - np.searchsorted(confidences, grid, side="left")
+        return pd.DataFrame(counts, index=pd.Index([self.names[i] for i in species], name="species"),
+                            columns=pd.Index(grid.round(6), name="threshold"))
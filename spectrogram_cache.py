@@ -0,0 +1,191 @@
+from config import Config
+from instrumentation import Instrumentation, instrumented
+import argparse
+import io
+import logging
+import re
+import numpy as np
+from pathlib import Path
+from typing import List, Optional
+from audio_cache import AudioCache
+from audio_segments import AudioSegments
+from audio_processor import (
+    AudioClip, Spectrogram, SpectrogramGenerator,
+    SPECTROGRAM_NPERSEG, SPECTROGRAM_NOVERLAP, SPECTROGRAM_FMAX,
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# same savefig options st.pyplot uses, so cached images look the same
+PNG_SAVEFIG_OPTIONS = {"format": "png", "bbox_inches": "tight", "dpi": 200}
+FULL_WINDOW = "full"
+# <audio key>_<window>_<nperseg>_<noverlap>_<fmax>, the audio key may hold "_" itself
+ENTRY_NAME = re.compile(rf"(?P<audio_key>.+?)_(?:{FULL_WINDOW}|\d+-\d+)_\d+_\d+_\d+[._]")
+
+class SpectrogramCache:
+    """
+    On-disk cache of the clipped dB matrices computed by SpectrogramGenerator.
+
+    Entries are keyed by the recording's AudioCache.key (its filename,
+    prefixed with the station but for the default one), clip window (or "full" for the whole
+    recording) and STFT parameters (nperseg, noverlap, fmax). The matrix is
+    stored as float16 `.npy` and memory-mapped on read, axes and dB range go
+    in a small `.axes.npz` next to it. Rendered PNGs
+    (which also depend on the prediction window drawn on top) are cached when
+    Config.SPECTROGRAM_CACHE_PNG is set. A window without an entry of its own
+    is sliced from the full-recording entry when the batch mode computed one.
+    The entries of a recording are removed when it is evicted from the audio
+    cache and its segments (AudioCache.on_evict); prune() removes every
+    orphan entry, the batch mode runs it first.
+    """
+
+    @staticmethod
+    def key(filename: str, window: str, nperseg: int, noverlap: int, fmax: int) -> str:
+        return f"{filename}_{window}_{nperseg}_{noverlap}_{fmax}"
+
+    @staticmethod
+    def window(clip: AudioClip) -> str:
+        if clip.full:
+            return FULL_WINDOW
+        start_ms = round(clip.offset * 1000)
+        return f"{start_ms}-{start_ms + round(clip.frames * 1000 / clip.sample_rate)}"
+
+    @staticmethod
+    def load(filename: str, window: str = FULL_WINDOW, nperseg: int = SPECTROGRAM_NPERSEG,
+             noverlap: int = SPECTROGRAM_NOVERLAP, fmax: int = SPECTROGRAM_FMAX) -> Optional[Spectrogram]:
+        key = SpectrogramCache.key(filename, window, nperseg, noverlap, fmax)
+        matrix_path = Config.SPECTROGRAM_CACHE_DIR / f"{key}.npy"
+        axes_path = Config.SPECTROGRAM_CACHE_DIR / f"{key}.axes.npz"
+        if not (matrix_path.exists() and axes_path.exists()):
+            return None
+        try:
+            with np.load(axes_path) as axes:
+                return Spectrogram(
+                    axes["freqs"], axes["times"],
+                    np.load(matrix_path, mmap_mode="r"),
+                    float(axes["vmin"]), float(axes["vmax"])
+                )
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Discarding unreadable spectrogram {key}: {e}")
+            return None
+
+    @staticmethod
+    def store(filename: str, spectrogram: Spectrogram, window: str = FULL_WINDOW,
+              nperseg: int = SPECTROGRAM_NPERSEG, noverlap: int = SPECTROGRAM_NOVERLAP,
+              fmax: int = SPECTROGRAM_FMAX):
+        key = SpectrogramCache.key(filename, window, nperseg, noverlap, fmax)
+        matrix = io.BytesIO()
+        np.save(matrix, spectrogram.Sxx_db.astype(np.float16))
+        axes = io.BytesIO()
+        np.savez(axes, freqs=spectrogram.freqs, times=spectrogram.times,
+                 vmin=spectrogram.vmin, vmax=spectrogram.vmax)
+        # axes last: an entry only counts as present once both files exist
+        AudioCache._write_atomic(Config.SPECTROGRAM_CACHE_DIR / f"{key}.npy", matrix.getvalue())
+        AudioCache._write_atomic(Config.SPECTROGRAM_CACHE_DIR / f"{key}.axes.npz", axes.getvalue())
+
+    @staticmethod
+    @instrumented("spectrogram.cache")
+    def get_or_compute(filename: str, clip: AudioClip, nperseg: int = SPECTROGRAM_NPERSEG,
+                       noverlap: int = SPECTROGRAM_NOVERLAP, fmax: int = SPECTROGRAM_FMAX) -> Spectrogram:
+        window = SpectrogramCache.window(clip)
+        spectrogram = SpectrogramCache.load(filename, window, nperseg, noverlap, fmax)
+        if spectrogram is not None:
+            Instrumentation.count("cache_hits")
+            return spectrogram
+
+        full = None if clip.full else SpectrogramCache.load(filename, FULL_WINDOW, nperseg, noverlap, fmax)
+        if full is not None:
+            end = clip.offset + clip.duration
+            columns = np.flatnonzero((full.times >= clip.offset) & (full.times <= end))
+            if len(columns):
+                Instrumentation.count("cache_hits")
+                return Spectrogram(full.freqs, full.times[columns], full.Sxx_db[:, columns.min():columns.max() + 1],
+                                   full.vmin, full.vmax)
+
+        Instrumentation.count("cache_misses")
+        spectrogram = SpectrogramGenerator.compute_spectrogram_db(
+            clip.samples, clip.sample_rate, nperseg, noverlap, fmax, time_offset=clip.offset
+        )
+        SpectrogramCache.store(filename, spectrogram, window, nperseg, noverlap, fmax)
+        return spectrogram
+
+    @staticmethod
+    @instrumented("spectrogram.png")
+    def get_png(filename: str, clip: AudioClip, prediction_time: float, prediction_duration: float) -> bytes:
+        """Rendered spectrogram of the clip with the prediction window, default STFT parameters"""
+        key = SpectrogramCache.key(
+            filename, SpectrogramCache.window(clip), SPECTROGRAM_NPERSEG, SPECTROGRAM_NOVERLAP, SPECTROGRAM_FMAX
+        )
+        png_path = Config.SPECTROGRAM_CACHE_DIR / f"{key}_{prediction_time:g}_{prediction_duration:g}.png"
+        if png_path.exists():
+            Instrumentation.count("cache_hits")
+            return png_path.read_bytes()
+        Instrumentation.count("cache_misses")
+
+        import matplotlib.pyplot as plt
+        spectrogram = SpectrogramCache.get_or_compute(filename, clip)
+        fig = SpectrogramGenerator.render_spectrogram(spectrogram, prediction_time, prediction_duration)
+        try:
+            buffer = io.BytesIO()
+            fig.savefig(buffer, **PNG_SAVEFIG_OPTIONS)
+        finally:
+            plt.close(fig)
+        AudioCache._write_atomic(png_path, buffer.getvalue())
+        return buffer.getvalue()
+
+    @staticmethod
+    def _cached(audio_key: str) -> bool:
+        return AudioCache.contains_key(audio_key) or AudioSegments.contains_key(audio_key)
+
+    @staticmethod
+    def discard(audio_keys: List[str]):
+        """Remove the entries of the recordings just evicted, those still cached in the other form are kept"""
+        gone = {key for key in audio_keys if not SpectrogramCache._cached(key)}
+        if not gone:
+            return
+        for path in Config.SPECTROGRAM_CACHE_DIR.iterdir():
+            match = ENTRY_NAME.match(path.name)
+            if match and match["audio_key"] in gone:
+                path.unlink(missing_ok=True)
+
+    @staticmethod
+    def prune():
+        """Remove the entries whose recording is no longer in the audio cache, whole or in segments"""
+        for path in Config.SPECTROGRAM_CACHE_DIR.iterdir():
+            match = ENTRY_NAME.match(path.name)
+            if match and not SpectrogramCache._cached(match["audio_key"]):
+                path.unlink(missing_ok=True)
+
+    @staticmethod
+    def precompute_all(nperseg: int = SPECTROGRAM_NPERSEG, noverlap: int = SPECTROGRAM_NOVERLAP,
+                       fmax: int = SPECTROGRAM_FMAX) -> int:
+        """Batch mode: compute the missing full-recording spectrogram of every cached recording"""
+        SpectrogramCache.prune()
+        computed = 0
+        audio_paths = (path for suffix in AudioCache.SUFFIXES for path in Config.AUDIO_CACHE_DIR.glob(f"*{suffix}"))
+        for audio_path in sorted(audio_paths):
+            filename = audio_path.stem
+            if SpectrogramCache.load(filename, FULL_WINDOW, nperseg, noverlap, fmax) is not None:
+                continue
+            try:
+                sample_rate, samples = AudioCache.read(audio_path)
+                SpectrogramCache.get_or_compute(filename, AudioClip(sample_rate, samples, 0.0, True),
+                                                nperseg, noverlap, fmax)
+                computed += 1
+            except (OSError, ValueError, RuntimeError) as e:
+                logger.error(f"Error while precomputing spectrogram of {audio_path.name}: {e}")
+        logger.info(f"Precomputed {computed} spectrograms")
+        return computed
+
+# spectrograms follow their recording out of the caches
+AudioCache.on_evict(SpectrogramCache.discard)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute spectrograms for every cached WAV")
+    parser.add_argument("--nperseg", type=int, default=SPECTROGRAM_NPERSEG)
+    parser.add_argument("--noverlap", type=int, default=SPECTROGRAM_NOVERLAP)
+    parser.add_argument("--fmax", type=int, default=SPECTROGRAM_FMAX)
+    args = parser.parse_args()
+    SpectrogramCache.precompute_all(args.nperseg, args.noverlap, args.fmax)
@@ -0,0 +1,62 @@
+import json
+import random
+
+import pytest
+
+from config import Config
+from api_client import APIClient
+from benchmarks.stub_pi import StubPi
+from benchmarks.synthetic import make_payload
+
+RECORDS = [
+    {"filename": 1750000000, "start_time": 1750000003, "species": "Parus major_Great Tit", "confidence": 0.81},
+    {"filename": 1750000000, "start_time": 1750000006, "species": "}{][,\"", "confidence": None},
+    {"filename": 1750000060, "start_time": 1750000060, "species": "Pica pica_Gazza ladra è}", "nested": {"a": [1, {"b": "}"}]}},
+    {"filename": 1750000060, "start_time": 1750000063, "species": "None_", "confidence": 0.2},
+]
+
+def parse(payload: bytes, cuts=()):
+    """_iter_json_array on `payload` split at the byte offsets `cuts`"""
+    bounds = [0, *sorted(cuts), len(payload)]
+    return list(APIClient._iter_json_array(iter(payload[a:b] for a, b in zip(bounds, bounds[1:]))))
+
+@pytest.mark.parametrize("separators", [(",", ":"), (", ", ": ")])
+def test_random_splits(separators):
+    payload = (" \n" + json.dumps(RECORDS, ensure_ascii=False, separators=separators) + "\n").encode()
+    rng = random.Random(0)
+    for _ in range(300):
+        cuts = rng.sample(range(1, len(payload)), rng.randint(1, 12))
+        assert parse(payload, cuts) == RECORDS
+    # one byte at a time, multi-byte characters split too
+    assert parse(payload, range(1, len(payload))) == RECORDS
+
+@pytest.mark.parametrize("payload", [b"[]", b" [ ]\n", b"[\n]"])
+def test_empty_array(payload):
+    assert parse(payload) == []
+
+def test_truncated_payload_raises():
+    payload = json.dumps(RECORDS, ensure_ascii=False).encode()
+    with pytest.raises(ValueError):
+        parse(b'[{"a":1},{"a":2}')
+    for end in range(len(payload)):
+        with pytest.raises(ValueError):
+            parse(payload[:end], range(1, end, 7))
+
+@pytest.mark.parametrize("payload", [b'{"a":1}', b'[{"a":1}] [{"a":2}]', b'[{"a":1}]{"a":2}', b'[{"a":1},{"a":2]'])
+def test_invalid_payload_raises(payload):
+    with pytest.raises(ValueError):
+        parse(payload)
+
+def test_stream_matches_single_request(monkeypatch):
+    start_ts, days = 1_750_000_000, 3
+    payload = make_payload(5_000, start_ts=start_ts, span_seconds=days * 86_400)
+    with StubPi(payload) as stub:
+        monkeypatch.setattr(Config, "STATIONS", {"stub": stub.api_base})
+        monkeypatch.setattr(Config, "STREAM_CHUNK_SIZE", 1024)   # records split across chunks
+        client = APIClient.station()
+        end_ts = start_ts + days * 86_400 - 1
+        single = client.fetch_detections_between(start_ts, end_ts)
+        windows = list(client.stream_detections(start_ts, end_ts, window_seconds=6 * 3600))
+    assert len(windows) == days * 4
+    streamed = [record for _, records in sorted(windows, key=lambda w: w[0]) for record in records]
+    assert streamed == single == sorted(payload, key=lambda d: d["start_time"])
@@ -0,0 +1,130 @@
+import io
+import struct
+
+import numpy as np
+import pytest
+from scipy.io import wavfile
+
+from config import Config
+from audio_cache import AudioCache
+from audio_segments import AudioSegments, WavLayout
+from benchmarks.stub_pi import StubPi
+from benchmarks.synthetic import make_clip
+
+FILENAME = 1750000000
+
+def wav_bytes(samples: np.ndarray, sample_rate: int = 16_000) -> bytes:
+    buffer = io.BytesIO()
+    wavfile.write(buffer, sample_rate, samples)
+    return buffer.getvalue()
+
+def with_list_chunk(data: bytes, payload: bytes = b"odd") -> bytes:
+    """`data` with a LIST chunk of odd size (padded) between fmt and data"""
+    pos = data.index(b"data")
+    chunk = b"LIST" + struct.pack("<I", len(payload)) + payload + b"\0" * (len(payload) & 1)
+    body = data[:pos] + chunk + data[pos:]
+    return body[:4] + struct.pack("<I", len(body) - 8) + body[8:]
+
+def extensible(samples: np.ndarray, sample_rate: int = 16_000) -> bytes:
+    """16-bit PCM as WAVE_FORMAT_EXTENSIBLE"""
+    channels = 1 if samples.ndim == 1 else samples.shape[1]
+    data = samples.astype("<i2").tobytes()
+    fmt = struct.pack("<HHIIHHHHI", 0xFFFE, channels, sample_rate, sample_rate * channels * 2, channels * 2, 16,
+                      22, 16, 0) + struct.pack("<H", 1) + b"\x00\x00\x00\x00\x10\x00\x80\x00\x00\xaa\x00\x38\x9b\x71"
+    body = b"WAVE" + b"fmt " + struct.pack("<I", len(fmt)) + fmt + b"data" + struct.pack("<I", len(data)) + data
+    return b"RIFF" + struct.pack("<I", len(body)) + body
+
+MONO = make_clip(3, 16_000)
+STEREO = np.stack([MONO, MONO[::-1]], axis=1)
+
+@pytest.mark.parametrize("data, frames, channels, dtype", [
+    (wav_bytes(MONO), len(MONO), 1, "<i2"),
+    (wav_bytes(STEREO), len(STEREO), 2, "<i2"),
+    (wav_bytes(MONO.astype(np.float32) / 32768), len(MONO), 1, "<f4"),
+    (with_list_chunk(wav_bytes(MONO)), len(MONO), 1, "<i2"),
+    (extensible(MONO), len(MONO), 1, "<i2"),
+])
+def test_parse_layout(data, frames, channels, dtype):
+    layout = WavLayout.parse(data[:Config.AUDIO_HEADER_BYTES], len(data))
+    assert (layout.frames, layout.sample_rate, layout.channels, layout.dtype) == (frames, 16_000, channels, dtype)
+    # the samples start where the layout says
+    _, expected = wavfile.read(io.BytesIO(data))
+    samples = np.frombuffer(data, dtype=dtype, offset=layout.data_offset, count=frames * channels)
+    assert np.array_equal(samples.reshape(expected.shape), expected)
+
+def test_parse_streamed_data_size():
+    # recorders writing the file as they go leave the data size unset
+    data = bytearray(wav_bytes(MONO))
+    pos = data.index(b"data")
+    data[pos + 4:pos + 8] = struct.pack("<I", 0xFFFFFFFF)
+    assert WavLayout.parse(bytes(data[:256]), len(data)).frames == len(MONO)
+
+@pytest.mark.parametrize("head", [
+    b"RIFX" + b"\0" * 40,                                       # not RIFF WAVE
+    wav_bytes(MONO)[:20],                                       # cut before the data chunk
+    wav_bytes(MONO)[:12] + wav_bytes(MONO)[36:44],              # data chunk before fmt
+    wav_bytes(MONO)[:34] + struct.pack("<H", 24) + wav_bytes(MONO)[36:64],     # 24-bit PCM
+])
+def test_parse_rejects(head):
+    with pytest.raises(ValueError):
+        WavLayout.parse(head, 1_000_000)
+
+LAYOUT = WavLayout(size=44 + 100_000 * 4, data_offset=44, frames=100_000, sample_rate=16_000, channels=2, dtype="<i2")
+
+def test_segment_math(monkeypatch):
+    monkeypatch.setattr(Config, "AUDIO_SEGMENT_SECONDS", 2.0)    # 32000 frames per segment
+    assert AudioSegments._segments(LAYOUT, 0, 32_000) == range(0, 1)
+    assert AudioSegments._segments(LAYOUT, 31_999, 32_001) == range(0, 2)
+    assert AudioSegments._segments(LAYOUT, 40_000, 40_000) == range(1, 2)     # empty window, its segment
+    assert AudioSegments._segments(LAYOUT, 90_000, 100_000) == range(2, 4)
+    assert AudioSegments._byte_range(LAYOUT, 0, 0) == (44, 44 + 32_000 * 4 - 1)
+    assert AudioSegments._byte_range(LAYOUT, 1, 3) == (44 + 32_000 * 4, LAYOUT.size - 1)   # last one is short
+
+def test_missing_runs(tmp_path):
+    for index in (2, 3, 6):
+        (tmp_path / f"{index}.pcm").write_bytes(b"")
+    assert AudioSegments._missing_runs(tmp_path, range(0, 9)) == [(0, 1), (4, 5), (7, 8)]
+    assert AudioSegments._missing_runs(tmp_path, range(2, 4)) == []
+
+@pytest.fixture
+def caches(tmp_path, monkeypatch):
+    for name in ("AUDIO_CACHE_DIR", "AUDIO_SEGMENT_DIR"):
+        (tmp_path / name).mkdir()
+        monkeypatch.setattr(Config, name, tmp_path / name)
+    monkeypatch.setattr(Config, "AUDIO_CACHE_FORMAT", "wav")
+    monkeypatch.setattr(Config, "AUDIO_PLAYBACK_FORMAT", "wav")
+    monkeypatch.setattr(Config, "AUDIO_SEGMENT_SECONDS", 1.0)
+    monkeypatch.setattr(AudioCache, "_evict_listeners", [])
+
+def test_fetch_and_read_by_range(caches, monkeypatch):
+    samples = make_clip(10, 16_000)
+    with StubPi(audio={FILENAME: wav_bytes(samples)}) as stub:
+        monkeypatch.setattr(Config, "STATIONS", {"stub": stub.api_base})
+        AudioSegments.fetch(FILENAME, 2.5, 4.2)
+        AudioSegments.fetch(FILENAME, 1.5, 6.5)     # only the segments around the first ones
+        AudioSegments.fetch(FILENAME, 3.0, 4.0)     # all cached
+    ranges = [path for path in stub.requests if path.startswith("/api/birds/audio/")]
+    assert len(ranges) == 4     # header, segments 2-4, then 1 and 5-6
+    assert not AudioCache.contains(FILENAME)
+    assert sorted(p.name for p in (Config.AUDIO_SEGMENT_DIR / str(FILENAME)).glob("*.pcm")) == \
+        [f"{i}.pcm" for i in range(1, 7)]
+    sample_rate, read = AudioSegments.read(FILENAME, 20_000, 100_000)
+    assert sample_rate == 16_000 and np.array_equal(read, samples[20_000:100_000])
+
+def test_server_without_range_caches_the_whole_recording(caches, monkeypatch):
+    data = wav_bytes(make_clip(3, 16_000))
+    with StubPi(audio={FILENAME: data}, ranges=False) as stub:
+        monkeypatch.setattr(Config, "STATIONS", {"stub": stub.api_base})
+        AudioSegments.fetch(FILENAME, 0.5, 1.5)
+    assert AudioCache.contains(FILENAME) and not AudioSegments.contains(FILENAME)
+
+def test_clear_removes_segments_and_notifies(caches, monkeypatch):
+    evicted = []
+    AudioCache.on_evict(evicted.extend)
+    with StubPi(audio={FILENAME: wav_bytes(make_clip(3, 16_000))}) as stub:
+        monkeypatch.setattr(Config, "STATIONS", {"stub": stub.api_base})
+        AudioSegments.fetch(FILENAME, 0.5, 1.5)
+    assert AudioSegments.contains(FILENAME)
+    AudioSegments.clear()
+    assert not AudioSegments.contains(FILENAME) and list(Config.AUDIO_SEGMENT_DIR.iterdir()) == []
+    assert evicted == [str(FILENAME)]
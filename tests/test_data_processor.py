@@ -0,0 +1,170 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from config import Config
+from data_processor import DataProcessor
+from species_index import SpeciesIndex
+from threshold_registry import ThresholdRegistry
+from utils import Utils, CONFIDENCE_LEVELS, KEPT_CONFIDENCE_LEVELS
+
+START_TS = 1_750_000_020
+
+def detection(species, confidence, start_time=START_TS):
+    return {"filename": start_time - start_time % 60, "start_time": start_time, "duration": 3,
+            "species": species, "confidence": confidence}
+
+@pytest.fixture
+def fresh_species_codes(monkeypatch):
+    """Species codes of a new process, None_ not registered yet"""
+    monkeypatch.setattr(ThresholdRegistry, "_species", {})
+
+def test_profile_and_frame_without_none(fresh_species_codes):
+    df = DataProcessor.process_detections(
+        [detection("Parus major_Great Tit", 0.7), detection("Parus major_Great Tit", 0.3, START_TS + 3)],
+        {"Parus major_Great Tit": 0.5},
+    )
+    assert list(df["confidence"]) == [pytest.approx(0.7)]
+
+def test_select_detections_without_none(fresh_species_codes):
+    prepared = DataProcessor.prepare_detections([detection("Parus major_Great Tit", 0.7)])
+    assert len(DataProcessor.select_detections(prepared, {"Parus major_Great Tit": 0.5})) == 1
+
+# reference per-row implementations, as the code was before it was vectorized
+
+def apply_group_thresholds_loop(df, confidence_thresholds):
+    final_rows = []
+    for _, group_df in df.groupby("start_time"):
+        none_rows = group_df[group_df["species"] == "None_"]
+        other_species_rows = group_df[group_df["species"] != "None_"]
+
+        if len(none_rows) > 0 and len(other_species_rows) == 0:
+            continue
+
+        if len(none_rows) > 0:
+            none_confidence = none_rows.iloc[0]["confidence"]
+            none_threshold = confidence_thresholds.get("None_", Config.DEFAULT_THRESHOLD_VALUE)
+            if none_confidence >= none_threshold:
+                continue
+
+        for _, row in other_species_rows.iterrows():
+            threshold = confidence_thresholds.get(row["species"], Config.DEFAULT_THRESHOLD_VALUE)
+            if row["confidence"] >= threshold:
+                final_rows.append(row)
+    return pd.DataFrame(final_rows, columns=df.columns)
+
+def add_confidence_level_column_rowwise(df, confidence_thresholds):
+    df = df.copy()
+    thresholds = [confidence_thresholds.get(s, Config.DEFAULT_THRESHOLD_VALUE) for s in df["species"]]
+    df["confidence_level"] = [Utils.calculate_confidence_level(c, t) for c, t in zip(df["confidence"], thresholds)]
+    df["threshold"] = thresholds
+    return df
+
+def canonical(df):
+    return df.sort_values(["start_time", "species", "confidence"]).reset_index(drop=True)
+
+def make_detections(n_rows, seed=0):
+    """About three classes per 3 s window, so None_ shares windows with the other species"""
+    rng = np.random.default_rng(seed)
+    start_time = START_TS + rng.integers(0, n_rows // 3, n_rows) * 3
+    return pd.DataFrame({
+        "filename": start_time - start_time % 60,
+        "start_time": start_time,
+        "duration": np.full(n_rows, 3),
+        "species": np.array(SPECIES, dtype=object)[rng.integers(0, len(SPECIES), n_rows)],
+        "confidence": rng.random(n_rows),
+    })
+
+SPECIES = ["None_", "Wind_", "Parus major_Great Tit", "Erithacus rubecula_European Robin",
+           "Turdus merula_Eurasian Blackbird", "Unknown bird_Not In Any Profile"]
+PROFILE = {"None_": 0.5, "Wind_": 0.3, "Parus major_Great Tit": 0.4, "Erithacus rubecula_European Robin": 0.6,
+           "Turdus merula_Eurasian Blackbird": 0.25}
+
+def with_nan_confidence(df):
+    df = df.copy()
+    df.loc[df.index[::17], "confidence"] = np.nan   # None_ rows among them
+    return df
+
+CASES = {
+    "profile": (make_detections(3_000), PROFILE),
+    "nan confidence": (with_nan_confidence(make_detections(3_000, seed=1)), PROFILE),
+    "unknown species": (make_detections(3_000, seed=2), {"Parus major_Great Tit": 0.4}),
+    "profile without None_": (make_detections(3_000, seed=3), {k: v for k, v in PROFILE.items() if k != "None_"}),
+    "empty profile": (make_detections(3_000, seed=4), {}),
+}
+
+@pytest.mark.parametrize("case", CASES)
+def test_process_detections_matches_reference_loop(case):
+    df, thresholds = CASES[case]
+    expected = canonical(apply_group_thresholds_loop(df, thresholds))
+    result = DataProcessor.process_detections(df.to_dict("records"), thresholds)
+    pd.testing.assert_frame_equal(canonical(result[list(df.columns)]), expected, check_dtype=False,
+                                  check_categorical=False, rtol=1e-6)
+    prepared = DataProcessor.prepare_detections(df)
+    selected = DataProcessor.select_detections(prepared, thresholds)
+    pd.testing.assert_frame_equal(canonical(selected[list(df.columns)]), expected, check_dtype=False,
+                                  check_categorical=False, rtol=1e-6)
+
+@pytest.mark.parametrize("case", CASES)
+def test_add_confidence_level_column_matches_rowwise(case):
+    df, thresholds = CASES[case]
+    expected = add_confidence_level_column_rowwise(df, thresholds)
+    result = Utils.add_confidence_level_column(df.copy(), thresholds)
+    assert list(result["confidence_level"].astype(str)) == list(expected["confidence_level"])
+    assert np.array_equal(result["threshold"].to_numpy(), np.array(expected["threshold"], dtype=float))
+
+def test_empty_detections():
+    assert DataProcessor.process_detections([], PROFILE).empty
+    assert DataProcessor.prepare_detections([]).empty
+    assert DataProcessor.select_detections(pd.DataFrame(), PROFILE).empty
+    df = Utils.add_confidence_level_column(pd.DataFrame(), PROFILE)
+    assert df.empty and {"confidence_level", "threshold"} <= set(df.columns)
+    df = Utils.add_confidence_level_column(make_detections(3).iloc[:0].copy(), PROFILE)
+    assert df.empty and list(df["confidence_level"].cat.categories) == CONFIDENCE_LEVELS
+
+def test_confidence_equal_to_threshold_is_kept():
+    # every slider value, the confidence exactly on it
+    values = [round(i / 100, 2) for i in range(1, 100)]
+    detections = [detection(f"Species {i}_{i}", value, START_TS + 3 * i) for i, value in enumerate(values)]
+    thresholds = {f"Species {i}_{i}": value for i, value in enumerate(values)}
+    assert len(DataProcessor.process_detections(detections, thresholds)) == len(values)
+    prepared = DataProcessor.prepare_detections(detections)
+    assert len(DataProcessor.select_detections(prepared, thresholds)) == len(values)
+    assert len(SpeciesIndex(prepared).select(thresholds)) == len(values)
+
+@pytest.mark.parametrize("deviation", [-0.15, -0.05, 0.05, 0.15])
+def test_confidence_level_on_its_bounds(deviation):
+    thresholds = [round(i / 100, 2) for i in range(1, 100)]
+    df = pd.DataFrame([detection(f"Species {i}_{i}", t + t * deviation) for i, t in enumerate(thresholds)])
+    profile = {f"Species {i}_{i}": t for i, t in enumerate(thresholds)}
+    expected = add_confidence_level_column_rowwise(df, profile)["confidence_level"]
+    result = Utils.add_confidence_level_column(DataProcessor.prepare_detections(df), profile)
+    assert list(result.sort_index()["confidence_level"].astype(str)) == list(expected)
+    selected = SpeciesIndex(DataProcessor.prepare_detections(df)).select(profile)
+    assert list(selected.sort_index()["confidence_level"].astype(str)) == list(expected[selected.sort_index().index])
+
+def test_kept_confidence_levels():
+    # the levels offered by the filters are the ones detections kept can have
+    df, thresholds = CASES["profile"]
+    selected = SpeciesIndex(DataProcessor.prepare_detections(df)).select(thresholds)
+    assert set(selected["confidence_level"].astype(str)) == set(KEPT_CONFIDENCE_LEVELS)
+
+@pytest.mark.parametrize("case", CASES)
+def test_selection_matches_select(case):
+    df, thresholds = CASES[case]
+    prepared = DataProcessor.add_display_columns(DataProcessor.prepare_detections(df))
+    index = SpeciesIndex(prepared)
+    levels = ["medium", "very_high"]
+    expected = index.select(thresholds, levels)
+    selection = index.select_rows(thresholds, levels)
+    pd.testing.assert_frame_equal(selection.frame(), expected)
+    assert len(selection) == len(expected)
+    assert selection.species_count() == expected["species"].nunique()
+    pd.testing.assert_frame_equal(selection.frame(slice(10, 20)), expected.iloc[10:20])
+    pd.testing.assert_frame_equal(selection.frame(np.array([5, 1])), expected.iloc[[5, 1]])
+    pd.testing.assert_frame_equal(selection.exclude(Config.NON_SPECIES_PREFIXES).frame(),
+                                  DataProcessor.filter_non_species(expected, Config.NON_SPECIES_PREFIXES))
+
+    # a later select does not change the rows already selected
+    index.select_rows({species: 0.9 for species in SPECIES})
+    pd.testing.assert_frame_equal(selection.frame(), expected)
@@ -0,0 +1,121 @@
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from config import Config
+from detection_rollups import DetectionRollups
+from detection_store import DetectionStore, CONFIDENCE_BINS
+from benchmarks.stub_pi import StubPi
+from benchmarks.synthetic import make_payload
+
+DAY = date.today() - timedelta(days=3)
+DAY_START, DAY_END = DetectionStore._day_bounds(DAY)
+
+def detection(start_time, species="Parus major_Great Tit", confidence=0.8):
+    return {"filename": start_time - start_time % 60, "start_time": start_time, "duration": 3,
+            "species": species, "confidence": confidence}
+
+@pytest.fixture
+def stub(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "DETECTION_STORE_PATH", tmp_path / "detections.sqlite")
+    with StubPi() as stub:
+        monkeypatch.setattr(Config, "STATIONS", {"stub": stub.api_base})
+        yield stub
+
+def stored(day=DAY):
+    return sorted(d["start_time"] for d in DetectionStore.load(day, day))
+
+def test_day_not_closed_on_the_clock_alone(stub):
+    # the station has not uploaded anything after the day (a backlog, an outage)
+    stub.add([detection(DAY_START + 3600), detection(DAY_START + 7200)])
+    assert DetectionStore.sync(DAY, DAY)
+    assert DetectionStore.closed_days(DAY, DAY) == set()
+
+    # classified late, older than the high-water mark of the day
+    stub.add([detection(DAY_START + 60)])
+    assert DetectionStore.sync(DAY, DAY)
+    assert stored() == [DAY_START + 60, DAY_START + 3600, DAY_START + 7200]
+
+def test_day_closed_once_the_station_moved_past_it(stub):
+    next_day = DAY + timedelta(days=1)
+    stub.add([detection(DAY_START + 3600), detection(DAY_END + Config.DETECTION_CLOSE_GRACE + 60)])
+    assert DetectionStore.sync(DAY, next_day)
+    assert DetectionStore.closed_days(DAY, next_day) == {DAY}
+
+    stub.add([detection(DAY_START + 60)])
+    assert DetectionStore.sync(DAY, DAY)
+    assert stored() == [DAY_START + 3600]
+
+    DetectionStore.reopen(DAY, DAY)
+    assert DetectionStore.sync(DAY, DAY)
+    assert stored() == [DAY_START + 60, DAY_START + 3600]
+
+# rollups
+
+def raw_rollups():
+    """rollup_hours and rollup_confidence computed with pandas from the stored rows"""
+    df = pd.DataFrame(DetectionStore.load(date(2000, 1, 1), date.today()))
+    local = pd.to_datetime(df["start_time"], unit="s", utc=True).dt.tz_convert(datetime.now().astimezone().tzinfo)
+    df = df.assign(day=local.dt.date.astype(str), hour=local.dt.hour,
+                   bin=(df["confidence"].fillna(0) * CONFIDENCE_BINS).astype(int).clip(0, CONFIDENCE_BINS - 1))
+    hours = df.groupby(["day", "hour", "species"]).agg(
+        detections=("start_time", "size"), confidence_sum=("confidence", "sum"),
+        first_seen=("start_time", "min"), last_seen=("start_time", "max"),
+    )
+    confidence = df.groupby(["day", "species", "bin"]).size().rename("detections")
+    return hours, confidence
+
+def stored_rollups():
+    with DetectionStore._connect() as conn:
+        hours = pd.read_sql_query("SELECT * FROM rollup_hours", conn).set_index(["day", "hour", "species"])
+        confidence = pd.read_sql_query("SELECT * FROM rollup_confidence", conn).set_index(["day", "species", "bin"])
+    return hours, confidence["detections"]
+
+def assert_rollups_match_rows():
+    (raw_hours, raw_confidence), (hours, confidence) = raw_rollups(), stored_rollups()
+    pd.testing.assert_frame_equal(hours.sort_index(), raw_hours.sort_index(), check_dtype=False, check_index_type=False)
+    pd.testing.assert_series_equal(confidence.sort_index(), raw_confidence.sort_index(), check_dtype=False,
+                                   check_index_type=False)
+
+def test_resync_of_overlapping_windows_is_idempotent(stub):
+    today = date.today()
+    now = int(datetime.now().timestamp())
+    stub.add(make_payload(3_000, start_ts=DAY_START, span_seconds=now - DAY_START - 600))
+    assert DetectionStore.sync(DAY, today)
+    rows = len(DetectionStore.load(DAY, today))
+    assert_rollups_match_rows()
+
+    # today is fetched again from behind its high-water mark, reopened days whole
+    assert DetectionStore.sync(DAY, today)
+    DetectionStore.reopen(DAY, today)
+    assert DetectionStore.sync(DAY, today)
+    assert len(DetectionStore.load(DAY, today)) == rows
+    assert_rollups_match_rows()
+
+def test_rollups_count_rows_added_late(stub):
+    payload = make_payload(2_000, start_ts=DAY_START, span_seconds=86_400)
+    stub.add(payload[::2])
+    assert DetectionStore.sync(DAY, DAY)
+    stub.add(payload[1::2])     # same hours and species, counts added to the existing rollup rows
+    assert DetectionStore.sync(DAY, DAY)
+    assert len(DetectionStore.load(DAY, DAY)) == len({(d["start_time"], d["species"]) for d in payload})
+    assert_rollups_match_rows()
+
+def test_rollup_queries_match_rows(stub):
+    stub.add(make_payload(3_000, start_ts=DAY_START, span_seconds=2 * 86_400))
+    end = DAY + timedelta(days=1)
+    assert DetectionStore.sync(DAY, end)
+    df = pd.DataFrame(DetectionStore.load(DAY, end))
+    df = df[df["species"] != "None_"]
+
+    daily = DetectionRollups.daily(DAY, end, ("None_",))
+    days = df["start_time"].map(lambda t: datetime.fromtimestamp(t).date())
+    assert list(daily["detections"]) == [int((days == day).sum()) for day in (DAY, end)]
+    species = DetectionRollups.species(DAY, end, ("None_",)).set_index("species")
+    assert species["detections"].to_dict() == df["species"].value_counts().to_dict()
+    histogram = DetectionRollups.confidence_histogram(DAY, end, ("None_",), bin_width=0.1)
+    bins = (df["confidence"] * CONFIDENCE_BINS).astype(int).clip(0, CONFIDENCE_BINS - 1) // 10
+    assert list(histogram["detections"]) == list(np.bincount(bins, minlength=10))
+    assert DetectionRollups.hourly(DAY, end, ("None_",))["detections"].sum() == len(df)
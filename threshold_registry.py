@@ -0,0 +1,105 @@
+from config import Config
+from instrumentation import Instrumentation, instrumented
+import logging
+import threading
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Dict, NamedTuple, Optional, Tuple, Union
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class ThresholdProfile(NamedTuple):
+    name: str
+    path: Path
+    thresholds: Dict[str, float]    # species -> threshold, species missing use Config.DEFAULT_THRESHOLD_VALUE
+
+class ThresholdRegistry:
+    """
+    Single source of the per-species confidence thresholds.
+
+    A profile is one CSV (species,threshold) matching
+    Config.THRESHOLD_PROFILES_GLOB next to Config.CUSTOM_THRESHOLDS_PATH,
+    e.g. species_confidence.csv and species_confidence_1.csv. Profiles are
+    parsed once and kept until the file's mtime or size changes.
+
+    Species are also given process-wide integer codes (append-only, so codes
+    stored in a frame stay valid), which lets thresholds be looked up per row
+    by indexing a small array instead of hashing every species name.
+    """
+
+    _lock = threading.Lock()
+    _profiles: Dict[Path, Tuple[Optional[tuple], ThresholdProfile]] = {}
+    _species: Dict[str, int] = {}
+
+    @staticmethod
+    def profiles() -> Dict[str, Path]:
+        """Available profiles by name (file stem), the default profile first"""
+        default = Path(Config.CUSTOM_THRESHOLDS_PATH)
+        paths = sorted(default.parent.glob(Config.THRESHOLD_PROFILES_GLOB))
+        return {path.stem: path for path in [default] + [p for p in paths if p != default]}
+
+    @classmethod
+    @instrumented("thresholds.load")
+    def get(cls, path: Union[str, Path, None] = None) -> ThresholdProfile:
+        path = Path(path or Config.CUSTOM_THRESHOLDS_PATH)
+        try:
+            stat = path.stat()
+            signature = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            signature = None
+
+        cached = cls._profiles.get(path)
+        if cached is not None and cached[0] == signature:
+            Instrumentation.count("cache_hits")
+            return cached[1]
+        Instrumentation.count("cache_misses")
+
+        profile = ThresholdProfile(path.stem, path, cls._read(path) if signature else {})
+        if signature is None:
+            logger.warning(f"Threshold file {path} not found, using a default threshold of {Config.DEFAULT_THRESHOLD_VALUE}")
+        with cls._lock:
+            cls._profiles[path] = (signature, profile)
+        return profile
+
+    @staticmethod
+    def _read(path: Path) -> Dict[str, float]:
+        try:
+            df = pd.read_csv(path)
+            if {"species", "threshold"} <= set(df.columns):
+                species, values = df["species"], df["threshold"]
+            else:
+                species, values = df.iloc[:, 0], df.iloc[:, 1]  # other headers: first two columns
+            return dict(zip(species.astype(str), values.astype(float)))
+        except (OSError, ValueError, IndexError, pd.errors.ParserError) as e:
+            logger.error(f"Error while reading thresholds from {path}: {e}")
+            return {}
+
+    @classmethod
+    def codes(cls, species: pd.Series) -> np.ndarray:
+        """Species code of every row, distinct species are encoded once"""
+        if isinstance(species.dtype, pd.CategoricalDtype):
+            row_codes, uniques = species.cat.codes.to_numpy(), species.cat.categories
+        else:
+            row_codes, uniques = pd.factorize(species)
+        with cls._lock:
+            unique_codes = np.array([cls._species.setdefault(s, len(cls._species)) for s in uniques], dtype=np.int32)
+        return unique_codes[row_codes] if len(uniques) else np.zeros(len(row_codes), dtype=np.int32)
+
+    @classmethod
+    def array(cls, thresholds: Union[Dict[str, float], ThresholdProfile]) -> np.ndarray:
+        """Thresholds indexed by species code, the default for species not in `thresholds`"""
+        if isinstance(thresholds, ThresholdProfile):
+            thresholds = thresholds.thresholds
+        with cls._lock:
+            codes = [cls._species.setdefault(s, len(cls._species)) for s in thresholds]
+            values = np.full(len(cls._species), Config.DEFAULT_THRESHOLD_VALUE, dtype=float)
+        values[codes] = list(thresholds.values())
+        return values
+
+    @classmethod
+    def lookup(cls, df: pd.DataFrame, thresholds: Union[Dict[str, float], ThresholdProfile]) -> np.ndarray:
+        """Threshold of every row of df, from its species_code column when present"""
+        codes = df["species_code"].to_numpy() if "species_code" in df.columns else cls.codes(df["species"])
+        return cls.array(thresholds)[codes]
@@ -1,75 +1,350 @@
 import streamlit as st
+import time
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
+from pandas.io.formats.style import Styler
+from config import Config
+from instrumentation import Instrumentation, instrumented
 from api_client import APIClient
-from audio_processor import AudioProcessor, SpectrogramGenerator
-from typing import Dict
+from http_session import HTTPSession
+from metrics_poller import MetricsPoller
+from audio_cache import AudioCache
+from audio_processor import AudioProcessor, AudioPrefetcher, SpectrogramGenerator
+from audio_export import AudioExporter
+from spectrogram_cache import SpectrogramCache
+from species_index import SpeciesIndex, Selection
+from typing import Dict, Iterable, Optional
+
+# sort options of the paginated detections table -> column sorted on
+TABLE_SORT_COLUMNS = {
+    "Time": "start_time",
+    "Species": "species_display",
+    "Confidence": "confidence",
+}
+# system metrics of the sidebar: field, label, unit
+SYSTEM_METRICS = (
+    ("cpu_usage", "CPU Usage", "%"),
+    ("ram_usage", "RAM Usage", "%"),
+    ("disk_usage", "Disk Usage", "%"),
+    ("temperature", "Temperature", "°C"),
+)
 
 class UIComponents:
     @staticmethod
-    def display_system_metrics():
-        metrics = APIClient.fetch_system_metrics()
-        
-        if metrics:
-            # col1, col2, col3, col4 = st.columns(4)
-            
-            # with col1:
-            st.markdown(f"Recording status: **{'✅ On' if metrics['is_recording'] else '⛔ Off'}**")
-            st.markdown(f"CPU Usage: **{metrics['cpu_usage']:.1f}%**")
-            st.markdown(f"RAM Usage: **{metrics['ram_usage']:.1f}%**")
-            st.markdown(f"Disk Usage: **{metrics['disk_usage']:.1f}%**")
-        # with col2:
-        # with col4:
-            temp = metrics.get('temperature', 'N/A')
-            if temp != 'N/A':
-                st.markdown(f"Temperature: **{temp:.1f}°C**")
-            else:
-                st.markdown("Temperature: **N/A**")
-        else:
+    @instrumented("ui.system_metrics")
+    def display_system_metrics(stations: Optional[Iterable[str]] = None):
+        # read from the background poller, no request to the stations here
+        for client in APIClient.stations(stations):
+            if len(Config.STATIONS) > 1:
+                st.markdown(f"##### {client.station}")
+            UIComponents._display_station_metrics(client.station)
+
+    @staticmethod
+    def _display_station_metrics(station: str):
+        metrics = MetricsPoller.latest(station)
+        if metrics is None:
             st.info("Waiting for new data...")
+            return
+
+        history = MetricsPoller.history(station, last=Config.METRICS_SPARKLINE_SAMPLES)
+        # NaN (no is_recording in the sample) is truthy
+        recording = pd.notna(metrics["is_recording"]) and bool(metrics["is_recording"])
+        st.markdown(f"Recording status: **{'✅ On' if recording else '⛔ Off'}**")
+        for field, label, unit in SYSTEM_METRICS:
+            value = metrics[field]
+            sparkline = history[field].dropna().round(1).tolist()
+            st.metric(label, "N/A" if np.isnan(value) else f"{value:.1f}{unit}",
+                      chart_data=sparkline if len(sparkline) > 1 else None)
+        age = time.time() - metrics["timestamp"]
+        if metrics["error"]:
+            st.caption(f"Last sample {age:.0f}s ago, station not answering")
+        else:
+            st.caption(f"Updated {age:.0f}s ago")
+
+    @staticmethod
+    def display_api_stats():
+        stats = HTTPSession.stats()
+        for station in HTTPSession.open_circuits():
+            st.warning(f"Station {station} unreachable, requests are paused")
+        if stats:
+            st.dataframe(
+                pd.DataFrame.from_dict(stats, orient="index")[["requests", "errors", "fast_fails", "mean_latency", "last_latency"]],
+                column_config={
+                    "mean_latency": st.column_config.NumberColumn("mean (s)", format="%.3f"),
+                    "last_latency": st.column_config.NumberColumn("last (s)", format="%.3f"),
+                },
+                width="stretch"
+            )
+
+    @staticmethod
+    @instrumented("ui.overview")
+    def display_overview(overview: Dict[str, pd.DataFrame]):
+        daily, hourly, species = overview["daily"], overview["hourly"], overview["species"]
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Detections", f"{daily['detections'].sum():,}")
+        col2.metric("Species", len(species))
+        col3.metric("Active days", int((daily["detections"] > 0).sum()))
+
+        st.caption("Detections per day")
+        st.bar_chart(daily["detections"])
+        st.caption("Detections per hour of the day")
+        st.bar_chart(hourly["detections"])
+        st.caption("Detections per confidence")
+        st.bar_chart(overview["confidence"].set_index("confidence")["detections"])
+        st.dataframe(
+            species,
+            column_config={
+                "mean_confidence": st.column_config.NumberColumn("mean confidence", format="%.2f"),
+                "first_seen": st.column_config.DatetimeColumn("first seen", format="YYYY-MM-DD HH:mm"),
+                "last_seen": st.column_config.DatetimeColumn("last seen", format="YYYY-MM-DD HH:mm"),
+            },
+            hide_index=True,
+            width="stretch"
+        )
+
+    @staticmethod
+    @instrumented("ui.threshold_sweep")
+    def display_threshold_sweep(index: SpeciesIndex, confidence_thresholds: Dict[str, float], profile: str = "default",
+                                exclude_prefixes: tuple = ()):
+        """Detections of each species kept at every threshold, to tune the threshold profile"""
+        sweep = index.sweep(confidence_thresholds)
+        if exclude_prefixes:
+            sweep = sweep[~sweep.index.str.startswith(exclude_prefixes)]
+        if sweep.empty:
+            st.info("No detections to sweep")
+            return
+        sweep = sweep.sort_values(0.0, ascending=False)
+        species = list(sweep.index)
+        sweep.index = sweep.index.str.replace("_", ", ")
+
+        charted = st.multiselect("Species", list(sweep.index), default=list(sweep.index[:Config.THRESHOLD_SWEEP_SPECIES]),
+                                 key="sweep_species", help="Species drawn in the chart")
+        if charted:
+            st.caption("Detections kept at each threshold")
+            st.line_chart(sweep.loc[charted].T, x_label="threshold", y_label="detections")
+        table = pd.DataFrame({
+            "species": sweep.index,
+            "threshold": [confidence_thresholds.get(s, Config.DEFAULT_THRESHOLD_VALUE) for s in species],
+        })
+        # counts every 0.1, the chart has the whole grid
+        coarse = [t for t in sweep.columns if round(t * 10, 6).is_integer()]
+        table = pd.concat([table, sweep[coarse].rename(columns=lambda t: f"≥ {t:.1f}").reset_index(drop=True)], axis=1)
+        st.dataframe(table, column_config={"threshold": st.column_config.NumberColumn(format="%.2f")},
+                     hide_index=True, width="stretch")
+        st.download_button(
+            "Download thresholds",
+            data=pd.DataFrame({"species": list(confidence_thresholds), "threshold": list(confidence_thresholds.values())})
+                   .to_csv(index=False),
+            file_name=f"{profile}.csv",
+            mime="text/csv",
+            on_click="ignore",
+            help="Thresholds of the profile with the changes made in this session, as a species_confidence CSV"
+        )
 
     @staticmethod
-    def display_audio_and_spectrogram(filename: str, prediction_time: float, prediction_duration: float):
-        if not AudioProcessor.download_and_cache_audio(filename):
+    def display_audio_and_spectrogram(filename: str, prediction_time: float, prediction_duration: float,
+                                      station: Optional[str] = None):
+        audio_key = AudioCache.key(filename, station)
+        window = (prediction_time, prediction_duration)
+        if not AudioProcessor.download_and_cache_audio(filename, station, window):
             warn = st.warning("Audio download failed. Check connection or try again.")
-            retry = st.button("Retry download", key=f"retry_{filename}", help="Attempt to download audio again")
+            retry = st.button("Retry download", key=f"retry_{audio_key}", help="Attempt to download audio again")
             if retry:
-                if AudioProcessor.download_and_cache_audio(filename):
+                if AudioProcessor.download_and_cache_audio(filename, station, window):
                     st.rerun()
                 else:
                     st.error("Retry failed. Please try later.")
             return
         
-        file_path = AudioProcessor.get_cached_audio_path(filename)
-        
         try:
-            audio_data = file_path.read_bytes()
-            trimmed_audio_buffer = AudioProcessor.extract_audio_segment(audio_data)
+            clip = AudioProcessor.load_clip(filename, prediction_time, prediction_duration, station=station)
             
-            st.text(f"Audio name: {filename}.wav")
-            st.audio(trimmed_audio_buffer, format="audio/wav")
+            st.text(f"Audio name: {filename}.wav" + (f" ({station})" if len(Config.STATIONS) > 1 else ""))
+            # Opus copy of the whole recording played over the window, the clip as WAV without one
+            playback_path = AudioCache.playback_path(filename, station)
+            if playback_path is not None:
+                st.audio(playback_path.read_bytes(), format="audio/ogg",
+                         start_time=clip.offset, end_time=clip.offset + clip.duration)
+            else:
+                st.audio(AudioProcessor.encode_wav(clip), format="audio/wav")
         
             with st.spinner("Spectrogram generation..."):
-                fig = SpectrogramGenerator.create_spectrogram_xc(trimmed_audio_buffer, prediction_time, prediction_duration)
-                st.pyplot(fig)
-                plt.close(fig) 
+                if Config.SPECTROGRAM_RENDERER == "raster":
+                    spectrogram = SpectrogramCache.get_or_compute(audio_key, clip)
+                    st.image(
+                        SpectrogramGenerator.render_spectrogram_raster(spectrogram, prediction_time, prediction_duration),
+                        caption=f"0–{spectrogram.freqs.max():.0f} Hz, {spectrogram.times.min():.1f}–{spectrogram.times.max():.1f} s",
+                        width="stretch"
+                    )
+                elif Config.SPECTROGRAM_CACHE_PNG:
+                    st.image(SpectrogramCache.get_png(audio_key, clip, prediction_time, prediction_duration), width="stretch")
+                else:
+                    import matplotlib.pyplot as plt
+                    spectrogram = SpectrogramCache.get_or_compute(audio_key, clip)
+                    fig = SpectrogramGenerator.render_spectrogram(spectrogram, prediction_time, prediction_duration)
+                    st.pyplot(fig)
+                    plt.close(fig) 
                     
         except Exception as e:
             st.error(f"Audio processing error: {e}")
 
     @staticmethod
-    def display_detections_table(df: pd.DataFrame):
-        if df.empty:
+    def display_export(selection: Selection, start_date, end_date):
+        """Bulk export of the clips of the shown detections to Config.EXPORT_DIR, resumed if interrupted"""
+        archive = Config.EXPORT_DIR / f"detections_{start_date}_{end_date}.zip"
+        padding = f"±{Config.AUDIO_CLIP_PADDING:g} s around each detection" if Config.AUDIO_CLIP_PADDING is not None \
+            else "whole recordings"
+        st.caption(f"{len(selection)} clips of the detections shown ({padding}) with a manifest, to {archive}")
+        if not st.button("📦 Export clips", key="export_clips"):
+            return
+        bar = st.progress(0.0, text="Exporting...")
+        result = AudioExporter.export(
+            selection.frame(), archive, progress=lambda done, total: bar.progress(done / max(total, 1), text=f"{done}/{total} recordings")
+        )
+        if result.failed:
+            st.warning(f"{len(result.failed)} recordings could not be downloaded, export again to retry them.")
+        st.success(f"{result.clips} clips saved to {result.archive}")
+
+    @staticmethod
+    def display_rerun_timings(summary):
+        if not summary:
+            st.info("No timings recorded yet")
+            return
+        st.caption(f"Last rerun: **{summary['total_seconds'] * 1000:.0f} ms**")
+        fragment_runs = [run for run in Instrumentation.log() if "fragment" in run]
+        if fragment_runs:
+            st.caption(f"Last rerun of {fragment_runs[-1]['fragment']} alone: "
+                       f"**{fragment_runs[-1]['total_seconds'] * 1000:.0f} ms** ({len(fragment_runs)} in the log)")
+        stages = pd.DataFrame.from_dict(summary["stages"], orient="index").fillna(0)
+        stages = stages.sort_values("seconds", ascending=False)
+        stages["ms"] = stages.pop("seconds") * 1000
+        if "bytes" in stages:
+            stages["KB"] = stages.pop("bytes") / 1024
+        st.dataframe(
+            stages,
+            column_config={
+                "ms": st.column_config.NumberColumn(format="%.1f"),
+                "KB": st.column_config.NumberColumn(format="%.1f"),
+            },
+            width="stretch"
+        )
+        st.download_button(
+            "Export log",
+            data=Instrumentation.export_log(),
+            file_name="rerun_timings.jsonl",
+            mime="application/json",
+            on_click="ignore",
+            width="stretch"
+        )
+
+    @staticmethod
+    @instrumented("ui.table_styling")
+    def build_detections_table(df: pd.DataFrame) -> Styler:
+        """Styled table of the given rows (one page), display values are derived here from the compact columns"""
+        display_df = pd.DataFrame({
+            'date': df['datetime'].dt.date,
+            'time': df['datetime'].dt.time,
+            'duration': df['duration'].astype(int),
+            'species': df['species_display'] if 'species_display' in df else df['species'].astype(str).str.replace('_', ', '),
+            'confidence': df['confidence'].astype(float),
+            'threshold': df['threshold'],
+            'confidence_level': df['confidence_level'].astype(str),
+            'filename': df['filename'],
+        })
+        if 'station' in df and len(df['station'].cat.categories) > 1:
+            display_df.insert(0, 'station', df['station'].astype(str))
+        return (
+            display_df.style
+            .format("{:.3f}", subset=["confidence", "threshold"])
+            .map(UIComponents._color_confidence_level, subset=['confidence_level'])
+        )
+
+    @staticmethod
+    def _clear_table_selection():
+        if 'detections_table' in st.session_state:
+            try:
+                st.session_state.detections_table.selection.rows = []
+            except Exception:
+                st.session_state.pop('detections_table', None)
+
+    @staticmethod
+    def _on_table_view_change():
+        # a new order or filter: back to the first page, the selected row is not on it anymore
+        st.session_state.table_page = 1
+        UIComponents._clear_table_selection()
+
+    @staticmethod
+    def _table_order(selection: Selection, sort_by: str, descending: bool, species: tuple) -> np.ndarray:
+        """
+        Row positions of the selection in the requested order, restricted to
+        `species`. Kept in session state for the selection it was computed
+        on, so changing page does not sort again.
+        """
+        cached = st.session_state.get("table_order")
+        if cached is not None and cached[0] is selection and cached[1] == (sort_by, descending, species):
+            return cached[2]
+
+        keys = selection.column(TABLE_SORT_COLUMNS[sort_by])
+        if species:
+            positions = np.flatnonzero(selection.column("species_display").isin(species).to_numpy())
+            keys = keys.iloc[positions]
+        else:
+            positions = np.arange(len(selection))
+        values = keys.to_numpy()
+        if values.dtype == object:
+            values = pd.factorize(values, sort=True)[0]     # integer codes sort much faster than strings
+
+        # stable both ways: ties keep the table order, most recent first
+        if descending:
+            order = len(values) - 1 - np.argsort(values[::-1], kind="stable")[::-1]
+        else:
+            order = np.argsort(values, kind="stable")
+        order = positions[order]
+        st.session_state.table_order = (selection, (sort_by, descending, species), order)
+        return order
+
+    @staticmethod
+    def _table_page(selection: Selection) -> pd.DataFrame:
+        """Sort, filter and page controls (state in st.session_state), returns the frame of the current page"""
+        col1, col2, col3, col4 = st.columns([2, 3, 1, 1])
+        with col1:
+            sort_by = st.selectbox("Sort by", list(TABLE_SORT_COLUMNS), key="table_sort_by",
+                                   on_change=UIComponents._on_table_view_change)
+            descending = st.toggle("Descending", value=True, key="table_descending",
+                                   on_change=UIComponents._on_table_view_change)
+        with col2:
+            species = st.multiselect("Species", sorted(selection.column("species_display").unique()), key="table_species",
+                                     placeholder="All species", on_change=UIComponents._on_table_view_change)
+        order = UIComponents._table_order(selection, sort_by, descending, tuple(species))
+
+        with col3:
+            page_size = st.selectbox("Rows per page", Config.TABLE_PAGE_SIZES, key="table_page_size",
+                                     index=Config.TABLE_PAGE_SIZES.index(Config.TABLE_PAGE_SIZE),
+                                     on_change=UIComponents._on_table_view_change)
+        n_pages = max(-(-len(order) // page_size), 1)
+        if st.session_state.get("table_page", 1) > n_pages:
+            st.session_state.table_page = n_pages   # fewer rows after a refresh
+        with col4:
+            page = st.number_input(f"Page (of {n_pages})", min_value=1, max_value=n_pages, key="table_page",
+                                   on_change=UIComponents._clear_table_selection)
+        st.caption(f"{len(order)} detections")
+        return selection.frame(order[(page - 1) * page_size:page * page_size])
+
+    @staticmethod
+    @instrumented("ui.table")
+    def display_detections_table(selection: Selection, paginated: bool = True, max_rows: int = None):
+        """
+        Detections table with single row selection. Paginated, only the rows
+        of the current page are built, styled and sent to the browser;
+        otherwise the first `max_rows` rows are. Returns the selected
+        detection or None.
+        """
+        if not len(selection):
             st.info("Nessun rilevamento per questa data.")
             return None
-        
-        # Prepara i dati per la visualizzazione
-        display_df = df[['date', 'time', 'duration', 'species', 'confidence', 'threshold', 'confidence_level', 'filename']].copy()
-        display_df['duration'] = display_df['duration'].astype(int)
-        display_df['confidence'] = display_df['confidence'].round(3).map('{:.3f}'.format)
-        display_df['threshold'] = display_df['threshold'].round(3).map('{:.3f}'.format)
-        display_df['species'] = display_df['species'].str.replace('_', ', ')
-        styled_df = display_df.style.map(UIComponents._color_confidence_level, subset=['confidence_level'])
+
+        page_df = UIComponents._table_page(selection) if paginated else selection.frame(slice(0, max_rows))
+        styled_df = UIComponents.build_detections_table(page_df)
 
         st.dataframe(
             styled_df,
@@ -81,51 +356,68 @@ class UIComponents:
             width='stretch'
         )
         
+        # warm the audio cache for the rows on top of the table
+        top = page_df.head(Config.AUDIO_PREFETCH_ROWS)
+        prediction_times = top["start_time"].to_numpy(dtype=np.int64) - top["filename"].to_numpy(dtype=np.int64)
+        AudioPrefetcher.prefetch(top["filename"], top["station"].astype(str) if "station" in top else None,
+                                 zip(prediction_times, top["duration"].to_numpy()))
+
         # handle selection
         selected_rows = []
         table_state = st.session_state.get('detections_table')
         if table_state is not None:
             selected_rows = getattr(getattr(table_state, 'selection', None), 'rows', [])
         
-        if selected_rows:
+        if selected_rows and selected_rows[0] < len(page_df):
             selected_index = selected_rows[0]
             return {
-                'filename': int(df.iloc[selected_index]["filename"]),
-                "start_time": int(df.iloc[selected_index]["start_time"]),
-                "duration": int(df.iloc[selected_index]["duration"])
+                'filename': int(page_df.iloc[selected_index]["filename"]),
+                "start_time": int(page_df.iloc[selected_index]["start_time"]),
+                "duration": int(page_df.iloc[selected_index]["duration"]),
+                "station": str(page_df.iloc[selected_index]["station"]) if "station" in page_df else None,
             }
         return None
 
     @staticmethod
-    def display_species_confidence_slider(confidence_thresholds: Dict[str, float] = {}):
+    @instrumented("ui.threshold_sliders")
+    def display_species_confidence_slider(confidence_thresholds: Dict[str, float] = {}, profile: str = "default"):
+        """
+        Thresholds of the profile with the user's changes applied. Changes are
+        kept per profile in st.session_state.threshold_overrides, so the
+        sliders are only built while editing is switched on.
+        """
+        overrides = st.session_state.setdefault("threshold_overrides", {}).setdefault(profile, {})
+        modified_thresholds = {**confidence_thresholds, **overrides}
+
+        def keep_override(species):
+            overrides[species] = st.session_state[f"slider_{profile}_{species}"]
+
         with st.expander("Modify confidence thresholds per species"):
+            col_edit, col_reset = st.columns([3, 1])
+            editing = col_edit.toggle("Edit thresholds", key="edit_thresholds",
+                                      help=f"{len(overrides)} thresholds changed from profile '{profile}'")
+            if col_reset.button("Reset", disabled=not overrides, width="stretch"):
+                overrides.clear()
+                for species in confidence_thresholds:
+                    st.session_state.pop(f"slider_{profile}_{species}", None)
+                modified_thresholds = dict(confidence_thresholds)
+            if not editing:
+                return modified_thresholds
+
             col1, col2 = st.columns(2)      # divide in two columns 
-            modified_thresholds = {}
-            for i, (species, threshold) in enumerate(confidence_thresholds.items()):
+            for i, species in enumerate(confidence_thresholds):
                 formatted_name = species.replace("_", ", " if species.split("_")[1] else "")
-                if i < len(confidence_thresholds) / 2:
-                    with col1:
-                        modified_value = st.slider(
-                            label=f"Threshold for **{formatted_name}**",
-                            min_value=0.0,
-                            max_value=1.0,
-                            value=float(threshold),
-                            step=0.01,
-                            key=f"slider_{species}",
-                        )
-                        modified_thresholds[species] = modified_value
-
-                else:
-                    with col2:
-                        modified_value = st.slider(
-                            label=f"Threshold for **{formatted_name}**",
-                            min_value=0.0,
-                            max_value=1.0,
-                            value=float(threshold),
-                            step=0.01,
-                            key=f"slider_{species}"
-                        )
-                        modified_thresholds[species] = modified_value
+                with col1 if i < len(confidence_thresholds) / 2 else col2:
+                    st.slider(
+                        label=f"Threshold for **{formatted_name}**",
+                        min_value=0.0,
+                        max_value=1.0,
+                        value=float(modified_thresholds[species]),
+                        step=0.01,
+                        key=f"slider_{profile}_{species}",
+                        on_change=keep_override,
+                        args=(species,),
+                    )
         return modified_thresholds
     
     @staticmethod
@@ -1,14 +1,25 @@
-from config import Config
+from instrumentation import instrumented
+from audio_cache import AudioCache
+from audio_segments import AudioSegments
+from threshold_registry import ThresholdRegistry
 import streamlit as st
 import pandas as pd
+import numpy as np
+
+# ordered from worst to best, upper bounds are the deviation percentages below
+CONFIDENCE_LEVELS = ['very_low', 'low', 'medium', 'high', 'very_high']
+CONFIDENCE_LEVEL_BOUNDS = [-15, -5, 5, 15]
+# detections kept are at or above their threshold (deviation >= 0): the levels a filter can offer
+KEPT_CONFIDENCE_LEVELS = [level for level, bound in zip(CONFIDENCE_LEVELS, CONFIDENCE_LEVEL_BOUNDS + [float("inf")])
+                          if bound >= 0]
 
 class Utils:
     @staticmethod
     def clear_audio_cache():
-        """Pulisce la cache audio"""
+        """Pulisce la cache audio: registrazioni intere e segmenti, con i loro spettrogrammi"""
         try:
-            for file_path in Config.AUDIO_CACHE_DIR.glob("*.wav"):
-                file_path.unlink()
+            AudioCache.clear()
+            AudioSegments.clear()
             st.session_state.audio_cache = {}
             st.success("Cache audio pulita!")
         except Exception as e:
@@ -30,18 +41,32 @@ class Utils:
             return 'very_high'
 
     @staticmethod
+    @instrumented("confidence_levels")
     def add_confidence_level_column(df, confidence_thresholds):
-        df_copy = df.copy()
-        df_copy["confidence_level"] = df_copy.apply(
-            lambda row: Utils.calculate_confidence_level(
-                row["confidence"],
-                confidence_thresholds.get(row["species"], Config.DEFAULT_THRESHOLD_VALUE)
-            ),
-            axis=1
-        )
-        df_copy["threshold"] = df_copy.apply(
-            lambda row: confidence_thresholds.get(row["species"], Config.DEFAULT_THRESHOLD_VALUE),
-            axis=1
-        )
-        return df_copy
+        """
+        Aggiunge le colonne 'confidence_level' e 'threshold' (in place, senza copia).
+
+        Vectorized version of calculate_confidence_level: thresholds indexed
+        by species code (ThresholdRegistry), one array expression for the
+        deviation and np.select for the binning.
+        """
+        if "species" not in df.columns:
+            df["confidence_level"] = pd.Series(dtype=pd.CategoricalDtype(CONFIDENCE_LEVELS))
+            df["threshold"] = pd.Series(dtype=float)
+            return df
 
+        thresholds = ThresholdRegistry.lookup(df, confidence_thresholds)
+        level_codes = Utils.confidence_level_codes(df["confidence"].to_numpy(dtype=float), thresholds)
+        df["confidence_level"] = pd.Categorical.from_codes(level_codes, CONFIDENCE_LEVELS)
+        df["threshold"] = thresholds
+        return df
+
+    @staticmethod
+    def confidence_level_codes(confidences: np.ndarray, thresholds) -> np.ndarray:
+        """Index in CONFIDENCE_LEVELS of every confidence, given its threshold (an array or a single value)"""
+        deviation_percentage = ((confidences - thresholds) / thresholds) * 100
+        return np.select(
+            [deviation_percentage <= bound for bound in CONFIDENCE_LEVEL_BOUNDS],
+            range(len(CONFIDENCE_LEVEL_BOUNDS)),
+            default=len(CONFIDENCE_LEVEL_BOUNDS)
+        ).astype(np.int8)